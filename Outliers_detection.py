@@ -0,0 +1,254 @@
+#%%
+# IQR based outlier limits and clipping, shared by file_main.py and new_main.py.
+#
+# find_limits computes the quartiles of every variable in one batched call.
+# For data that does not fit in memory, QuantileSketch keeps a small mergeable summary
+# of each column (a KLL sketch) that can be updated chunk by chunk or merged across
+# partitions, and find_limits_streaming builds the same limits from those sketches.
+# Clipper keeps the fitted limits, so the training time limits can be applied to test
+# or production data.
+
+import json
+import math
+
+import numpy as np
+
+
+#%%
+
+#calculates the lower and upper limits for each specified variable in a dataset based on the interquartile range (IQR) and a given fold value.
+#The purpose of finding these limits is often related to identifying and handling outliers in the data.
+
+def limits_from_quartiles(q1, q3, fold):
+    IQR = q3 - q1
+    return q1 - (IQR * fold), q3 + (IQR * fold)
+
+
+def find_limits(data, variables, fold):
+    quartiles = data[list(variables)].quantile([0.25, 0.75])
+    limits = dict()
+    for variable in variables:
+        limits[variable] = limits_from_quartiles(quartiles.at[0.25, variable], quartiles.at[0.75, variable], fold)
+    return limits
+
+
+#%%
+
+# Approximate quantiles of a stream of values with bounded memory (KLL sketch).
+#
+# Values are kept in levels of sorted "compactors"; an item on level h stands for 2**h
+# original values. When a level is over its capacity it is sorted and every other item
+# (random offset) is promoted to the next level, so memory stays around 3 * k items
+# whatever the number of values seen. Two sketches built on different chunks or
+# partitions can be merged, and the result has the same guarantees as one sketch built
+# on all the data.
+#
+# rank_error() is the normalized rank error that holds with 99% confidence: the value
+# returned for quantile q has a true rank within [q - eps, q + eps].
+# It uses the empirical formula of the Apache DataSketches KLL implementation
+# (about 1.3% for the default k=200).
+
+class QuantileSketch:
+
+    def __init__(self, k=200, seed=None):
+        self.k = k
+        self.n = 0
+        self.min = math.inf
+        self.max = -math.inf
+        self.levels = [np.empty(0)]
+        self._rng = np.random.default_rng(seed)
+
+    def _capacity(self, level):
+        depth = len(self.levels) - level - 1
+        return max(int(math.ceil(self.k * (2 / 3) ** depth)), 2)
+
+    def _compact(self, level):
+        items = np.sort(self.levels[level])
+        if level + 1 == len(self.levels):
+            self.levels.append(np.empty(0))
+        # An odd item stays on its level
+        keep = items[:len(items) % 2]
+        promoted = items[len(keep):][self._rng.integers(2)::2]
+        self.levels[level] = keep
+        self.levels[level + 1] = np.concatenate([self.levels[level + 1], promoted])
+
+    def _compress(self):
+        level = 0
+        while level < len(self.levels):
+            if len(self.levels[level]) > self._capacity(level):
+                self._compact(level)
+                # Adding a level lowers the capacity of all the others
+                level = 0
+            else:
+                level += 1
+
+    def update(self, values):
+        values = np.asarray(values, dtype=np.float64).ravel()
+        values = values[~np.isnan(values)]
+        if len(values) == 0:
+            return self
+        self.n += len(values)
+        self.min = min(self.min, values.min())
+        self.max = max(self.max, values.max())
+        self.levels[0] = np.concatenate([self.levels[0], values])
+        self._compress()
+        return self
+
+    def merge(self, other):
+        if other.k != self.k:
+            raise ValueError('Cannot merge sketches with different k ({} and {})'.format(self.k, other.k))
+        while len(self.levels) < len(other.levels):
+            self.levels.append(np.empty(0))
+        for level, items in enumerate(other.levels):
+            self.levels[level] = np.concatenate([self.levels[level], items])
+        self.n += other.n
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self._compress()
+        return self
+
+    def quantile(self, q):
+        if self.n == 0:
+            raise ValueError('Empty sketch')
+        items = np.concatenate(self.levels)
+        weights = np.concatenate([np.full(len(level_items), 2 ** level) for level, level_items in enumerate(self.levels)])
+        order = np.argsort(items, kind='stable')
+        items = items[order]
+        cumulative = np.cumsum(weights[order]) / weights.sum()
+
+        q = np.asarray(q, dtype=np.float64)
+        result = items[np.minimum(np.searchsorted(cumulative, q, side='left'), len(items) - 1)]
+        # The extremes are tracked exactly
+        result = np.where(q <= 0, self.min, np.where(q >= 1, self.max, result))
+        return result if result.ndim else float(result)
+
+    def rank_error(self):
+        return 2.296 / self.k ** 0.9723
+
+    # Range of values that contains the true q quantile with 99% confidence
+
+    def quantile_bounds(self, q):
+        eps = self.rank_error()
+        return self.quantile(max(q - eps, 0.0)), self.quantile(min(q + eps, 1.0))
+
+    def __len__(self):
+        return sum(len(items) for items in self.levels)
+
+
+#%%
+
+# IQR limits over a stream of frames (e.g. trip_loader.iter_trips), one sketch per variable.
+# Returns the limits and the sketches, which can be merged with sketches of other
+# partitions or updated with more chunks later.
+
+def sketch_limits(sketches, fold):
+    limits = dict()
+    for variable, sketch in sketches.items():
+        q1, q3 = sketch.quantile([0.25, 0.75])
+        limits[variable] = limits_from_quartiles(q1, q3, fold)
+    return limits
+
+
+def find_limits_streaming(chunks, variables, fold, k=200, seed=None):
+    sketches = {variable: QuantileSketch(k=k, seed=seed) for variable in variables}
+    for chunk in chunks:
+        for variable, sketch in sketches.items():
+            sketch.update(chunk[variable].values)
+    return sketch_limits(sketches, fold), sketches
+
+
+#%%
+
+#The purpose of the Clipper is to enforce constraints on the values of specific variables, ensuring that they fall within a predefined range.
+#This is often done to mitigate the impact of outliers or extreme values on statistical analyses, modeling, or visualization.
+# It provides a way to handle values that are deemed too extreme without removing them entirely from the dataset.
+#
+# fit() finds the IQR limits of `variables` on the training data (partial_fit() does the same
+# chunk by chunk with QuantileSketch), transform() clips the frame it is given in place,
+# one column at a time, into the column's own buffer, so nothing is allocated. The limits are
+# cast to the dtype of the column (rounded inwards for integer columns), so every column keeps
+# its dtype. Columns other than the clipped ones are never touched. The limits can be saved
+# to / loaded from a json file and reapplied to new data.
+#
+# clip_counts_ holds, for the last transform, the number of values raised to the lower
+# limit and lowered to the upper limit in each column.
+
+# Limits of a column of the given dtype: the same dtype, the float limits rounded inwards
+# (and within the range of the dtype) for integers
+
+def _dtype_limits(dtype, lower, upper):
+    if dtype.kind not in 'iu':
+        return dtype.type(lower), dtype.type(upper)
+    info = np.iinfo(dtype)
+    lower, upper = math.ceil(max(lower, info.min)), math.floor(min(upper, info.max))
+    if lower > upper:
+        # Both limits between the same two integers
+        lower = upper = round((lower + upper) / 2)
+    return dtype.type(lower), dtype.type(upper)
+
+
+class Clipper:
+
+    def __init__(self, variables=None, fold=1.5, limits=None):
+        self.variables = list(variables) if variables is not None else list(limits or [])
+        self.fold = fold
+        self.limits_ = dict(limits) if limits is not None else None
+        self.sketches_ = None
+        self.clip_counts_ = {}
+
+    def fit(self, data):
+        self.limits_ = find_limits(data, self.variables, self.fold)
+        return self
+
+    def partial_fit(self, chunk, k=200, seed=None):
+        if self.sketches_ is None:
+            self.sketches_ = {variable: QuantileSketch(k=k, seed=seed) for variable in self.variables}
+        for variable, sketch in self.sketches_.items():
+            sketch.update(chunk[variable].values)
+        self.limits_ = sketch_limits(self.sketches_, self.fold)
+        return self
+
+    # `columns` restricts the clipping to a subset of the fitted variables
+
+    def transform(self, data, columns=None):
+        if self.limits_ is None:
+            raise ValueError('Clipper is not fitted yet, call fit() first')
+        columns = self.variables if columns is None else columns
+        clip_counts = {}
+        for variable in columns:
+            values = data[variable].to_numpy()
+            lower_limit, upper_limit = _dtype_limits(values.dtype, *self.limits_[variable])
+            below = int(np.count_nonzero(values < lower_limit))
+            above = int(np.count_nonzero(values > upper_limit))
+            if below or above:
+                if values.flags.writeable and values.dtype == data[variable].dtype:
+                    np.clip(values, lower_limit, upper_limit, out=values)
+                else:
+                    # Read-only buffer (copy-on-write pandas, the default from pandas 3, hands out
+                    # read-only views; columns memory-mapped by feature_cache.py) or a converted
+                    # copy of an extension column: the column is replaced by a clipped copy
+                    data[variable] = np.clip(values, lower_limit, upper_limit)
+            clip_counts[variable] = (below, above)
+        self.clip_counts_ = clip_counts
+        return data
+
+    def fit_transform(self, data):
+        return self.fit(data).transform(data)
+
+    def to_dict(self):
+        return {'variables': self.variables, 'fold': self.fold,
+                'limits': {variable: [float(lower), float(upper)] for variable, (lower, upper) in self.limits_.items()}}
+
+    @classmethod
+    def from_dict(cls, params):
+        limits = {variable: tuple(bounds) for variable, bounds in params['limits'].items()}
+        return cls(params['variables'], fold=params['fold'], limits=limits)
+
+    def save(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.to_dict(), f, indent=2)
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            return cls.from_dict(json.load(f))
@@ -0,0 +1,254 @@
+#%%
+# Historical traffic features: aggregates of past trips keyed by (pickup cell, weekday, hour),
+# looked up for every trip to score or to train on.
+#
+# The aggregates are not stored as values but as histograms in dense arrays, one row per key:
+#   - durations: log-spaced bins from 10 s to ~6 h
+#   - speeds: log-spaced bins from 0.5 to 100 km/h
+# Histograms add up, so new trips are counted in with update() (or merge() of a store built
+# on another partition) without going over the old trips again, and the out-of-fold features
+# of a training set are the histograms of all the rows minus the ones of the row's own fold
+# (its own target never reaches its features).
+#
+# The features (FEATURE_NAMES) are read from the histograms: trip count, median speed and
+# quartiles of the duration. Keys with few trips are smoothed towards the (weekday, hour)
+# histogram of the whole city, prior_weight trips of it are added to every key.
+# lookup() computes the table of all the keys once (a few ms), then every lookup is an array
+# index per trip.
+#
+# The spatial key is a cell of a regular lat/long grid over NYC_BOUNDS (cell_size degrees,
+# trips outside the box share one extra cell), or with centers (e.g. the cluster_centers_ of
+# TripPreprocessor, as longitude, latitude) the closest center.
+#
+# TripPreprocessor(aggregate_store=AggregateStore()) fills a store in fit() and appends its
+# features to the ones it gives to the model, so the scoring path (predict.py, scoring_service.py)
+# looks the trips up in the store saved with the preprocessor.
+
+import math
+
+import numpy as np
+
+from preprocessing_pipeline import TARGET, feature_arrays
+from trip_features import NYC_BOUNDS, nearest_center
+
+
+FEATURE_NAMES = ['store_trip_count', 'store_median_speed', 'store_duration_q25', 'store_duration_median',
+                 'store_duration_q75']
+
+HOURS_PER_WEEK = 7 * 24
+
+DURATION_EDGES = np.geomspace(10, 20000, 41)
+
+SPEED_EDGES = np.geomspace(0.5, 100, 33)
+
+
+#%%
+
+def _bins(values, edges):
+    # Values outside the edges counted in the first / last bin
+    return np.clip(np.searchsorted(edges, values, side='right') - 1, 0, len(edges) - 2)
+
+
+# q quantile of every row of a histogram matrix, interpolated linearly in log space within the bin
+
+def _histogram_quantile(histograms, edges, q):
+    cumulative = np.cumsum(histograms, axis=1)
+    total = cumulative[:, -1]
+    target = q * total
+    index = np.minimum((cumulative < target[:, None]).sum(axis=1), histograms.shape[1] - 1)
+    rows = np.arange(len(histograms))
+    before = np.where(index > 0, cumulative[rows, np.maximum(index - 1, 0)], 0)
+    counts = histograms[rows, index]
+    fraction = np.divide(target - before, counts, out=np.zeros_like(target), where=counts > 0)
+    log_edges = np.log(edges)
+    values = np.exp(log_edges[index] + fraction * (log_edges[index + 1] - log_edges[index]))
+    return np.where(total > 0, values, np.nan)
+
+
+#%%
+
+class AggregateStore:
+
+    def __init__(self, cell_size=0.02, bounds=NYC_BOUNDS, centers=None, prior_weight=20):
+        self.cell_size = cell_size
+        self.bounds = tuple(bounds)
+        self.centers = None if centers is None else np.asarray(centers, dtype=np.float64)
+        self.prior_weight = prior_weight
+        long_min, lat_min, long_max, lat_max = self.bounds
+        self._rows = int(np.ceil((lat_max - lat_min) / cell_size))
+        self._columns = int(np.ceil((long_max - long_min) / cell_size))
+        self.duration_counts = np.zeros((self.n_keys, len(DURATION_EDGES) - 1), dtype=np.int32)
+        self.speed_counts = np.zeros((self.n_keys, len(SPEED_EDGES) - 1), dtype=np.int32)
+        self._table = None
+
+    @property
+    def n_cells(self):
+        if self.centers is not None:
+            return len(self.centers)
+        return self._rows * self._columns + 1
+
+    @property
+    def n_keys(self):
+        return self.n_cells * HOURS_PER_WEEK
+
+    @property
+    def n_trips(self):
+        return int(self.duration_counts.sum())
+
+    def cells(self, latitudes, longitudes):
+        latitudes = np.asarray(latitudes, dtype=np.float64)
+        longitudes = np.asarray(longitudes, dtype=np.float64)
+        if self.centers is not None:
+            return nearest_center(latitudes, longitudes, self.centers).astype(np.int64)
+        long_min, lat_min, long_max, lat_max = self.bounds
+        rows = np.floor((latitudes - lat_min) / self.cell_size).astype(np.int64)
+        columns = np.floor((longitudes - long_min) / self.cell_size).astype(np.int64)
+        inside = (rows >= 0) & (rows < self._rows) & (columns >= 0) & (columns < self._columns)
+        return np.where(inside, rows * self._columns + columns, self.n_cells - 1)
+
+    # Same cell for one point, with scalar math (the grid or the centers of cells())
+
+    def cell_one(self, latitude, longitude):
+        if self.centers is not None:
+            distances = [(longitude - center_longitude) ** 2 + (latitude - center_latitude) ** 2
+                         for center_longitude, center_latitude in self.centers.tolist()]
+            return distances.index(min(distances))
+        long_min, lat_min, long_max, lat_max = self.bounds
+        row = math.floor((latitude - lat_min) / self.cell_size)
+        column = math.floor((longitude - long_min) / self.cell_size)
+        if 0 <= row < self._rows and 0 <= column < self._columns:
+            return row * self._columns + column
+        return self.n_cells - 1
+
+    def keys(self, latitudes, longitudes, weekdays, hours):
+        weekdays = np.asarray(weekdays, dtype=np.int64)
+        hours = np.asarray(hours, dtype=np.int64)
+        return self.cells(latitudes, longitudes) * HOURS_PER_WEEK + weekdays * 24 + hours
+
+    # Histograms of the given trips, as (n_keys, n_bins) count arrays
+
+    def _counts(self, keys, durations, distances):
+        durations = np.asarray(durations, dtype=np.float64)
+        speeds = 3600 * np.asarray(distances, dtype=np.float64) / np.maximum(durations, 1)
+        n_duration_bins = len(DURATION_EDGES) - 1
+        n_speed_bins = len(SPEED_EDGES) - 1
+        duration_counts = np.bincount(keys * n_duration_bins + _bins(durations, DURATION_EDGES),
+                                      minlength=self.n_keys * n_duration_bins).reshape(self.n_keys, -1)
+        speed_counts = np.bincount(keys * n_speed_bins + _bins(speeds, SPEED_EDGES),
+                                   minlength=self.n_keys * n_speed_bins).reshape(self.n_keys, -1)
+        return duration_counts.astype(np.int32), speed_counts.astype(np.int32)
+
+    def update(self, latitudes, longitudes, weekdays, hours, durations, distances):
+        duration_counts, speed_counts = self._counts(self.keys(latitudes, longitudes, weekdays, hours),
+                                                     durations, distances)
+        self.duration_counts += duration_counts
+        self.speed_counts += speed_counts
+        self._table = None
+        return self
+
+    # Trips of a frame (raw trips or with the trip_features columns) with their duration in `target`
+
+    def update_frame(self, data, target=TARGET):
+        columns = feature_arrays(data)
+        return self.update(columns['pickup_latitude'], columns['pickup_longitude'], columns['weekday'],
+                           columns['hour'], np.asarray(data[target]), columns['trip_distance(km)'])
+
+    def clear(self):
+        self.duration_counts[:] = 0
+        self.speed_counts[:] = 0
+        self._table = None
+        return self
+
+    def merge(self, other):
+        same_centers = (self.centers is None and other.centers is None) or (
+            self.centers is not None and other.centers is not None and np.array_equal(self.centers, other.centers))
+        if not same_centers or (other.n_keys, other.cell_size, other.bounds) != (self.n_keys, self.cell_size,
+                                                                                  self.bounds):
+            raise ValueError('Cannot merge stores with different keys')
+        self.duration_counts += other.duration_counts
+        self.speed_counts += other.speed_counts
+        self._table = None
+        return self
+
+    # Features of the given keys from the histograms (duration_counts, speed_counts) of all the keys
+
+    def _features(self, keys, duration_counts, speed_counts):
+        features = np.empty((len(keys), len(FEATURE_NAMES)), dtype=np.float32)
+        features[:, 0] = duration_counts[keys].sum(axis=1)
+
+        # Histogram of each key plus prior_weight trips of the (weekday, hour) histogram of the city
+        weekly_hours = keys % HOURS_PER_WEEK
+        column = 1
+        for counts, edges, quantiles in [(speed_counts, SPEED_EDGES, [0.5]),
+                                         (duration_counts, DURATION_EDGES, [0.25, 0.5, 0.75])]:
+            city = counts.reshape(-1, HOURS_PER_WEEK, counts.shape[1]).sum(axis=0).astype(np.float64)
+            city_totals = city.sum(axis=1, keepdims=True)
+            prior = np.divide(city, city_totals, out=np.zeros_like(city), where=city_totals > 0)
+            histograms = counts[keys] + self.prior_weight * prior[weekly_hours]
+            for q in quantiles:
+                features[:, column] = _histogram_quantile(histograms, edges, q)
+                column += 1
+        return features
+
+    def table(self):
+        if self._table is None:
+            self._table = self._features(np.arange(self.n_keys), self.duration_counts, self.speed_counts)
+        return self._table
+
+    # (n_trips, len(FEATURE_NAMES)) float32 features of trips, one table lookup per trip
+
+    def lookup(self, latitudes, longitudes, weekdays, hours):
+        return self.table()[self.keys(latitudes, longitudes, weekdays, hours)]
+
+    # Features of one trip (a row of the table), for the scalar scoring path
+
+    def lookup_one(self, latitude, longitude, weekday, hour):
+        return self.table()[self.cell_one(latitude, longitude) * HOURS_PER_WEEK + int(weekday) * 24 + int(hour)]
+
+    def lookup_frame(self, data):
+        columns = feature_arrays(data)
+        return self.lookup(columns['pickup_latitude'], columns['pickup_longitude'], columns['weekday'],
+                           columns['hour'])
+
+    # Features of training trips that are also in the store, each computed without the trips of
+    # its own fold (random folds of the rows, n_folds of them). As in table(), the features of a
+    # fold are computed once per key and then looked up by the rows, the histograms are never
+    # built per row.
+
+    def out_of_fold(self, latitudes, longitudes, weekdays, hours, durations, distances, n_folds=5, random_state=42):
+        keys = self.keys(latitudes, longitudes, weekdays, hours)
+        durations = np.asarray(durations)
+        distances = np.asarray(distances)
+        folds = np.random.default_rng(random_state).integers(n_folds, size=len(keys))
+        features = np.empty((len(keys), len(FEATURE_NAMES)), dtype=np.float32)
+        for fold in range(n_folds):
+            rows = np.flatnonzero(folds == fold)
+            duration_counts, speed_counts = self._counts(keys[rows], durations[rows], distances[rows])
+            fold_keys, inverse = np.unique(keys[rows], return_inverse=True)
+            features[rows] = self._features(fold_keys, self.duration_counts - duration_counts,
+                                            self.speed_counts - speed_counts)[inverse]
+        return features
+
+    def out_of_fold_frame(self, data, target=TARGET, n_folds=5, random_state=42):
+        columns = feature_arrays(data)
+        return self.out_of_fold(columns['pickup_latitude'], columns['pickup_longitude'], columns['weekday'],
+                                columns['hour'], np.asarray(data[target]), columns['trip_distance(km)'],
+                                n_folds, random_state)
+
+    # The table is saved too: computing it takes ~0.2 s on the first lookup of a scoring process
+
+    def save(self, path):
+        np.savez_compressed(path, duration_counts=self.duration_counts, speed_counts=self.speed_counts,
+                            table=self.table(), cell_size=self.cell_size, bounds=self.bounds,
+                            prior_weight=self.prior_weight, centers=np.empty((0, 2)) if self.centers is None else self.centers)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as arrays:
+            centers = arrays['centers']
+            store = cls(cell_size=float(arrays['cell_size']), bounds=arrays['bounds'].tolist(),
+                        centers=centers if len(centers) else None, prior_weight=float(arrays['prior_weight']))
+            store.duration_counts = arrays['duration_counts']
+            store.speed_counts = arrays['speed_counts']
+            store._table = arrays['table']
+        return store
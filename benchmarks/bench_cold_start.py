@@ -0,0 +1,139 @@
+#%%
+# Cold start of a scoring process: time from launching python to the first trip scored
+# (import scoring_service, TripScorer.load, one predict), in a fresh interpreter each run,
+# for the same CatBoost model saved as .cbm and as flat trees (.trees, flat_trees.py).
+#
+# Also checks that the lean path stays lean, and fails (exit status 1) when it does not:
+#   - importing scoring_service and scoring with a .trees model must not import any of
+#     HEAVY_MODULES (plotting, mapping, pandas, training libraries)
+#   - its median cold start must stay under --max-seconds
+# and reports the memory of N worker processes sharing one memory-mapped .trees model
+# (RssFile: pages of the page cache shared by all the workers, RssAnon: private memory).
+#
+#   python benchmarks/bench_cold_start.py [--runs 5] [--workers 4] [--max-seconds 1.0]
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from model_io import save_model
+from preprocessing_pipeline import RAW_FEATURES, TripPreprocessor
+from synthetic_trips import make_trips
+from trip_loader import DATETIME_FORMAT
+
+
+HEAVY_MODULES = ['pandas', 'sklearn', 'scipy', 'joblib', 'numba', 'catboost', 'xgboost', 'matplotlib', 'seaborn',
+                 'folium', 'geopy']
+
+REPOSITORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Run in the fresh interpreter: argv = model, preprocessor, trip as json, seconds to wait before exiting
+_WORKER = '''
+import json, sys, time
+start = time.perf_counter()
+sys.path.insert(0, {repository!r})
+from scoring_service import TripScorer
+imported = time.perf_counter()
+scorer = TripScorer.load(sys.argv[1], sys.argv[2])
+loaded = time.perf_counter()
+prediction = scorer.predict(json.loads(sys.argv[3]))
+predicted = time.perf_counter()
+memory = {{}}
+with open('/proc/self/status') as f:
+    for line in f:
+        if line.startswith(('RssAnon', 'RssFile')):
+            memory[line.split(':')[0]] = int(line.split()[1]) / 1e3
+print(json.dumps({{'import_seconds': imported - start, 'load_seconds': loaded - imported,
+                  'predict_seconds': predicted - loaded, 'prediction': prediction, 'memory_mb': memory,
+                  'heavy_modules': [name for name in {heavy!r} if name in sys.modules]}}), flush=True)
+time.sleep(float(sys.argv[4]))
+'''.format(repository=REPOSITORY, heavy=HEAVY_MODULES)
+
+
+def _command(model_path, preprocessor_path, trip, hold_seconds=0):
+    return [sys.executable, '-c', _WORKER, model_path, preprocessor_path, json.dumps(trip), str(hold_seconds)]
+
+
+def cold_start(model_path, preprocessor_path, trip, runs):
+    results = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        output = subprocess.run(_command(model_path, preprocessor_path, trip), capture_output=True, text=True,
+                                check=True).stdout
+        result = json.loads(output)
+        result['total_seconds'] = time.perf_counter() - start
+        results.append(result)
+    return results
+
+
+# N workers started together on the same model, each reporting its memory once it has scored a trip
+
+def shared_workers(model_path, preprocessor_path, trip, n_workers):
+    workers = [subprocess.Popen(_command(model_path, preprocessor_path, trip, hold_seconds=5), stdout=subprocess.PIPE,
+                                text=True) for _ in range(n_workers)]
+    results = [json.loads(worker.stdout.readline()) for worker in workers]
+    for worker in workers:
+        worker.kill()
+        worker.wait()
+    return results
+
+
+def run(runs, n_workers, max_seconds):
+    from catboost import CatBoostRegressor
+
+    df = make_trips(200_000)
+    preprocessor = TripPreprocessor().fit(df, df['trip_duration'])
+    model = CatBoostRegressor(iterations=500, depth=8, verbose=False)
+    model.fit(preprocessor.transform(df), preprocessor.transform_target(df['trip_duration']))
+    trip = df[RAW_FEATURES].iloc[0].to_dict()
+    trip['pickup_datetime'] = trip['pickup_datetime'].strftime(DATETIME_FORMAT)
+    trip = {key: value.item() if isinstance(value, np.generic) else value for key, value in trip.items()}
+
+    failures = []
+    with tempfile.TemporaryDirectory() as directory:
+        preprocessor_path = os.path.join(directory, 'trip_preprocessor.json')
+        preprocessor.save(preprocessor_path)
+        predictions = {}
+        for extension in ('.cbm', '.trees'):
+            model_path = save_model(model, os.path.join(directory, 'trip_model' + extension))
+            results = cold_start(model_path, preprocessor_path, trip, runs)
+            predictions[extension] = results[0]['prediction']
+            print('{:<7} cold start {:.3f} s (import {:.3f} s, load {:.3f} s, first trip {:.4f} s), medians of {} runs'.format(
+                extension, *(np.median([result[key] for result in results]) for key in
+                             ('total_seconds', 'import_seconds', 'load_seconds', 'predict_seconds')), runs))
+            print('        heavy modules imported: {}'.format(', '.join(results[0]['heavy_modules']) or 'none'))
+
+            if extension == '.trees':
+                if results[0]['heavy_modules']:
+                    failures.append('heavy modules imported: {}'.format(', '.join(results[0]['heavy_modules'])))
+                total = np.median([result['total_seconds'] for result in results])
+                if total > max_seconds:
+                    failures.append('cold start {:.3f} s over the {:.3f} s budget'.format(total, max_seconds))
+
+            if n_workers:
+                memory = [result['memory_mb'] for result in shared_workers(model_path, preprocessor_path, trip, n_workers)]
+                print('        {} workers: RssAnon {:.0f} MB, RssFile {:.0f} MB per worker'.format(
+                    n_workers, np.mean([m['RssAnon'] for m in memory]), np.mean([m['RssFile'] for m in memory])))
+        print('same prediction: {} ({:.3f} s and {:.3f} s)'.format(
+            np.isclose(predictions['.cbm'], predictions['.trees']), predictions['.cbm'], predictions['.trees']))
+
+    for failure in failures:
+        print('FAILED: ' + failure)
+    return not failures
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--max-seconds', type=float, default=1.0)
+    args = parser.parse_args()
+    sys.exit(0 if run(args.runs, args.workers, args.max_seconds) else 1)
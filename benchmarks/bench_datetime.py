@@ -0,0 +1,96 @@
+#%%
+# Vectorized datetime features (trip_features.datetime_features / trip_duration_seconds)
+# against the original .dt accessor passes and the per-row total_seconds lambda.
+#
+#   python benchmarks/bench_datetime.py [n_rows ...]
+#
+# Every variant runs in its own process so its peak RSS can be reported. The original
+# version needs ~600 MB per million rows and can be killed for lack of memory at 10M rows.
+
+import multiprocessing
+import os
+import resource
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from trip_features import datetime_features, trip_duration_seconds
+
+
+def original_datetime_features(df):
+    df['month'] = df.pickup_datetime.dt.month
+    df['week'] = df['pickup_datetime'].dt.isocalendar().week
+    df['weekday'] = df.pickup_datetime.dt.weekday
+    df['hour'] = df.pickup_datetime.dt.hour
+    df['minute'] = df.pickup_datetime.dt.minute
+    df['minute_oftheday'] = df['hour'] * 60 + df['minute']
+    df.drop(['minute'], axis=1, inplace=True)
+    df['check_trip_duration'] = (df['dropoff_datetime'] - df['pickup_datetime']).map(lambda x : x.total_seconds())
+    return df
+
+
+def new_datetime_features(df):
+    for column, values in datetime_features(df['pickup_datetime'].values).items():
+        df[column] = values
+    df['check_trip_duration'] = trip_duration_seconds(df['pickup_datetime'].values, df['dropoff_datetime'].values)
+    return df
+
+
+def make_datetimes(n, seed=42):
+    rng = np.random.default_rng(seed)
+    pickup = np.datetime64('2016-01-01T00:00:00') + rng.integers(0, 366 * 86400, n).astype('timedelta64[s]')
+    dropoff = pickup + rng.integers(1, 7200, n).astype('timedelta64[s]')
+    return pd.DataFrame({'pickup_datetime': pd.to_datetime(pickup), 'dropoff_datetime': pd.to_datetime(dropoff)})
+
+
+COLUMNS = ['month', 'week', 'weekday', 'hour', 'minute_oftheday', 'check_trip_duration']
+
+
+def _timed_child(function, n, queue):
+    df = make_datetimes(n)
+    start = time.perf_counter()
+    result = function(df)
+    seconds = time.perf_counter() - start
+    feature_bytes = result[COLUMNS].memory_usage(index=False).sum()
+    queue.put((seconds, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1e3, feature_bytes / 1e6))
+
+
+def timed(function, n):
+    queue = multiprocessing.Queue()
+    process = multiprocessing.Process(target=_timed_child, args=(function, n, queue))
+    process.start()
+    process.join()
+    if process.exitcode != 0:
+        return None
+    return queue.get()
+
+
+def check_agreement(n):
+    df = make_datetimes(n)
+    original = original_datetime_features(df.copy())
+    new = new_datetime_features(df.copy())
+    for column in COLUMNS:
+        assert (original[column].to_numpy(dtype=np.int64) == new[column].to_numpy(dtype=np.int64)).all(), column
+
+
+def run(n):
+    check_agreement(min(n, 1000000))
+    print('{:,} rows'.format(n))
+    results = {}
+    for name, function in (('original', original_datetime_features), ('vectorized', new_datetime_features)):
+        results[name] = timed(function, n)
+        if results[name] is None:
+            print('  {:<10} failed (killed, most likely out of memory)'.format(name))
+        else:
+            print('  {:<10} {:8.3f} s  peak RSS {:7.0f} MB  feature columns {:6.1f} MB'.format(name, *results[name]))
+    if results['original'] is not None and results['vectorized'] is not None:
+        print('  speedup {:.1f}x'.format(results['original'][0] / results['vectorized'][0]))
+
+
+if __name__ == '__main__':
+    for n in (int(arg) for arg in sys.argv[1:] or ['1000000', '10000000']):
+        run(n)
@@ -0,0 +1,69 @@
+#%%
+# Duplicate trips found with trip_duplicates.py against pandas (duplicated / drop_duplicates),
+# on synthetic trips with copies injected: exact copies, the same trips under other ids, and
+# trips moved by up to 1/3 of the near duplicate tolerances (20 s, 3e-5 degrees).
+#
+# Exact results are checked to be the same rows as pandas.duplicated, in one frame and
+# streamed in chunks. Near duplicates are counted for 1, 2 and 4 grids.
+#
+#   python benchmarks/bench_duplicates.py [n_rows ...]
+
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from synthetic_trips import make_trips
+from trip_duplicates import NEAR_DUPLICATE_TOLERANCES, TRIP_KEY_COLUMNS, duplicate_index, iter_duplicates
+
+CHUNKSIZE = 500_000
+
+
+def timed(function):
+    start = time.perf_counter()
+    result = function()
+    return time.perf_counter() - start, result
+
+
+def trips_with_copies(n, seed=42):
+    rng = np.random.default_rng(seed)
+    trips = make_trips(n, seed)
+    copies = trips.iloc[rng.choice(n, size=n // 50, replace=False)]
+    other_ids = copies.assign(id=copies['id'].str.replace('id', 'ix', regex=False))
+    moved = copies.copy()
+    moved['pickup_datetime'] += pd.to_timedelta(rng.integers(-20, 21, len(moved)), unit='s')
+    for column in ['pickup_longitude', 'pickup_latitude', 'dropoff_longitude', 'dropoff_latitude']:
+        moved[column] += rng.uniform(-3e-5, 3e-5, len(moved)).astype(moved[column].dtype)
+    data = pd.concat([trips, copies, other_ids], ignore_index=True)
+    data = data.iloc[rng.permutation(len(data))].reset_index(drop=True)
+    # The moved copies come last, so that the near duplicates found among them can be counted
+    return pd.concat([data, moved], ignore_index=True), len(data)
+
+
+def run(n):
+    data, n_unmoved = trips_with_copies(n)
+    print('\n{:,} rows ({:,} injected copies, {:,} moved)'.format(len(data), len(data) - n, len(data) - n_unmoved))
+    for name, columns in (('all columns', None), ('trip key', TRIP_KEY_COLUMNS)):
+        seconds, found = timed(lambda: duplicate_index(data, columns))
+        pandas_seconds, expected = timed(lambda: data.index[data.duplicated(columns)])
+        drop_seconds, _ = timed(lambda: len(data) - len(data.drop_duplicates(columns)))
+        streamed = np.concatenate([labels.to_numpy() for labels in iter_duplicates(
+            (data.iloc[start:start + CHUNKSIZE] for start in range(0, len(data), CHUNKSIZE)), columns)])
+        print('  {:<12} {:>9,} duplicates  fingerprints {:.3f} s  duplicated {:.3f} s  drop_duplicates {:.3f} s  '
+              'same rows: {}  streamed: {}'.format(name, len(found), seconds, pandas_seconds, drop_seconds,
+                                                  found.equals(expected), np.array_equal(streamed, expected)))
+
+    for offsets in ((0.0,), (0.0, 0.5), (0.0, 0.25, 0.5, 0.75)):
+        seconds, found = timed(lambda: duplicate_index(data, TRIP_KEY_COLUMNS, NEAR_DUPLICATE_TOLERANCES, offsets))
+        moved_found = int((found >= n_unmoved).sum())
+        print('  near, {} grid(s) {:.3f} s: {:,} duplicates, {:.0f}% of the moved copies'.format(
+            len(offsets), seconds, len(found), 100 * moved_found / (len(data) - n_unmoved)))
+
+
+if __name__ == '__main__':
+    for n in (int(arg) for arg in sys.argv[1:] or ['1400000']):
+        run(n)
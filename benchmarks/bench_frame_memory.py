@@ -0,0 +1,95 @@
+#%%
+# Memory of the cleaned trip frame of new_main.py before and after frame_memory.compact_frame,
+# and the predictions of models fitted on the original frame scored on both versions.
+#
+# The frame is built like the script builds it: trip features, pd.get_dummies(..., dtype=int)
+# one-hot columns, the power transformed columns as float64, week as a nullable UInt32, object
+# ids. Resident memory is the RSS added by reading each frame back in a fresh process.
+#
+#   python benchmarks/bench_frame_memory.py [n_rows ...]
+
+import json
+import os
+import pickle
+import subprocess
+import sys
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from frame_memory import compact_frame, format_report, prediction_drift, restore_id_columns
+from synthetic_trips import make_trips
+from trip_features import add_trip_features
+
+# Reads a pickled frame in a fresh interpreter and prints the RSS it added
+_WORKER = '''
+import json, pickle, sys
+sys.path[:0] = {paths!r}
+from stage_trace import current_rss_mb
+import pandas
+before = current_rss_mb()
+with open(sys.argv[1], 'rb') as f:
+    df = pickle.load(f)
+print(json.dumps({{'rss_mb': current_rss_mb() - before}}))
+'''
+
+
+def script_frame(n):
+    df = add_trip_features(make_trips(n))
+    df['id'] = df['id'].astype(object)
+    df = pd.concat([df, pd.get_dummies(df['store_and_fwd_flag'], dtype=int)], axis=1).drop(columns='store_and_fwd_flag')
+    df = pd.concat([df, pd.get_dummies(df['vendor_id'], dtype=int)], axis=1).drop(columns='vendor_id')
+    df = df.rename(columns={1: '1', 2: '2'})
+    df['week'] = df['week'].astype('UInt32')
+    # The Yeo-Johnson cell writes float64 columns back
+    transformed = ['passenger_count', 'pickup_longitude', 'pickup_latitude', 'dropoff_longitude', 'dropoff_latitude',
+                   'trip_distance(km)', 'distance_manhattan', 'direction', 'center_latitude', 'center_longitude',
+                   'month', 'hour', 'minute_oftheday', 'weekday']
+    for column in transformed:
+        df[column] = np.log1p(np.abs(df[column].to_numpy(dtype=np.float64)))
+    df['avg_speed_h'] = 1000 * df['trip_distance(km)'] / df['trip_duration']
+    df['avg_speed_m'] = 1000 * df['distance_manhattan'] / df['trip_duration']
+    return df
+
+
+def resident_mb(df):
+    paths = [os.path.dirname(os.path.dirname(os.path.abspath(__file__)))]
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'frame.pickle')
+        with open(path, 'wb') as f:
+            pickle.dump(df, f, protocol=pickle.HIGHEST_PROTOCOL)
+        output = subprocess.run([sys.executable, '-c', _WORKER.format(paths=paths), path], capture_output=True,
+                                text=True, check=True).stdout
+    return json.loads(output)['rss_mb']
+
+
+def run(n):
+    from sklearn.linear_model import LinearRegression
+    from xgboost import XGBRegressor
+
+    df = script_frame(n)
+    compact, report = compact_frame(df)
+    print('\n{:,} rows'.format(n))
+    print(format_report(report))
+    restored = restore_id_columns(compact.copy())['id']
+    print('ids restored: {}'.format(np.array_equal(restored.to_numpy(dtype=str), df['id'].to_numpy(dtype=str))))
+
+    raw, small = resident_mb(df), resident_mb(compact)
+    print('resident memory of the frame: {:.0f} MB -> {:.0f} MB ({:.1f}x)'.format(raw, small, raw / small))
+
+    features = [column for column in df.columns if column not in ('id', 'pickup_datetime', 'dropoff_datetime',
+                                                                  'trip_duration', 'avg_speed_h', 'avg_speed_m')]
+    X, X_compact = df[features].astype({'week': np.int64}), compact[features]
+    y = np.log1p(df['trip_duration'].to_numpy())
+    for model in (LinearRegression(), XGBRegressor(n_estimators=100, max_depth=6)):
+        model.fit(X, y)
+        print('{:<16} largest prediction difference on the compacted frame: {:.3g} (log seconds)'.format(
+            type(model).__name__, prediction_drift(model, X, X_compact)))
+
+
+if __name__ == '__main__':
+    for n in (int(arg) for arg in sys.argv[1:] or ['1400000']):
+        run(n)
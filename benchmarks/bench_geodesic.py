@@ -0,0 +1,71 @@
+#%%
+# Fused geodesic kernel (trip_features.geodesic_features) against the original
+# haversine_distance + dummy_manhattan_distance + bearing_array + center point code.
+#
+#   python benchmarks/bench_geodesic.py [n_rows ...]
+
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import trip_features
+from trip_features import bearing_array, dummy_manhattan_distance, geodesic_features, haversine_distance
+from synthetic_trips import make_trips
+
+
+def original_geo_features(df):
+    return {
+        'trip_distance(km)': haversine_distance(df, 'pickup_latitude', 'dropoff_latitude', 'pickup_longitude', 'dropoff_longitude').values,
+        'center_latitude': (df['pickup_latitude'].values + df['dropoff_latitude'].values) / 2,
+        'center_longitude': (df['pickup_longitude'].values + df['dropoff_longitude'].values) / 2,
+        'distance_manhattan': dummy_manhattan_distance(df, 'pickup_latitude', 'pickup_longitude', 'dropoff_latitude', 'dropoff_longitude').values,
+        'direction': bearing_array(df, df['pickup_latitude'].values, df['pickup_longitude'].values, df['dropoff_latitude'].values, df['dropoff_longitude'].values),
+    }
+
+
+def best_time(function, repeat=3):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def run(n):
+    df = make_trips(n)
+    # float64 copy of the coordinates, the reference for the numerical agreement
+    df64 = df.astype({column: np.float64 for column in df.columns if df[column].dtype == np.float32})
+    coordinates = [df[column].values for column in ('pickup_latitude', 'pickup_longitude', 'dropoff_latitude', 'dropoff_longitude')]
+
+    engines = ['numpy'] + (['numba'] if trip_features.NUMBA_AVAILABLE else [])
+    for engine in engines:
+        # First call compiles the numba kernel
+        geodesic_features(*coordinates, engine=engine)
+
+    reference = original_geo_features(df64)
+    results = {'original (float32 input)': best_time(lambda: original_geo_features(df)),
+               'original (float64 input)': best_time(lambda: original_geo_features(df64))}
+    for engine in engines:
+        results['fused {} float32'.format(engine)] = best_time(lambda: geodesic_features(*coordinates, engine=engine))
+        results['fused {} float64'.format(engine)] = best_time(lambda: geodesic_features(*coordinates, dtype=np.float64, engine=engine))
+
+    print('\n{:,} rows'.format(n))
+    baseline = results['original (float32 input)']
+    for name, seconds in results.items():
+        print('  {:<28} {:8.3f} s  {:6.1f}x'.format(name, seconds, baseline / seconds))
+
+    for engine in engines:
+        fused = geodesic_features(*coordinates, dtype=np.float64, engine=engine)
+        errors = ', '.join('{} {:.2e}'.format(column, np.max(np.abs(fused[column] - reference[column])))
+                           for column in fused)
+        print('  max abs difference ({}): {}'.format(engine, errors))
+
+
+if __name__ == '__main__':
+    for n in (int(arg) for arg in sys.argv[1:] or ['1000000']):
+        run(n)
@@ -0,0 +1,43 @@
+#%%
+# Elbow analysis: the original loop of full KMeans fits (k = 1..14 on every pickup point)
+# against clustering.kmeans_sweep, with the inertia of both on all the points.
+#
+#   python benchmarks/bench_kmeans_sweep.py [n_rows]
+
+import os
+import sys
+import time
+
+import numpy as np
+from sklearn.cluster import KMeans
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from clustering import kmeans_sweep
+from synthetic_trips import make_trips
+
+
+K_VALUES = range(1, 15)
+
+
+def run(n):
+    points = make_trips(n)[['pickup_longitude', 'pickup_latitude']].to_numpy(dtype=np.float64)
+
+    start = time.perf_counter()
+    original = {k: KMeans(n_clusters=k, random_state=42).fit(points).inertia_ for k in K_VALUES}
+    original_seconds = time.perf_counter() - start
+
+    sweep = kmeans_sweep(points, K_VALUES)
+    # Inertia of the sweep models on all the points, not only on their sample
+    full_inertia = {k: -sweep.model(k).score(points) for k in K_VALUES}
+
+    print('{:,} points'.format(n))
+    print('  original loop {:7.2f} s'.format(original_seconds))
+    print('  kmeans_sweep  {:7.2f} s  {:5.1f}x'.format(sweep.total_seconds, original_seconds / sweep.total_seconds))
+    print('  {:>3} {:>14} {:>14} {:>8}'.format('k', 'original', 'sweep', 'ratio'))
+    for k in K_VALUES:
+        print('  {:>3} {:>14.2f} {:>14.2f} {:>8.3f}'.format(k, original[k], full_inertia[k], full_inertia[k] / original[k]))
+
+
+if __name__ == '__main__':
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 1_400_000)
@@ -0,0 +1,49 @@
+#%%
+# Outlier map rendering: the original folium.Marker per row loop (on the first 10,000 outliers,
+# like new_main.py) against map_rendering on all the points, for render time and HTML size.
+#
+#   python benchmarks/bench_maps.py [n_rows ...]
+
+import os
+import sys
+import time
+
+import folium
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from map_rendering import NYC_CENTER, points_map
+from synthetic_trips import make_trips
+
+
+def original_map(points):
+    map_osm = folium.Map(location=NYC_CENTER, zoom_start=3, tiles="cartodb positron")
+    for i, j in points.head(10000).iterrows():
+        if int(j['pickup_latitude']) != 0:
+            folium.Marker(list((j['pickup_latitude'], j['pickup_longitude']))).add_to(map_osm)
+    return map_osm
+
+
+def rendered(build):
+    start = time.perf_counter()
+    html = build().get_root().render()
+    return time.perf_counter() - start, len(html.encode()) / 1e6
+
+
+def run(n):
+    points = make_trips(n)[['pickup_latitude', 'pickup_longitude']]
+    latitudes = points['pickup_latitude'].to_numpy()
+    longitudes = points['pickup_longitude'].to_numpy()
+
+    print('{:,} points'.format(n))
+    results = [('original markers (10k)', rendered(lambda: original_map(points))),
+               ('heatmap (all points)', rendered(lambda: points_map(latitudes, longitudes, kind='heatmap'))),
+               ('markers (all points)', rendered(lambda: points_map(latitudes, longitudes, kind='markers')))]
+    for name, (seconds, megabytes) in results:
+        print('  {:<24} {:7.2f} s  {:7.2f} MB'.format(name, seconds, megabytes))
+
+
+if __name__ == '__main__':
+    for n in (int(arg) for arg in sys.argv[1:] or ['100000', '1400000']):
+        run(n)
@@ -0,0 +1,48 @@
+#%%
+# Trip features computed by a pool of processes over shared memory (parallel_features.py)
+# against trip_features.add_trip_features in one process, for n_jobs 1, 2, 4, 8 and all the
+# cores (n_jobs above the number of cores measures the oversubscribed pool).
+# Every run is checked to give exactly the same columns as the single process code.
+#
+#   python benchmarks/bench_parallel_features.py [n_rows ...]
+
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from parallel_features import COORDINATE_COLUMNS, parallel_trip_features
+from synthetic_trips import make_trips
+from trip_features import add_trip_features
+
+
+def best_time(function, repeat=3):
+    timings = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        timings.append(time.perf_counter() - start)
+    return min(timings), result
+
+
+def run(n):
+    df = make_trips(n)[COORDINATE_COLUMNS + ['pickup_datetime']]
+    baseline, reference = best_time(lambda: add_trip_features(df.copy()))
+    print('\n{:,} rows, {} cores'.format(n, os.cpu_count()))
+    print('  {:<22} {:8.3f} s  {:6.1f}M rows/s'.format('add_trip_features', baseline, n / baseline / 1e6))
+
+    for n_jobs in sorted({1, 2, 4, 8, os.cpu_count() or 1}):
+        seconds, features = best_time(lambda: parallel_trip_features(df, n_jobs=n_jobs))
+        same = all(np.array_equal(values, reference[column].values, equal_nan=True) and
+                   values.dtype == reference[column].dtype for column, values in features.items())
+        print('  {:<22} {:8.3f} s  {:6.1f}M rows/s  {:5.2f}x  same columns: {}'.format(
+            'n_jobs={}'.format(n_jobs), seconds, n / seconds / 1e6, baseline / seconds, same))
+
+
+if __name__ == '__main__':
+    for n in (int(arg) for arg in sys.argv[1:] or ['10000000']):
+        run(n)
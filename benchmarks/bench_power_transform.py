@@ -0,0 +1,52 @@
+#%%
+# Yeo-Johnson fitting of the numeric trip features: sklearn PowerTransformer.fit_transform on
+# all the rows (as in the scripts) against YeoJohnson with subsampled lambdas, fitted with
+# joblib threads and processes, followed by the lambda drift of the subsample.
+#
+#   python benchmarks/bench_power_transform.py [n_rows ...]
+
+import os
+import sys
+import time
+
+import pandas as pd
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from power_transform import YeoJohnson
+from preprocessing_pipeline import NUMERIC_FEATURES
+from synthetic_trips import make_trips
+from trip_features import add_trip_features
+
+
+SAMPLE_SIZES = [50_000, 200_000]
+
+
+def timed(function):
+    start = time.perf_counter()
+    result = function()
+    return time.perf_counter() - start, result
+
+
+def run(n):
+    from sklearn.preprocessing import PowerTransformer
+
+    df = add_trip_features(make_trips(n))[NUMERIC_FEATURES]
+    print('{:,} rows, {} columns'.format(n, len(NUMERIC_FEATURES)))
+
+    sklearn_seconds, _ = timed(lambda: PowerTransformer(method='yeo-johnson', standardize=False).fit_transform(df))
+    print('  sklearn full fit_transform          {:7.2f} s'.format(sklearn_seconds))
+
+    for sample_size in SAMPLE_SIZES:
+        for prefer in ('threads', 'processes'):
+            transformer = YeoJohnson(sample_size=sample_size, prefer=prefer)
+            seconds, _ = timed(lambda: transformer.fit_transform(df))
+            print('  sample {:>7,} {:<9} fit {:5.2f} s, fit_transform {:5.2f} s  {:5.1f}x'.format(
+                sample_size, prefer, transformer.fit_seconds_, seconds, sklearn_seconds / seconds))
+        with pd.option_context('display.width', 200, 'display.max_columns', None, 'display.float_format', '{:.4f}'.format):
+            print(transformer.lambda_drift(df))
+
+
+if __name__ == '__main__':
+    for n in (int(arg) for arg in sys.argv[1:] or ['1400000']):
+        run(n)
@@ -0,0 +1,86 @@
+#%%
+# TripPreprocessor: artifact load time and transform throughput per batch size, against the
+# pandas chain of new_main.py (trip features, pd.get_dummies, PowerTransformer.transform,
+# clipping and KMeans.predict with the same fitted values) applied to the same batches.
+#
+#   python benchmarks/bench_preprocessing.py [n_rows ...]
+
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from preprocessing_pipeline import NUMERIC_FEATURES, RAW_FEATURES, TripPreprocessor
+from synthetic_trips import make_trips
+from trip_features import add_trip_features
+
+
+BATCH_SIZES = [1, 1000, 100_000]
+
+def pandas_transform(batch, transformer, kmeans, preprocessor):
+    df = add_trip_features(batch.copy())
+    df = pd.concat([df, pd.get_dummies(df['store_and_fwd_flag'], dtype=int)], axis=1)
+    df = pd.concat([df, pd.get_dummies(df['vendor_id'], dtype=int)], axis=1)
+    df[NUMERIC_FEATURES] = transformer.transform(df[NUMERIC_FEATURES])
+    for column, (lower, upper) in preprocessor.limits_.items():
+        df[column] = df[column].clip(lower, upper)
+    df['pickup_cluster'] = kmeans.predict(batch[['pickup_longitude', 'pickup_latitude']].to_numpy(np.float64))
+    return df
+
+
+# Rows per second over batches of batch_size rows, at least min_seconds of work
+def throughput(function, data, batch_size, min_seconds=1.0):
+    rows = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < min_seconds:
+        for offset in range(0, len(data), batch_size):
+            batch = data.iloc[offset:offset + batch_size]
+            function(batch)
+            rows += len(batch)
+            if time.perf_counter() - start >= min_seconds:
+                break
+    return rows / (time.perf_counter() - start)
+
+
+def run(n):
+    from sklearn.cluster import KMeans
+    from sklearn.preprocessing import PowerTransformer
+
+    df = make_trips(n)
+    start = time.perf_counter()
+    preprocessor = TripPreprocessor().fit(df, df['trip_duration'])
+    fit_seconds = time.perf_counter() - start
+    # PowerTransformer with the lambdas of the preprocessor, as the scripts would have it after fit
+    transformer = PowerTransformer(method='yeo-johnson', standardize=False)
+    transformer.set_output(transform='pandas')
+    transformer.fit(add_trip_features(df.iloc[:1000].copy())[NUMERIC_FEATURES])
+    transformer.lambdas_ = np.asarray(preprocessor.lambdas_)
+    kmeans = KMeans(n_clusters=preprocessor.n_clusters, init=preprocessor.cluster_centers_, n_init=1, max_iter=1)
+    kmeans.fit(preprocessor.cluster_centers_)
+    kmeans.cluster_centers_ = preprocessor.cluster_centers_
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'trip_preprocessor.json')
+        preprocessor.save(path)
+        size = os.path.getsize(path)
+        start = time.perf_counter()
+        loaded = TripPreprocessor.load(path)
+        load_seconds = time.perf_counter() - start
+
+    raw = df[RAW_FEATURES]
+    print('{:,} rows: fit {:.2f} s, artifact {:,} bytes, load {:.2f} ms'.format(n, fit_seconds, size, load_seconds * 1000))
+    print('  {:>8} {:>14} {:>14} {:>8}'.format('batch', 'pandas rows/s', 'fast rows/s', 'speedup'))
+    for batch_size in BATCH_SIZES:
+        slow = throughput(lambda batch: pandas_transform(batch, transformer, kmeans, loaded), raw, batch_size)
+        fast = throughput(loaded.transform, raw, batch_size)
+        print('  {:>8,} {:>14,.0f} {:>14,.0f} {:>7.1f}x'.format(batch_size, slow, fast, fast / slow))
+
+
+if __name__ == '__main__':
+    for n in (int(arg) for arg in sys.argv[1:] or ['500000']):
+        run(n)
@@ -0,0 +1,71 @@
+#%%
+# IQR limits: original find_limits (four .quantile() calls per variable) against the batched
+# find_limits and the streaming QuantileSketch version, with the measured rank error of
+# the sketch quartiles next to its 99% bound.
+#
+#   python benchmarks/bench_quantiles.py [n_rows ...]
+
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from Outliers_detection import find_limits, find_limits_streaming
+from synthetic_trips import make_trips
+from trip_features import add_trip_features
+
+
+VARIABLES = ['trip_duration', 'pickup_latitude', 'pickup_longitude', 'dropoff_latitude', 'dropoff_longitude',
+             'trip_distance(km)', 'distance_manhattan', 'direction']
+
+CHUNKSIZE = 500_000
+
+
+def original_find_limits(data, variables, fold):
+    limits = dict()
+    for variable in variables:
+        IQR = data[variable].quantile(0.75) - data[variable].quantile(0.25)
+        lower_limit = data[variable].quantile(0.25) - (IQR * fold)
+        upper_limit = data[variable].quantile(0.75) + (IQR * fold)
+        limits[variable] = (lower_limit, upper_limit)
+    return limits
+
+
+def timed(function):
+    start = time.perf_counter()
+    result = function()
+    return time.perf_counter() - start, result
+
+
+def run(n):
+    df = add_trip_features(make_trips(n))
+    chunks = [df.iloc[start:start + CHUNKSIZE] for start in range(0, n, CHUNKSIZE)]
+
+    original_seconds, original = timed(lambda: original_find_limits(df, VARIABLES, 1.5))
+    batched_seconds, batched = timed(lambda: find_limits(df, VARIABLES, 1.5))
+    streaming_seconds, (_, sketches) = timed(lambda: find_limits_streaming(chunks, VARIABLES, 1.5, seed=0))
+    assert batched == original
+
+    print('{:,} rows, {} variables'.format(n, len(VARIABLES)))
+    print('  original   {:7.3f} s'.format(original_seconds))
+    print('  batched    {:7.3f} s  {:5.1f}x'.format(batched_seconds, original_seconds / batched_seconds))
+    print('  streaming  {:7.3f} s  {:5.1f}x  ({} chunks, {} items kept per sketch)'.format(
+        streaming_seconds, original_seconds / streaming_seconds, len(chunks), max(len(s) for s in sketches.values())))
+
+    worst = 0
+    for variable, sketch in sketches.items():
+        values = np.sort(df[variable].to_numpy(dtype=np.float64))
+        for q, estimate in zip((0.25, 0.75), sketch.quantile([0.25, 0.75])):
+            # Fraction of the values below the estimate, compared with q
+            low = np.searchsorted(values, estimate, side='left') / n
+            high = np.searchsorted(values, estimate, side='right') / n
+            worst = max(worst, max(low - q, q - high, 0))
+    print('  sketch quartiles: max rank error {:.4f}, 99% bound {:.4f}'.format(worst, sketches[VARIABLES[0]].rank_error()))
+
+
+if __name__ == '__main__':
+    for n in (int(arg) for arg in sys.argv[1:] or ['2000000']):
+        run(n)
@@ -0,0 +1,68 @@
+#%%
+# Latency of scoring one trip: TripScorer.predict (scalar features) against the batch path
+# (one row DataFrame through TripPreprocessor.transform), then over HTTP with the
+# ScoringServer and the load_test generator of scoring_service.py.
+#
+#   python benchmarks/bench_scoring.py [n_requests]
+
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from preprocessing_pipeline import RAW_FEATURES, TripPreprocessor
+from scoring_service import ScoringServer, TripScorer, latency_summary, load_test, print_summary
+from synthetic_trips import make_trips
+from trip_loader import DATETIME_FORMAT
+
+
+def timed_calls(function, items):
+    latencies = []
+    for item in items:
+        start = time.perf_counter()
+        function(item)
+        latencies.append(time.perf_counter() - start)
+    return latency_summary(latencies)
+
+
+def run(n_requests):
+    from sklearn.ensemble import HistGradientBoostingRegressor
+
+    df = make_trips(200_000)
+    preprocessor = TripPreprocessor().fit(df, df['trip_duration'])
+    model = HistGradientBoostingRegressor(max_iter=100).fit(preprocessor.transform(df),
+                                                            preprocessor.transform_target(df['trip_duration']))
+    scorer = TripScorer(model, preprocessor)
+
+    raw = df[RAW_FEATURES].iloc[:n_requests]
+    trips = raw.assign(pickup_datetime=raw['pickup_datetime'].dt.strftime(DATETIME_FORMAT)).to_dict('records')
+    frames = [raw.iloc[i:i + 1] for i in range(min(n_requests, 500))]
+
+    print('HistGradientBoostingRegressor, {:,} trips'.format(n_requests))
+    print('  features only, scalar: ', end='')
+    print_summary(timed_calls(preprocessor.transform_one, trips))
+    print('  features only, frame:  ', end='')
+    print_summary(timed_calls(preprocessor.transform, frames))
+    print('  TripScorer.predict:    ', end='')
+    print_summary(timed_calls(scorer.predict, trips))
+    print('  frame + model.predict: ', end='')
+    print_summary(timed_calls(lambda frame: model.predict(preprocessor.transform(frame)), frames))
+
+    predictions = np.array([scorer.predict(trip) for trip in trips[:200]])
+    batch = preprocessor.inverse_transform_target(model.predict(preprocessor.transform(raw.iloc[:200])))
+    print('  max difference with the batch path: {:.2e} s'.format(np.abs(predictions - batch).max()))
+
+    server = ScoringServer(scorer).start()
+    try:
+        for concurrency in (1, 4):
+            print('  HTTP, concurrency {}:    '.format(concurrency), end='')
+            print_summary(load_test(server.url, trips, n_requests, concurrency))
+    finally:
+        server.stop()
+
+
+if __name__ == '__main__':
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 2000)
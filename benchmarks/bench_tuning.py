@@ -0,0 +1,59 @@
+#%%
+# XGBoost tuning: the RandomizedSearchCV block of new_main.py (XGBRegressor(n_jobs=n_cores)
+# inside RandomizedSearchCV(n_jobs=n_cores, cv=5), 10 configurations trained to completion)
+# against HalvingSearch, with the wall time and the RMSE of the chosen model on held out trips.
+#
+#   python benchmarks/bench_tuning.py [n_rows] [n_trials]
+
+import os
+import sys
+import time
+
+import numpy as np
+from scipy.stats import randint, uniform
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from joblib import cpu_count
+from preprocessing_pipeline import TripPreprocessor
+from synthetic_trips import make_trips
+from tuning import HalvingSearch, rmse
+
+
+PARAM_DIST = {
+    'learning_rate': uniform(0.01, 0.2),
+    'max_depth': randint(3, 10),
+}
+
+
+def run(n, n_trials):
+    import xgboost as xgb
+    from sklearn.model_selection import RandomizedSearchCV, train_test_split
+
+    df = make_trips(n)
+    train, test = train_test_split(df, test_size=0.2, random_state=42)
+    preprocessor = TripPreprocessor().fit(train, train['trip_duration'])
+    X_train, X_test = preprocessor.transform(train), preprocessor.transform(test)
+    y_train, y_test = preprocessor.transform_target(train['trip_duration']), preprocessor.transform_target(test['trip_duration'])
+    n_cores = cpu_count()
+    print('{:,} training rows, {} cores'.format(len(X_train), n_cores))
+
+    start = time.perf_counter()
+    random_search = RandomizedSearchCV(xgb.XGBRegressor(n_jobs=n_cores),
+                                       param_distributions=dict(PARAM_DIST, n_estimators=randint(50, 200)),
+                                       n_iter=10, scoring='neg_mean_squared_error', cv=5, random_state=123, n_jobs=n_cores)
+    random_search.fit(X_train, y_train)
+    random_seconds = time.perf_counter() - start
+    random_rmse = rmse(y_test, random_search.best_estimator_.predict(X_test))
+    print('  RandomizedSearchCV, 10 trials:  {:7.1f} s, test RMSE {:.5f}'.format(random_seconds, random_rmse))
+
+    search = HalvingSearch(PARAM_DIST, n_trials=n_trials, max_rounds=200, n_folds=5, random_state=123)
+    search.fit(X_train, y_train)
+    print('  HalvingSearch, {} trials:       {:7.1f} s, test RMSE {:.5f}  ({:.1f}x faster, {} rounds per fold, '
+          'rungs {})'.format(n_trials, search.total_seconds_, rmse(y_test, search.predict(X_test)),
+                             random_seconds / search.total_seconds_, search.trained_rounds_, search.rungs))
+    print('  best: {} with {} rounds'.format(search.best_params_, search.best_rounds_))
+
+
+if __name__ == '__main__':
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 100_000, int(sys.argv[2]) if len(sys.argv) > 2 else 10)
@@ -0,0 +1,50 @@
+#%%
+# Synthetic trips with the same columns and dtypes as trip_loader.load_trips,
+# so the benchmarks can run at any size without the Kaggle files.
+# Coordinates are spread around Manhattan, with a few outliers like in train.csv.
+# The trip duration follows the distance at a speed that depends on the hour of the day,
+# with log-normal noise, so the models of the benchmarks have something to learn.
+
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from trip_loader import DATETIME_FORMAT, STORE_AND_FWD_DTYPE
+
+
+def make_trips(n, seed=42):
+    rng = np.random.default_rng(seed)
+    pickup = np.datetime64('2016-01-01T00:00:00') + rng.integers(0, 182 * 86400, n).astype('timedelta64[s]')
+    coordinates = [(center + rng.normal(0, scale, n)).astype(np.float32)
+                   for center, scale in ((-73.975, 0.04), (40.75, 0.03), (-73.975, 0.04), (40.75, 0.03))]
+    # ~km on the street grid, 85 km per degree of longitude and 111 per degree of latitude at NYC
+    distance = 85 * np.abs(coordinates[2] - coordinates[0]) + 111 * np.abs(coordinates[3] - coordinates[1])
+    hour = (pickup - pickup.astype('datetime64[D]')).astype(np.int64) // 3600
+    speed = 12 + 10 * ((hour < 7) | (hour > 21))
+    duration = np.round(60 + distance / speed * 3600 * rng.lognormal(0, 0.35, n)).astype(np.int32)
+    data = pd.DataFrame({
+        'id': pd.Series(np.char.add('id', np.char.zfill(np.arange(n).astype(str), 7)), dtype=str),
+        'vendor_id': rng.integers(1, 3, n).astype(np.int8),
+        'pickup_datetime': pd.to_datetime(pickup),
+        'dropoff_datetime': pd.to_datetime(pickup + duration.astype('timedelta64[s]')),
+        'passenger_count': rng.choice([0, 1, 2, 3, 4, 5, 6, 7], n, p=[0.001, 0.7, 0.14, 0.04, 0.02, 0.05, 0.048, 0.001]).astype(np.int8),
+        'pickup_longitude': coordinates[0],
+        'pickup_latitude': coordinates[1],
+        'dropoff_longitude': coordinates[2],
+        'dropoff_latitude': coordinates[3],
+        'store_and_fwd_flag': pd.Categorical.from_codes((rng.random(n) < 0.006).astype(np.int8), dtype=STORE_AND_FWD_DTYPE),
+        'trip_duration': duration,
+    })
+    outliers = rng.random(n) < 0.001
+    data.loc[outliers, 'pickup_latitude'] = rng.uniform(34, 51, outliers.sum()).astype(np.float32)
+    return data
+
+
+def write_trips_csv(path, n, seed=42):
+    data = make_trips(n, seed)
+    data.to_csv(path, index=False, date_format=DATETIME_FORMAT)
+    return path
@@ -0,0 +1,116 @@
+#%%
+# Elbow analysis for the KMeans clustering of the pickup locations.
+#
+# Instead of one KMeans on every point for each k, kmeans_sweep fits KMeans on a random
+# subsample of the points (200k points give centers within a few % of the inertia of a fit
+# on all 1.4M, MiniBatchKMeans stops much earlier and is ~2x worse at the same cost).
+# The k values are split into consecutive runs that are fitted in parallel threads
+# (the KMeans iterations release the GIL), and inside a run each k starts from the centers
+# found for k - 1 plus one new center picked k-means++ style.
+# The fitted models are kept, so the final clustering can reuse the one of the chosen k.
+
+import time
+
+import numpy as np
+import pandas as pd
+from joblib import Parallel, cpu_count, delayed
+from sklearn.cluster import KMeans
+from sklearn.metrics import silhouette_score
+from threadpoolctl import threadpool_limits
+
+
+SWEEP_SAMPLE_SIZE = 200_000
+
+
+
+#%%
+
+# New center drawn with probability proportional to the squared distance to the closest
+# existing center (the k-means++ rule)
+
+def _add_center(points, centers, rng):
+    distances = ((points[:, None, :] - centers[None, :, :]) ** 2).sum(axis=2).min(axis=1)
+    if distances.sum() == 0:
+        return np.vstack([centers, points[rng.integers(len(points))]])
+    return np.vstack([centers, points[rng.choice(len(points), p=distances / distances.sum())]])
+
+
+def _fit_run(points, k_values, random_state, silhouette_size):
+    rng = np.random.default_rng(random_state)
+    results = []
+    centers = None
+    for k in k_values:
+        start = time.perf_counter()
+        if centers is not None and len(centers) == k - 1:
+            init = _add_center(points, centers, rng)
+        else:
+            init = 'k-means++'
+        model = KMeans(n_clusters=k, init=init, n_init=1, random_state=random_state)
+        model.fit(points)
+        fit_seconds = time.perf_counter() - start
+        centers = model.cluster_centers_
+
+        silhouette = None
+        if silhouette_size and k > 1:
+            silhouette = silhouette_score(points, model.labels_, sample_size=min(silhouette_size, len(points)),
+                                          random_state=random_state)
+        results.append((k, model, fit_seconds, silhouette))
+    return results
+
+
+def _split_runs(k_values, n_runs):
+    return [list(run) for run in np.array_split(np.asarray(k_values), n_runs) if len(run)]
+
+
+#%%
+
+class KMeansSweep:
+
+    def __init__(self, results, n_points, sample_size, total_seconds):
+        results = sorted(results, key=lambda result: result[0])
+        self.k_values = [k for k, _, _, _ in results]
+        self.models = {k: model for k, model, _, _ in results}
+        self.fit_seconds = {k: seconds for k, _, seconds, _ in results}
+        self.silhouettes = {k: silhouette for k, _, _, silhouette in results}
+        # Inertia of the sample scaled to the number of points, comparable with the
+        # inertia_ of a KMeans fitted on all the points
+        self.inertias = {k: model.inertia_ * n_points / sample_size for k, model in self.models.items()}
+        self.n_points = n_points
+        self.sample_size = sample_size
+        self.total_seconds = total_seconds
+
+    def model(self, k):
+        return self.models[k]
+
+    def predict(self, points, k):
+        return self.models[k].predict(np.asarray(points, dtype=np.float64))
+
+    def to_frame(self):
+        return pd.DataFrame({'inertia': self.inertias, 'silhouette': self.silhouettes,
+                             'fit_seconds': self.fit_seconds}).rename_axis('k')
+
+
+# points: (n, 2) array or frame of coordinates.
+# silhouette_size: number of sampled points for a silhouette score of each k (None to skip it,
+# ~10_000 is a good value)
+
+def kmeans_sweep(points, k_values=range(1, 15), sample_size=SWEEP_SAMPLE_SIZE, n_jobs=-1,
+                 silhouette_size=None, random_state=42):
+    start = time.perf_counter()
+    points = np.asarray(points, dtype=np.float64)
+    rng = np.random.default_rng(random_state)
+    sample = points
+    if sample_size and len(points) > sample_size:
+        sample = points[rng.choice(len(points), size=sample_size, replace=False)]
+
+    n_cores = cpu_count()
+    if n_jobs is None or n_jobs < 1:
+        n_jobs = n_cores
+    runs = _split_runs(k_values, min(len(k_values), n_jobs))
+    # Cores are shared between the runs, so the threads of each KMeans do not oversubscribe the machine
+    with threadpool_limits(max(1, n_cores // len(runs))):
+        results = Parallel(n_jobs=len(runs), prefer='threads')(
+            delayed(_fit_run)(sample, run, random_state, silhouette_size) for run in runs)
+
+    return KMeansSweep([result for run in results for result in run], len(points), len(sample),
+                       time.perf_counter() - start)
@@ -0,0 +1,133 @@
+#%%
+# On-disk cache of the trip frame with all derived features (see trip_features.py).
+#
+# Each entry is a directory named after a hash of the input file contents and of the
+# feature code, holding one .npy file per column plus a small meta.json.
+# On a warm run the columns are memory-mapped back, so neither the CSV parsing nor the
+# feature computation is repeated. Editing trip_loader.py, trip_features.py or parallel_features.py
+# changes the key, so stale entries are never reused.
+
+import hashlib
+import json
+import os
+import shutil
+import uuid
+
+import numpy as np
+import pandas as pd
+
+import parallel_features
+import trip_features
+import trip_loader
+
+
+FEATURE_CACHE_DIR = '.feature_cache'
+
+_META_FILE = 'meta.json'
+
+
+#%%
+
+def file_digest(path, block_size=1 << 20):
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+# Version of the code producing the cached columns: the explicit FEATURE_VERSION
+# plus the source of the loader and feature modules
+
+def feature_code_digest():
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(str(trip_features.FEATURE_VERSION).encode())
+    for module in (trip_loader, trip_features, parallel_features):
+        with open(module.__file__, 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+
+def feature_cache_key(path):
+    return '{}-{}'.format(file_digest(path), feature_code_digest())
+
+
+#%%
+
+# Columns are stored as plain numpy arrays:
+# categoricals as their codes, strings as fixed width unicode,
+# nullable integers as the matching numpy integer type.
+
+def _column_to_numpy(series):
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        return series.cat.codes.to_numpy(), {'kind': 'category', 'categories': series.cat.categories.tolist()}
+    if pd.api.types.is_string_dtype(series.dtype):
+        return series.to_numpy().astype(str), {'kind': 'str'}
+    if isinstance(series.dtype, pd.api.extensions.ExtensionDtype):
+        return series.to_numpy(dtype=series.dtype.numpy_dtype), {'kind': 'numpy'}
+    return series.to_numpy(), {'kind': 'numpy'}
+
+
+def _column_from_numpy(values, meta):
+    if meta['kind'] == 'category':
+        return pd.Categorical.from_codes(values, categories=meta['categories'])
+    if meta['kind'] == 'str':
+        return values.astype(object)
+    return values
+
+
+def save_frame(data, directory):
+    # Written to a temporary directory first and renamed at the end,
+    # so an interrupted run never leaves a half written entry behind
+    tmp_directory = '{}.tmp-{}'.format(directory, uuid.uuid4().hex)
+    os.makedirs(tmp_directory)
+    columns = []
+    for i, column in enumerate(data.columns):
+        values, meta = _column_to_numpy(data[column])
+        meta.update(name=column, file='{}.npy'.format(i))
+        np.save(os.path.join(tmp_directory, meta['file']), values)
+        columns.append(meta)
+    with open(os.path.join(tmp_directory, _META_FILE), 'w') as f:
+        json.dump({'columns': columns, 'index': 'range' if isinstance(data.index, pd.RangeIndex) else 'file'}, f)
+    if not isinstance(data.index, pd.RangeIndex):
+        np.save(os.path.join(tmp_directory, 'index.npy'), data.index.to_numpy())
+    try:
+        os.rename(tmp_directory, directory)
+    except OSError:
+        # Another process stored the same entry in the meantime
+        shutil.rmtree(tmp_directory, ignore_errors=True)
+
+
+def load_frame(directory, mmap=True):
+    with open(os.path.join(directory, _META_FILE)) as f:
+        meta = json.load(f)
+    mmap_mode = 'r' if mmap else None
+    data = {}
+    for column in meta['columns']:
+        values = np.load(os.path.join(directory, column['file']), mmap_mode=mmap_mode)
+        data[column['name']] = _column_from_numpy(values, column)
+    index = None
+    if meta['index'] == 'file':
+        index = np.load(os.path.join(directory, 'index.npy'))
+    return pd.DataFrame(data, index=index, copy=False)
+
+
+#%%
+
+# Typed trip frame with every feature of trip_features.add_trip_features,
+# read from the cache when the same file was processed by the same code before
+
+# n_jobs: processes computing the features on a cold run (parallel_features.py), -1 for all the
+# cores. The default computes them in the calling process, a script asking for more processes
+# needs a __main__ guard (see parallel_features.py).
+
+def load_trip_features(path, cache_dir=FEATURE_CACHE_DIR, n_jobs=1):
+    directory = os.path.join(cache_dir, feature_cache_key(path))
+    if os.path.exists(os.path.join(directory, _META_FILE)):
+        return load_frame(directory)
+
+    data = parallel_features.add_trip_features_parallel(trip_loader.load_trips(path), n_jobs=n_jobs)
+    os.makedirs(cache_dir, exist_ok=True)
+    save_frame(data, directory)
+    # Read back, so cold and warm runs return exactly the same dtypes
+    return load_frame(directory)
@@ -8,7 +8,6 @@ current_dir = os.path.dirname(os.path.abspath(__file__))
 # Adding the parent directory to the Python path
 sys.path.append(os.path.dirname(current_dir))
 
-# from Outliers_detection import find_limits, clip_variables
 
 # from Outliers_detection import mapping_outliers
 import pandas as pd
@@ -17,9 +16,7 @@ import matplotlib.pyplot as plt
 from datetime import datetime
 import seaborn as sns
 import folium
-from sklearn.cluster import KMeans
 from sklearn.linear_model import LinearRegression
-from sklearn.preprocessing import PowerTransformer
 from sklearn.ensemble import RandomForestRegressor
 from sklearn.model_selection import train_test_split
 # from catboost import CatBoostRegressor
@@ -27,6 +24,16 @@ from sklearn.model_selection import train_test_split
 from sklearn.metrics import mean_squared_error
 from sklearn.metrics import mean_squared_log_error
 
+from clustering import kmeans_sweep
+from density_plots import plot_density
+from feature_cache import load_trip_features
+from Outliers_detection import Clipper
+from power_transform import YeoJohnson
+from row_filters import trip_row_filter
+from stage_trace import StageTracer
+from trip_duplicates import NEAR_DUPLICATE_TOLERANCES, TRIP_KEY_COLUMNS, duplicate_index
+from trip_features import trip_duration_seconds
+
 # import xgboost as xgb
 
 
@@ -34,95 +41,27 @@ from sklearn.metrics import mean_squared_log_error
 # Get the current working directory
 current_directory = os.getcwd()
 
-# Reading the CSV file
-df = pd.read_csv(os.path.join(current_directory, "train.csv"))
+# Wall time, CPU time, memory and rows of every stage below (stage_trace.py), written at the
+# end as pipeline_trace.json (opens in chrome://tracing or ui.perfetto.dev) with a summary table.
+# STAGE_TRACE_MEMORY=1 adds the tracemalloc peak of every stage, at the cost of a slower run
+tracer = StageTracer()
+
+# Reading the CSV file together with the derived trip features (cached on disk after the first run)
+with tracer.stage('load') as stage:
+    df = load_trip_features(os.path.join(current_directory, "train.csv"))
+    stage['rows_out'] = df
 
 print(df.head(5))
 
 print(df.info())
 
 
-#%%
-
-#calculates the lower and upper limits for each specified variable in a dataset based on the interquartile range (IQR) and a given fold value.
-#The purpose of finding these limits is often related to identifying and handling outliers in the data.
-
-def find_limits(data, variables, fold):
-    limits = dict()
-    for variable in variables:
-        IQR = data[variable].quantile(0.75) - data[variable].quantile(0.25)
-        lower_limit = data[variable].quantile(0.25) - (IQR * fold)
-        upper_limit = data[variable].quantile(0.75) + (IQR * fold)
-        limits[variable] = (lower_limit, upper_limit)
-    return limits
-
-
-#%%
-
-#The purpose of this function is to enforce constraints on the values of specific variables, ensuring that they fall within a predefined range.
-#This is often done to mitigate the impact of outliers or extreme values on statistical analyses, modeling, or visualization.
-# It provides a way to handle values that are deemed too extreme without removing them entirely from the dataset.
-
-def clip_variables(data, limits):
-    clipped_data = data.copy()
-    for variable, (lower_limit, upper_limit) in limits.items():
-        clipped_data[variable] = clipped_data[variable].clip(lower=lower_limit, upper=upper_limit)
-    return clipped_data
-#%%
-
-
-#Haversine distance is a formula used to calculate the distance between two points on the surface of a sphere,
-#given their latitude and longitude in decimal degrees.
-#This formula is often employed to calculate the distance between two locations on earth 
-#where the earth is approximately spherical
-
-def haversine_distance(df, lat1, lat2, long1, long2):
-    
-    r = 6371 #average radius of earth in kilometers
-    
-    phi1 = np.radians(df[lat1])
-    
-    phi2 = np.radians(df[lat2])
-    
-    delta_phi = np.radians(df[lat2] - df[lat1])
-    
-    delta_lambda = np.radians(df[long2] - df[long1])
-    
-    a = np.sin(delta_phi/2) ** 2 + np.cos(phi1) * np.cos(phi2) * np.sin(delta_lambda/2)**2
-    
-    c = 2 * np.arctan2(np.sqrt(a), np.sqrt(1-a))
-    
-    d = r * c
-    
-    return d
-
-#%%
-
-#calculates the compass bearing (direction) between two geographic points specified by their latitude and longitude coordinates.
-#The bearing is the angle measured in degrees from the north direction (0 degrees) in a clockwise direction
-#The Haversine formula is often used for navigation and geographical applications to determine the direction from one point to another.
-#The resulting bearing is typically expressed as a value between 0 and 360 degrees where 0 degrees is north,
-#90 degrees is east, 180 degrees is south, and 270 degrees is west
-
-
-def bearing_array(df,lat1, long1, lat2, long2):
-    AVG_EARTH_RADIUS = 6371  # in km
-    long_delta_rad = np.radians(long2 - long1)
-    lat1, long1, lat2, long2 = map(np.radians, (lat1, long1, lat2, long2))
-    y = np.sin(long_delta_rad) * np.cos(lat2)
-    x = np.cos(lat1) * np.sin(lat2) - np.sin(lat1) * np.cos(lat2) * np.cos(long_delta_rad)
-    return np.degrees(np.arctan2(y, x))
-
 
 #%%
 
-
-df.loc[:, 'trip_distance(km)'] = haversine_distance(df, 'pickup_latitude', 'dropoff_latitude', 'pickup_longitude','dropoff_longitude')
-
-df.loc[:, 'center_latitude'] = (df['pickup_latitude'].values + df['dropoff_latitude'].values) / 2
-df.loc[:, 'center_longitude'] = (df['pickup_longitude'].values + df['dropoff_longitude'].values) / 2
-
-df.loc[:, 'direction'] = bearing_array(df,df['pickup_latitude'].values, df['pickup_longitude'].values,df['dropoff_latitude'].values, df['dropoff_longitude'].values)
+# The distance, center, direction and datetime features come from trip_features.py.
+# The manhattan distance is only used in new_main.py
+df = df.drop('distance_manhattan', axis=1)
 
 
 #%%
@@ -131,7 +70,10 @@ print(df.isnull().sum())
 # No Null Values
 
 # Check for Duplicates
-print('Number of duplicates, trip ids: {}'.format(len(df) - len(df.drop_duplicates())))  
+print('Number of duplicates, trip ids: {}'.format(len(duplicate_index(df))))
+print('Same trip under another id: {}'.format(len(duplicate_index(df, TRIP_KEY_COLUMNS))))
+print('Near duplicates (same vendor, within a minute and ~10 m): {}'.format(
+    len(duplicate_index(df, TRIP_KEY_COLUMNS, NEAR_DUPLICATE_TOLERANCES))))
 # No duplicates
 
 
@@ -161,47 +103,31 @@ print('Passengers: {} to {}'.format(df.passenger_count.min(), df.passenger_count
 
 print('Empty trips: {}'.format(df[df.passenger_count == 0].shape[0]))
 
-# Remove these rides which have 0 passenger (60 Trips)
-df = df[df['passenger_count'] > 0]
+# These rides which have 0 passenger (60 Trips) are removed by the row filter below
 
 # Taxi can accomodate only 6 members at max 
-# Removing other passenger counts (7,8,9)
+# Other passenger counts (7,8,9) are removed by the row filter below
 print('Trips with Passanger count - 7 : {}'.format(df[df.passenger_count == 9].shape[0])) # 
 
 print('Trips with Passanger count - 8 : {}'.format(df[df.passenger_count == 8].shape[0]))
 
 print('Trips with Passanger count - 9 : {}'.format(df[df.passenger_count == 7].shape[0]))
 
-df = df[df['passenger_count'] < 7]
 
 #%%
 
-df['pickup_datetime'] = pd.to_datetime(df.pickup_datetime)
-df['dropoff_datetime'] = pd.to_datetime(df.dropoff_datetime)
 
-df['month'] = df.pickup_datetime.dt.month
-df['week'] = df['pickup_datetime'].dt.isocalendar().week
-df['weekday'] = df.pickup_datetime.dt.weekday
-df['hour'] = df.pickup_datetime.dt.hour
-df['minute'] = df.pickup_datetime.dt.minute
-df['minute_oftheday'] = df['hour'] * 60 + df['minute']
-df.drop(['minute'], axis=1, inplace=True)
-
-
-df['check_trip_duration'] = (df['dropoff_datetime'] - df['pickup_datetime']).map(lambda x : x.total_seconds())
+df['check_trip_duration'] = trip_duration_seconds(df['pickup_datetime'].values, df['dropoff_datetime'].values)
 
 duration_difference = df[np.abs(df['check_trip_duration'].values  - df['trip_duration'].values) > 1]
 
 print(f"Trip Duration with 0 mins: {duration_difference}")
 
-# Removing the rows with trip duration : 0 mins
+# Rows with trip duration : 0 mins
 print(df[df['trip_duration'] == 0]) # 0 Rows
-df[df['trip_duration'] != 0]
-
-# Removing the rows with more than 100 hours of trip  duration 
-df[df['trip_duration'] < 360000] # 4 rows
 
-df.rename(columns={'trip_duration': 'trip_duration(sec)'}, inplace=True)
+# Rows with more than 100 hours of trip  duration 
+print(df[df['trip_duration'] >= 360000]) # 4 rows
 
 #%%
 
@@ -214,8 +140,17 @@ df = df.drop('check_trip_duration', axis=1)
 
 num_rows_distance_less_than_1_metre = len(df[df['trip_distance(km)'] <= 0.001])
 print(f'Number of rows with trip distance less than 1 metre : {num_rows_distance_less_than_1_metre}')
- 
-df = df[df['trip_distance(km)'] > 0.001]
+
+#%%
+# Removing the empty trips, trips with more than 6 passengers, trips with 0 or more than 100 hours
+# of duration and trips shorter than 1 metre, with a single copy of the frame
+with tracer.stage('row_filter', rows_in=df) as stage:
+    row_filter = trip_row_filter()
+    df = row_filter.apply(df)
+    stage['rows_out'] = df
+print(row_filter.report())
+
+df.rename(columns={'trip_duration': 'trip_duration(sec)'}, inplace=True)
 
 #%%
 # Plotting Pickup cordinates which are outside of New-York (pickup)
@@ -233,15 +168,16 @@ pickup_locations = df[['pickup_longitude', 'pickup_latitude']]
 
 # Define the number of clusters (adjust as needed)
 k_values = range(1, 15)
-inertias = []
 
-for k in k_values:
-    kmeans = KMeans(n_clusters=k, random_state=42)
-    kmeans.fit(pickup_locations)
-    inertias.append(kmeans.inertia_)
+# KMeans on a subsample of the pickups, all k values fitted in parallel
+with tracer.stage('kmeans_sweep', rows_in=pickup_locations) as stage:
+    sweep = kmeans_sweep(pickup_locations, k_values)
+    stage['rows_out'] = sweep.to_frame()
+print(sweep.to_frame())
+print(f'Elbow sweep took {sweep.total_seconds:.1f} s')
 
 # Plot the elbow curve
-plt.plot(k_values, inertias, marker='o')
+plt.plot(sweep.k_values, [sweep.inertias[k] for k in sweep.k_values], marker='o')
 plt.xlabel('Number of Clusters (k)')
 plt.ylabel('Inertia')
 plt.title('Elbow Method for Optimal k')
@@ -252,9 +188,11 @@ plt.show()
 
 num_clusters = 10
 
-# Fit K-means clustering model
-kmeans = KMeans(n_clusters=num_clusters, random_state=42)
-df['pickup_cluster'] = kmeans.fit_predict(pickup_locations)
+# Reusing the K-means model fitted in the elbow sweep
+kmeans = sweep.model(num_clusters)
+with tracer.stage('kmeans_predict', rows_in=pickup_locations) as stage:
+    df['pickup_cluster'] = sweep.predict(pickup_locations, num_clusters)
+    stage['rows_out'] = df['pickup_cluster']
 
 plt.figure(figsize=(10, 6))
 sns.scatterplot(x='pickup_longitude', y='pickup_latitude', hue='pickup_cluster', data=df, palette='viridis')
@@ -266,18 +204,12 @@ plt.show()
 
 #%%
 
-from geopy.geocoders import Nominatim
-
-
-# Initialize a geocoder
-geolocator = Nominatim(user_agent="shanun")
-
-
+from geocoding import NominatimBackend, OfflineBackend, ReverseGeocoder
 
 
-def get_address(latitude, longitude):
-    location = geolocator.reverse((latitude, longitude), language='en')
-    return location.address if location else "Address not found"
+# Initialize a geocoder, the addresses are cached in geocode_cache.sqlite
+# Without network, use OfflineBackend('<address points csv>') instead of the Nominatim backend
+geocoder = ReverseGeocoder(NominatimBackend(user_agent="shanun"))
 
 #selecting top 4 clusters
 top_clusters = df['pickup_cluster'].value_counts().nlargest(4).index
@@ -317,15 +249,16 @@ for cluster in top_clusters:
     
     sampled_locations = cluster_data.sample(n=10, random_state=42)
 
+    # Addresses of all the sampled locations in one batch
+    addresses = geocoder.reverse_many(sampled_locations['pickup_latitude'], sampled_locations['pickup_longitude'])
     
     # Create a MarkerCluster with the cluster number as the name
     marker_cluster = MarkerCluster(name=str(cluster), overlay=True)
     
     # Add markers to the MarkerCluster
-    for _, location in sampled_locations.iterrows():
-        address = get_address(location['pickup_latitude'], location['pickup_longitude'])
+    for (_, location), address in zip(sampled_locations.iterrows(), addresses):
         folium.Marker([location['pickup_latitude'], location['pickup_longitude']],
-                      popup=f"Cluster: {cluster}<br>Address: {address}",
+                      popup=f"Cluster: {cluster}<br>Address: {address or 'lookup failed'}",
                       icon=None).add_to(marker_cluster)
     
     # Add the MarkerCluster to the list
@@ -364,10 +297,18 @@ cols_to_transform = df.drop(cols_to_exclude, axis = 1).columns
 
 # print(df[cols_to_transform].columns)
 
-transformer = PowerTransformer(method='yeo-johnson', standardize=False)
-transformer.set_output(transform='pandas')
+# Lambdas estimated on a 200k row subsample, the columns fitted in parallel
+with tracer.stage('yeo_johnson', rows_in=df) as stage:
+    transformer = YeoJohnson(sample_size=200_000).fit(df[cols_to_transform])
+    print('Yeo-Johnson lambdas fitted in {:.1f} s'.format(transformer.fit_seconds_))
 
-df[cols_to_transform] = transformer.fit_transform(df[cols_to_transform])
+    check_lambda_drift = False # refits every column on all the rows
+
+    if check_lambda_drift:
+        print(transformer.lambda_drift(df[cols_to_transform]))
+
+    df[cols_to_transform] = transformer.transform(df[cols_to_transform])
+    stage['rows_out'] = df
 
 
 #%%
@@ -380,10 +321,13 @@ Outlier_detection_IQR = True # IQR = 1.5
 if Outlier_detection_IQR:
     variable_list = ['trip_duration(sec)','pickup_latitude','pickup_longitude','dropoff_latitude','dropoff_longitude','trip_distance(km)', 'avg_speed_h', 'direction']
     fold_value = 1.5
-    result = find_limits(df, variable_list, fold_value)
-
-    df = clip_variables(df, result)
+    # Clips df in place, the fitted limits stay in clipper.limits_ for new data
+    with tracer.stage('clipping', rows_in=df) as stage:
+        clipper = Clipper(variable_list, fold=fold_value)
+        clipper.fit_transform(df)
+        stage['rows_out'] = df
     print("Cleaned Data")
+    print("Clipped values (below lower limit, above upper limit):", clipper.clip_counts_)
 
 
 #%%
@@ -407,21 +351,13 @@ if Outlier_detection_IQR:
 #%%
 
 # Visulazing distribution of Trip Duration(Sec) 
-sns.kdeplot(df['trip_duration(sec)'], fill=True)
-plt.title('Density Plot of Trip Duration')
-plt.xlabel('Trip Duration')
-plt.ylabel('Density')
-plt.show()
-plt.figure(figsize=(10, 6))
+# Binned FFT density (density_plots.py); with TRIP_PLOTS_DIR set the figures are written there instead of shown
+plot_density(df['trip_duration(sec)'], 'Density Plot of Trip Duration', 'Trip Duration', name='trip_duration')
 
 #%%
 # Visulazing distribution of Trip Distance(km) 
 
-sns.kdeplot(df['trip_distance(km)'], fill=True)
-plt.title('Density Plot of Trip Distance')
-plt.xlabel('Trip Distance')
-plt.ylabel('Density')
-plt.show()
+plot_density(df['trip_distance(km)'], 'Density Plot of Trip Distance', 'Trip Distance', name='trip_distance')
 
 #%%
 
@@ -439,11 +375,13 @@ X_train.shape, y_train.shape, X_test.shape, y_test.shape
 
 
 #%%
-lr = LinearRegression()
+with tracer.stage('linear_regression', rows_in=X_train) as stage:
+    lr = LinearRegression()
 
-lr.fit(X_train, y_train)
+    lr.fit(X_train, y_train)
 
-y_pred_lr = lr.predict(X_test)
+    y_pred_lr = lr.predict(X_test)
+    stage['rows_out'] = y_pred_lr
 
 
 
@@ -451,3 +389,6 @@ rmse_lr = np.sqrt(mean_squared_error(y_test, y_pred_lr))
 print("Root Mean Squared Error on Test Set (linear regression):", rmse_lr)
 
 # %%
+# Where the time and the memory of the run went
+tracer.save(os.path.join(current_directory, 'pipeline_trace.json'))
+print(tracer.report())
@@ -0,0 +1,228 @@
+#%%
+# Tree ensembles (CatBoost, XGBoost, sklearn decision trees and random forests) converted to
+# plain numpy arrays, saved as a directory of .npy files plus a small meta.json (same layout
+# as the entries of feature_cache.py) and loaded back memory-mapped:
+#   - predicting needs numpy only, a scoring process does not pay the seconds of
+#     importing catboost / xgboost / sklearn before its first trip
+#   - the arrays are mapped read-only from the page cache, so the worker processes of a
+#     server or a batch job share one copy of the model instead of one each
+#
+# Two layouts:
+#   - 'nodes' (sklearn, XGBoost): one array per node attribute, all the trees concatenated.
+#     A row goes left when x <= threshold (XGBoost's x < threshold on float32 features is
+#     stored as x <= the float32 just below the threshold), and NaN follows default_left.
+#     Leaves point to themselves, so all the trees are walked together, max_depth steps of
+#     vectorized indexing (the two children of a node are stored side by side, one lookup).
+#   - 'oblivious' (CatBoost symmetric trees): every level of a tree has a single split and
+#     the leaf index is made of the split results (bit i for the split of level i).
+#     Shallower trees are padded with splits that are never true.
+# The prediction is scale * (sum or mean of the leaf values of the trees) + bias, the raw
+# score of the model (regression objectives with an identity link only).
+
+import json
+import os
+import shutil
+import tempfile
+import uuid
+
+import numpy as np
+
+
+_META_FILE = 'meta.json'
+
+# Rows per block in predict, bounds the (rows, trees) index arrays to a few MB
+PREDICT_BLOCK_SIZE = 4096
+
+SKLEARN_FORESTS = ('RandomForestRegressor', 'ExtraTreesRegressor')
+
+XGBOOST_OBJECTIVES = ('reg:squarederror', 'reg:absoluteerror', 'reg:pseudohubererror', 'reg:quantileerror')
+
+
+#%%
+
+# Node arrays of one tree; children of -1 mark the leaves
+
+def _node_tree(feature, threshold, left, right, default_left, value):
+    left = np.asarray(left, dtype=np.int64)
+    right = np.asarray(right, dtype=np.int64)
+    leaves = left < 0
+    own = np.arange(len(left))
+    feature = np.where(leaves, 0, feature).astype(np.int32)
+    # Depth of the deepest leaf, one step per level in predict
+    depth = np.zeros(len(left), dtype=np.int64)
+    for node in range(len(left)):
+        if not leaves[node]:
+            depth[left[node]] = depth[right[node]] = depth[node] + 1
+    return {'feature': feature, 'threshold': np.where(leaves, 0, threshold).astype(np.float64),
+            'left': np.where(leaves, own, left), 'right': np.where(leaves, own, right),
+            'default_left': np.asarray(default_left, dtype=bool), 'value': np.asarray(value, dtype=np.float64),
+            'depth': int(depth.max())}
+
+
+def _concatenate_trees(trees):
+    offsets = np.cumsum([0] + [len(tree['left']) for tree in trees[:-1]])
+    arrays = {'roots': offsets.astype(np.int64)}
+    for name in ('feature', 'threshold', 'default_left', 'value'):
+        arrays[name] = np.concatenate([tree[name] for tree in trees])
+    arrays['children'] = np.concatenate([np.column_stack([tree['left'], tree['right']]).ravel() + offset
+                                         for tree, offset in zip(trees, offsets)]).astype(np.int32)
+    return arrays, max(tree['depth'] for tree in trees)
+
+
+def _from_sklearn(model):
+    estimators = getattr(model, 'estimators_', [model])
+    trees = []
+    for estimator in estimators:
+        tree = estimator.tree_
+        if tree.n_outputs != 1:
+            raise ValueError('Only single output trees can be converted')
+        default_left = getattr(tree, 'missing_go_to_left', np.zeros(tree.node_count, dtype=bool))
+        trees.append(_node_tree(tree.feature, tree.threshold, tree.children_left, tree.children_right,
+                                default_left, tree.value[:, 0, 0]))
+    arrays, depth = _concatenate_trees(trees)
+    return arrays, {'layout': 'nodes', 'depth': depth, 'aggregate': 'mean', 'scale': 1.0, 'bias': 0.0}
+
+
+def _from_xgboost(model):
+    booster = model.get_booster() if hasattr(model, 'get_booster') else model
+    learner = json.loads(booster.save_raw(raw_format='json'))['learner']
+    if learner['objective']['name'] not in XGBOOST_OBJECTIVES:
+        raise ValueError('Objective {} is not supported'.format(learner['objective']['name']))
+    if learner['gradient_booster']['name'] != 'gbtree':
+        raise ValueError('Only gbtree boosters can be converted')
+    trees = []
+    for tree in learner['gradient_booster']['model']['trees']:
+        if tree['categories_nodes']:
+            raise ValueError('Categorical splits are not supported')
+        conditions = np.asarray(tree['split_conditions'], dtype=np.float32)
+        leaves = np.asarray(tree['left_children']) < 0
+        # x < c on float32 values is x <= the float32 before c
+        thresholds = np.where(leaves, 0, np.nextafter(conditions, np.float32(-np.inf)))
+        trees.append(_node_tree(tree['split_indices'], thresholds, tree['left_children'], tree['right_children'],
+                                tree['default_left'], np.where(leaves, conditions, 0)))
+    arrays, depth = _concatenate_trees(trees)
+    base_score = float(learner['learner_model_param']['base_score'].strip('[]'))
+    return arrays, {'layout': 'nodes', 'depth': depth, 'aggregate': 'sum', 'scale': 1.0, 'bias': base_score}
+
+
+def _from_catboost(model):
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'model.json')
+        model.save_model(path, format='json')
+        with open(path) as f:
+            params = json.load(f)
+    if 'oblivious_trees' not in params:
+        raise ValueError('Only symmetric trees (grow_policy SymmetricTree) can be converted')
+    columns = {feature['feature_index']: feature['flat_feature_index']
+               for feature in params['features_info']['float_features']}
+    trees = params['oblivious_trees']
+    depth = max(len(tree['splits']) for tree in trees)
+    features = np.zeros((len(trees), depth), dtype=np.int32)
+    # Padding levels are never true
+    borders = np.full((len(trees), depth), np.inf)
+    leaf_values = np.zeros((len(trees), 2 ** depth))
+    for i, tree in enumerate(trees):
+        for level, split in enumerate(tree['splits']):
+            if split['split_type'] != 'FloatFeature':
+                raise ValueError('Only float feature splits are supported')
+            features[i, level] = columns[split['float_feature_index']]
+            borders[i, level] = split['border']
+        leaf_values[i, :len(tree['leaf_values'])] = tree['leaf_values']
+    scale, bias = params['scale_and_bias']
+    return ({'features': features, 'borders': borders, 'leaf_values': leaf_values},
+            {'layout': 'oblivious', 'depth': depth, 'aggregate': 'sum', 'scale': float(scale), 'bias': float(sum(bias))})
+
+
+#%%
+
+class FlatTreeModel:
+
+    def __init__(self, arrays, meta):
+        self.arrays = arrays
+        self.meta = meta
+
+    @classmethod
+    def from_model(cls, model):
+        module = type(model).__module__.split('.')[0]
+        if module == 'catboost':
+            return cls(*_from_catboost(model))
+        if module == 'xgboost':
+            return cls(*_from_xgboost(model))
+        if module == 'sklearn' and (hasattr(model, 'tree_') or type(model).__name__ in SKLEARN_FORESTS):
+            return cls(*_from_sklearn(model))
+        raise ValueError('Cannot convert a {} to flat trees'.format(type(model).__name__))
+
+    @property
+    def n_trees(self):
+        if self.meta['layout'] == 'oblivious':
+            return len(self.arrays['leaf_values'])
+        return len(self.arrays['roots'])
+
+    def _predict_nodes(self, X):
+        arrays = self.arrays
+        # Row offsets in the flattened X, so each level is 1d indexing only
+        flat_X = X.ravel()
+        row_offsets = (np.arange(len(X)) * X.shape[1])[:, None]
+        has_nan = np.isnan(flat_X).any()
+        nodes = np.broadcast_to(arrays['roots'], (len(X), len(arrays['roots'])))
+        for _ in range(self.meta['depth']):
+            values = flat_X[row_offsets + arrays['feature'][nodes]]
+            go_left = values <= arrays['threshold'][nodes]
+            if has_nan:
+                missing = np.isnan(values)
+                go_left[missing] = arrays['default_left'][nodes[missing]]
+            # Children stored side by side, left then right
+            children = arrays['children'][2 * nodes + ~go_left]
+            # Every row is at a leaf of every tree, most paths are shorter than the deepest one
+            if np.array_equal(children, nodes):
+                break
+            nodes = children
+        return arrays['value'][nodes]
+
+    def _predict_oblivious(self, X):
+        arrays = self.arrays
+        # Transposed, a level of all the trees is a copy of whole feature rows
+        X = np.ascontiguousarray(X.T)
+        leaves = np.zeros((self.n_trees, X.shape[1]), dtype=np.int32)
+        for level in range(self.meta['depth']):
+            np.add(leaves, 1 << level, out=leaves,
+                   where=X[arrays['features'][:, level]] > arrays['borders'][:, level, None])
+        offsets = np.arange(self.n_trees) * arrays['leaf_values'].shape[1]
+        return arrays['leaf_values'].ravel()[leaves + offsets[:, None]].T
+
+    # Raw score of every row of X (2d array of the features the model was trained on)
+
+    def predict(self, X):
+        X = np.asarray(X, dtype=np.float32)
+        if X.ndim == 1:
+            X = X[None, :]
+        predict_block = self._predict_oblivious if self.meta['layout'] == 'oblivious' else self._predict_nodes
+        predictions = np.empty(len(X))
+        for start in range(0, len(X), PREDICT_BLOCK_SIZE):
+            leaf_values = predict_block(X[start:start + PREDICT_BLOCK_SIZE])
+            total = leaf_values.mean(axis=1) if self.meta['aggregate'] == 'mean' else leaf_values.sum(axis=1)
+            predictions[start:start + PREDICT_BLOCK_SIZE] = self.meta['scale'] * total + self.meta['bias']
+        return predictions
+
+    # Written to a temporary directory first and renamed at the end, like feature_cache.save_frame
+
+    def save(self, directory):
+        tmp_directory = '{}.tmp-{}'.format(directory, uuid.uuid4().hex)
+        os.makedirs(tmp_directory)
+        for name, values in self.arrays.items():
+            np.save(os.path.join(tmp_directory, '{}.npy'.format(name)), values)
+        with open(os.path.join(tmp_directory, _META_FILE), 'w') as f:
+            json.dump(dict(self.meta, arrays=list(self.arrays)), f)
+        if os.path.exists(directory):
+            shutil.rmtree(directory)
+        os.rename(tmp_directory, directory)
+        return directory
+
+    @classmethod
+    def load(cls, directory, mmap=True):
+        with open(os.path.join(directory, _META_FILE)) as f:
+            meta = json.load(f)
+        mmap_mode = 'r' if mmap else None
+        arrays = {name: np.load(os.path.join(directory, '{}.npy'.format(name)), mmap_mode=mmap_mode)
+                  for name in meta.pop('arrays')}
+        return cls(arrays, meta)
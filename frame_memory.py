@@ -0,0 +1,186 @@
+#%%
+# Memory profile of a trip frame and the smallest safe dtype of every column.
+#
+# After the feature cells of the scripts the frame holds float64 columns (power transform,
+# speeds), int64 one-hot columns (pd.get_dummies(..., dtype=int)), nullable integers and the
+# id strings as Python objects. compact_frame downcasts each column:
+#   - integers (nullable ones without missing values too) to the smallest type holding their
+#     min and max, 0/1 columns (one-hot) to int8
+#   - floats to float32 when the values stay within float_rtol of the float64 ones (float32
+#     keeps ~7 significant digits, the tree models bin their features as float32 anyway),
+#     integral floats without NaN to the smallest integer type
+#   - ids of a fixed prefix + fixed width digits ('id2875421') to their number as uint32,
+#     the prefix and width kept in df.attrs so restore_ids gives the strings back
+#   - other strings with few distinct values (below categorical_ratio of the rows) to categories
+# one_hot_to_codes replaces a group of one-hot columns by a single categorical column.
+#
+# memory_profile is the per-column table (deep bytes, so object strings are counted), the
+# report of compact_frame has the bytes of each column before and after. prediction_drift
+# checks that a model scores the compacted frame like the original one.
+
+import re
+
+import numpy as np
+import pandas as pd
+
+
+DEFAULT_FLOAT_RTOL = 1e-6
+
+DEFAULT_CATEGORICAL_RATIO = 0.5
+
+_INTEGER_TYPES = [np.int8, np.uint8, np.int16, np.uint16, np.int32, np.uint32, np.int64, np.uint64]
+
+_ID_PATTERN = re.compile(r'^(\D*)(\d+)$')
+
+
+#%%
+
+def memory_profile(df):
+    usage = df.memory_usage(deep=True, index=False)
+    profile = pd.DataFrame({'dtype': df.dtypes.astype(str), 'bytes': usage})
+    profile['share'] = profile['bytes'] / max(int(usage.sum()), 1)
+    return profile.sort_values('bytes', ascending=False)
+
+
+def smallest_integer_type(min_value, max_value):
+    for dtype in _INTEGER_TYPES:
+        info = np.iinfo(dtype)
+        if info.min <= min_value and max_value <= info.max:
+            return dtype
+    return None
+
+
+def _downcast_integers(values):
+    if len(values) == 0:
+        return values
+    dtype = smallest_integer_type(values.min(), values.max())
+    return values.astype(dtype) if dtype is not None and np.dtype(dtype).itemsize < values.dtype.itemsize else values
+
+
+def _downcast_floats(values, float_rtol):
+    finite = np.isfinite(values)
+    if finite.all() and len(values) and np.array_equal(values, np.round(values)):
+        dtype = smallest_integer_type(values.min(), values.max())
+        if dtype is not None and np.dtype(dtype).itemsize < values.dtype.itemsize:
+            return values.astype(dtype)
+    if values.dtype.itemsize <= 4:
+        return values
+    with np.errstate(over='ignore', invalid='ignore'):
+        narrow = values.astype(np.float32)
+        error = np.abs(narrow.astype(np.float64) - values)
+    # inf and NaN stay what they were, overflows to inf fail the check
+    same_special = np.array_equal(np.isfinite(narrow), finite)
+    if same_special and not (error[finite] > float_rtol * np.abs(values[finite])).any():
+        return narrow
+    return values
+
+
+# Kaggle / TLC style ids: one prefix and a number of fixed width, kept as (prefix, width, numbers)
+
+def split_ids(values):
+    values = np.asarray(values, dtype=object)
+    if len(values) == 0 or not all(isinstance(value, str) for value in values[:1000]):
+        return None
+    match = _ID_PATTERN.match(values[0])
+    if match is None:
+        return None
+    prefix, width = match.group(1), len(match.group(2))
+    strings = values.astype(str)
+    if not (np.char.startswith(strings, prefix).all() and (np.char.str_len(strings) == len(prefix) + width).all()):
+        return None
+    digits = np.char.replace(strings, prefix, '', count=1) if prefix else strings
+    if not np.char.isdigit(digits).all():
+        return None
+    numbers = digits.astype(np.uint64)
+    return prefix, width, _downcast_integers(numbers)
+
+
+def restore_ids(numbers, prefix, width):
+    return np.char.add(prefix, np.char.zfill(np.asarray(numbers).astype(str), width)).astype(object)
+
+
+# Column with the smallest safe dtype, and the id (prefix, width) when it was an id column
+
+def compact_column(series, float_rtol=DEFAULT_FLOAT_RTOL, categorical_ratio=DEFAULT_CATEGORICAL_RATIO):
+    dtype = series.dtype
+    if isinstance(dtype, pd.CategoricalDtype) or dtype == bool:
+        return series, None
+    if isinstance(dtype, pd.api.extensions.ExtensionDtype) and dtype.kind in 'iuf':
+        # Nullable numbers: plain numpy when nothing is missing, else the smallest nullable type
+        if not series.isna().any():
+            return compact_column(pd.Series(series.to_numpy(dtype=dtype.numpy_dtype), index=series.index,
+                                            name=series.name), float_rtol, categorical_ratio)
+        if dtype.kind in 'iu':
+            return pd.to_numeric(series, downcast='unsigned' if series.min() >= 0 else 'integer'), None
+        return series, None
+    if dtype.kind in 'iu':
+        return pd.Series(_downcast_integers(series.to_numpy()), index=series.index, name=series.name), None
+    if dtype.kind == 'f':
+        return pd.Series(_downcast_floats(series.to_numpy(), float_rtol), index=series.index, name=series.name), None
+    if dtype.kind == 'O' or pd.api.types.is_string_dtype(dtype):
+        ids = split_ids(series.to_numpy(dtype=object))
+        if ids is not None:
+            prefix, width, numbers = ids
+            return pd.Series(numbers, index=series.index, name=series.name), (prefix, width)
+        if series.nunique(dropna=False) < categorical_ratio * len(series):
+            return series.astype('category'), None
+    return series, None
+
+
+# Compacted copy of df (or df itself with inplace=True) and the report of every column:
+# dtype and bytes before and after
+
+def compact_frame(df, float_rtol=DEFAULT_FLOAT_RTOL, categorical_ratio=DEFAULT_CATEGORICAL_RATIO, inplace=False):
+    before = memory_profile(df)
+    data = df if inplace else df.copy(deep=False)
+    id_columns = dict(data.attrs.get('id_columns', {}))
+    for column in list(data.columns):
+        values, ids = compact_column(data[column], float_rtol, categorical_ratio)
+        if values.dtype != data[column].dtype:
+            data[column] = values
+        if ids is not None:
+            id_columns[column] = list(ids)
+    if id_columns:
+        data.attrs['id_columns'] = id_columns
+    after = memory_profile(data)
+    report = pd.DataFrame({'dtype_before': before['dtype'], 'bytes_before': before['bytes'],
+                           'dtype_after': after['dtype'], 'bytes_after': after['bytes']})
+    report['bytes_saved'] = report['bytes_before'] - report['bytes_after']
+    return data, report.sort_values('bytes_saved', ascending=False)
+
+
+def format_report(report):
+    before = report['bytes_before'].sum()
+    after = report['bytes_after'].sum()
+    return '{}\n{:.1f} MB -> {:.1f} MB, {:.1f} MB saved ({:.1f}x smaller)'.format(
+        report.to_string(), before / 1e6, after / 1e6, (before - after) / 1e6, before / max(after, 1))
+
+
+# Id columns of a compacted frame back to their strings
+
+def restore_id_columns(df):
+    for column, (prefix, width) in df.attrs.get('id_columns', {}).items():
+        df[column] = restore_ids(df[column].to_numpy(), prefix, width)
+    df.attrs.pop('id_columns', None)
+    return df
+
+
+#%%
+
+# One categorical column (int8 codes) in place of the one-hot columns of a group,
+# categories named after the columns; rows with no column set are missing
+
+def one_hot_to_codes(df, columns, name):
+    values = df[columns].to_numpy()
+    codes = np.where(values.any(axis=1), values.argmax(axis=1), -1).astype(np.int8)
+    data = df.drop(columns=columns)
+    data[name] = pd.Categorical.from_codes(codes, categories=[str(column) for column in columns])
+    return data
+
+
+# Largest absolute difference between the predictions of a model on two versions of the features
+
+def prediction_drift(model, X_before, X_after):
+    before = np.asarray(model.predict(X_before), dtype=np.float64)
+    after = np.asarray(model.predict(X_after), dtype=np.float64)
+    return float(np.max(np.abs(before - after))) if len(before) else 0.0
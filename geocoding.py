@@ -0,0 +1,235 @@
+#%%
+# Reverse geocoding of pickup/dropoff points (coordinates -> address).
+#
+# ReverseGeocoder looks addresses up in batches: coordinates are rounded (4 decimals,
+# ~10 m), looked up in a persistent sqlite cache, and only the missing ones are sent to
+# a backend:
+#   - NominatimBackend queries a Nominatim server over HTTP with a bounded number of
+#     concurrent requests and a rate limit (the public server allows 1 request/s).
+#     base_url can point to a local server, e.g. the StubNominatimServer below in tests.
+#   - OfflineBackend answers from a local gazetteer / address point file with a KD-tree,
+#     so no network is needed at all.
+# A lookup that fails (HTTP error, timeout, bad response) gives None for its point, the
+# other points of the batch are still returned and cached; the failed ones are not cached,
+# so they are sent again by the next batch.
+
+import http.client
+import json
+import math
+import sqlite3
+import threading
+import time
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import pandas as pd
+
+
+NOT_FOUND = "Address not found"
+
+NOMINATIM_URL = 'https://nominatim.openstreetmap.org'
+
+EARTH_RADIUS_KM = 6371
+
+
+#%%
+
+class RateLimiter:
+
+    def __init__(self, requests_per_second):
+        self.interval = 1 / requests_per_second if requests_per_second else 0
+        self._next_time = 0
+        self._lock = threading.Lock()
+
+    # Blocks until the next request is allowed
+
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            wait_time = self._next_time - now
+            self._next_time = max(now, self._next_time) + self.interval
+        if wait_time > 0:
+            time.sleep(wait_time)
+
+
+class NominatimBackend:
+
+    def __init__(self, user_agent, base_url=NOMINATIM_URL, max_concurrency=1, requests_per_second=1.0,
+                 timeout=10, language='en'):
+        self.user_agent = user_agent
+        self.base_url = base_url.rstrip('/')
+        self.max_concurrency = max_concurrency
+        self.rate_limiter = RateLimiter(requests_per_second)
+        self.timeout = timeout
+        self.language = language
+
+    def reverse(self, latitude, longitude):
+        self.rate_limiter.wait()
+        query = urllib.parse.urlencode({'lat': latitude, 'lon': longitude, 'format': 'jsonv2',
+                                        'accept-language': self.language})
+        request = urllib.request.Request('{}/reverse?{}'.format(self.base_url, query),
+                                         headers={'User-Agent': self.user_agent})
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            location = json.load(response)
+        return location.get('display_name') or NOT_FOUND
+
+    # Address of every point, None for the points whose request failed (errors_ has the
+    # (latitude, longitude, error) of those)
+
+    def _try_reverse(self, latitude, longitude):
+        try:
+            return self.reverse(latitude, longitude), None
+        except (OSError, ValueError, http.client.HTTPException) as error:
+            return None, error
+
+    def reverse_many(self, latitudes, longitudes):
+        with ThreadPoolExecutor(max_workers=self.max_concurrency) as executor:
+            results = list(executor.map(self._try_reverse, latitudes, longitudes))
+        self.errors_ = [(latitude, longitude, error) for latitude, longitude, (_, error)
+                        in zip(latitudes, longitudes, results) if error is not None]
+        return [address for address, _ in results]
+
+
+#%%
+
+# Points on the unit sphere, so euclidean distances in the KD-tree follow great circle distances
+
+def _unit_vectors(latitudes, longitudes):
+    phi = np.radians(np.asarray(latitudes, dtype=np.float64))
+    lam = np.radians(np.asarray(longitudes, dtype=np.float64))
+    return np.column_stack([np.cos(phi) * np.cos(lam), np.cos(phi) * np.sin(lam), np.sin(phi)])
+
+
+# gazetteer: frame or csv file with latitude, longitude and address columns
+# (e.g. the NYC address points of NYC Open Data).
+# Points further than max_distance_km from any address are NOT_FOUND.
+
+class OfflineBackend:
+
+    def __init__(self, gazetteer, max_distance_km=0.5, latitude='latitude', longitude='longitude', address='address'):
+        from scipy.spatial import cKDTree
+
+        if not isinstance(gazetteer, pd.DataFrame):
+            gazetteer = pd.read_csv(gazetteer, usecols=[latitude, longitude, address])
+        self.addresses = gazetteer[address].to_numpy(dtype=object)
+        self.tree = cKDTree(_unit_vectors(gazetteer[latitude], gazetteer[longitude]))
+        # Chord length of the maximum great circle distance
+        self.max_chord = 2 * math.sin(max_distance_km / EARTH_RADIUS_KM / 2)
+
+    def reverse_many(self, latitudes, longitudes):
+        distances, indices = self.tree.query(_unit_vectors(latitudes, longitudes), distance_upper_bound=self.max_chord)
+        found = np.isfinite(distances)
+        return [self.addresses[i] if ok else NOT_FOUND for i, ok in zip(indices, found)]
+
+    def reverse(self, latitude, longitude):
+        return self.reverse_many([latitude], [longitude])[0]
+
+
+#%%
+
+# Persistent cache of addresses keyed by rounded coordinates
+
+class GeocodeCache:
+
+    def __init__(self, path, precision=4):
+        self.precision = precision
+        self.connection = sqlite3.connect(path)
+        self.connection.execute('CREATE TABLE IF NOT EXISTS addresses '
+                                '(latitude REAL, longitude REAL, address TEXT, PRIMARY KEY (latitude, longitude))')
+
+    def key(self, latitude, longitude):
+        return round(float(latitude), self.precision), round(float(longitude), self.precision)
+
+    def get_many(self, keys):
+        found = {}
+        keys = list(keys)
+        # sqlite limits the number of parameters of a query
+        for start in range(0, len(keys), 400):
+            batch = keys[start:start + 400]
+            condition = ' OR '.join(['(latitude = ? AND longitude = ?)'] * len(batch))
+            rows = self.connection.execute('SELECT latitude, longitude, address FROM addresses WHERE ' + condition,
+                                           [value for key in batch for value in key])
+            found.update(((latitude, longitude), address) for latitude, longitude, address in rows)
+        return found
+
+    def put_many(self, items):
+        with self.connection:
+            self.connection.executemany('INSERT OR REPLACE INTO addresses VALUES (?, ?, ?)',
+                                        [(latitude, longitude, address) for (latitude, longitude), address in items])
+
+    def close(self):
+        self.connection.close()
+
+
+class ReverseGeocoder:
+
+    def __init__(self, backend, cache_path='geocode_cache.sqlite', precision=4):
+        self.backend = backend
+        self.cache = GeocodeCache(cache_path, precision)
+
+    def reverse_many(self, latitudes, longitudes):
+        keys = [self.cache.key(latitude, longitude) for latitude, longitude in zip(latitudes, longitudes)]
+        unique_keys = list(dict.fromkeys(keys))
+        addresses = self.cache.get_many(unique_keys)
+
+        missing = [key for key in unique_keys if key not in addresses]
+        if missing:
+            found = self.backend.reverse_many([key[0] for key in missing], [key[1] for key in missing])
+            new_addresses = dict(zip(missing, found))
+            # Failed lookups (None) are not cached
+            self.cache.put_many((key, address) for key, address in new_addresses.items() if address is not None)
+            addresses.update(new_addresses)
+        return [addresses[key] for key in keys]
+
+    def reverse(self, latitude, longitude):
+        return self.reverse_many([latitude], [longitude])[0]
+
+
+#%%
+
+# Local stand-in for the Nominatim /reverse endpoint, answering from any backend
+# (usually an OfflineBackend). Runs in a background thread:
+#   server = StubNominatimServer(OfflineBackend(gazetteer)).start()
+#   NominatimBackend('test', base_url=server.url, requests_per_second=None, max_concurrency=8)
+
+class StubNominatimServer:
+
+    def __init__(self, backend, host='127.0.0.1', port=0):
+        self.backend = backend
+        self.requests = 0
+        self._lock = threading.Lock()
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                url = urllib.parse.urlparse(self.path)
+                params = urllib.parse.parse_qs(url.query)
+                if url.path != '/reverse' or 'lat' not in params or 'lon' not in params:
+                    self.send_error(400)
+                    return
+                with stub._lock:
+                    stub.requests += 1
+                address = stub.backend.reverse(float(params['lat'][0]), float(params['lon'][0]))
+                body = json.dumps({} if address == NOT_FOUND else {'display_name': address}).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.url = 'http://{}:{}'.format(*self.server.server_address)
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
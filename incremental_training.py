@@ -0,0 +1,276 @@
+#%%
+# Out-of-core training: the models are fed a trip file chunk by chunk (trip_loader.iter_trips),
+# so the memory used depends on the chunk size and not on the number of trips, and months or
+# years of TLC data can be trained on one node.
+#
+#   1. fit_preprocessor: one pass fitting a TripPreprocessor with streaming statistics
+#      (TripPreprocessor.fit_stream: reservoir sample + quantile sketches)
+#   2. training_chunks: each chunk is cleaned (row_filters.trip_row_filter) and transformed
+#      into a float32 feature matrix and the transformed target
+#   3. the models:
+#      - train_partial_fit: sklearn models with partial_fit (SGDRegressor,
+#        PassiveAggressiveRegressor, MLPRegressor...). The features are standardized with
+#        the RunningMoments of one more pass, rows are shuffled within each chunk (TLC files
+#        are sorted by time) and the file is read again for every epoch.
+#      - train_xgboost: XGBoost external memory. The chunks go through an xgboost.DataIter
+#        into an ExtMemQuantileDMatrix, which keeps the quantized pages in a cache on disk.
+#      - train_catboost: CatBoost loads the whole training pool in memory, also when it is
+#        read from a file, so each chunk adds trees to the model of the previous chunks
+#        (init_model) instead. The model has a budget of `iterations` trees in all, split
+#        evenly over the chunks of the file (counted from its lines before training), so its
+#        size and scoring latency do not grow with the file. Each chunk only fits its own
+#        share of the trees and is not seen again: the first chunks weigh as much as the
+#        last ones, but the trees fitted on them never learn from the rows that come later.
+#
+# A fixed fraction of the rows (picked with a hash of the row number, the same rows on every
+# pass) is held out; evaluate() streams them to compute the RMSE and RMSLE in seconds.
+#
+#   python incremental_training.py train.csv --model xgboost --output trip_model.json \
+#       --preprocessor trip_preprocessor.json --chunksize 500000
+
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from model_io import save_model
+from preprocessing_pipeline import TARGET, TripPreprocessor
+from row_filters import trip_row_filter
+from stage_trace import peak_rss_mb
+from streaming_stats import RunningMoments
+from trip_features import add_geo_features
+from trip_loader import DEFAULT_CHUNKSIZE, iter_trips
+
+
+TEST_FRACTION = 0.1
+
+MODELS = ['sgd', 'xgboost', 'catboost']
+
+
+#%%
+
+# Rows of the held out part: a multiplicative hash of the row number, uniform in [0, 1)
+
+def holdout_mask(index, test_fraction=TEST_FRACTION):
+    hashed = (np.asarray(index, dtype=np.uint64) * np.uint64(2654435761)) % np.uint64(2 ** 32)
+    return hashed / 2 ** 32 < test_fraction
+
+
+# Cleaned frames of the training (part='train') or held out (part='test') rows
+
+def cleaned_chunks(path, chunksize=DEFAULT_CHUNKSIZE, part='train', test_fraction=TEST_FRACTION):
+    row_filter = trip_row_filter()
+    for chunk in iter_trips(path, chunksize):
+        held_out = holdout_mask(chunk.index, test_fraction)
+        chunk = chunk[held_out if part == 'test' else ~held_out]
+        # The distance is needed by the row filter, feature_arrays reuses it
+        chunk = row_filter.apply(add_geo_features(chunk))
+        if len(chunk):
+            yield chunk
+
+
+def fit_preprocessor(path, chunksize=DEFAULT_CHUNKSIZE, test_fraction=TEST_FRACTION, **params):
+    return TripPreprocessor(**params).fit_stream(cleaned_chunks(path, chunksize, 'train', test_fraction))
+
+
+# (X, y) pairs: float32 features and the transformed target
+
+def training_chunks(path, preprocessor, chunksize=DEFAULT_CHUNKSIZE, part='train', test_fraction=TEST_FRACTION):
+    for chunk in cleaned_chunks(path, chunksize, part, test_fraction):
+        yield preprocessor.transform(chunk), preprocessor.transform_target(chunk[TARGET])
+
+
+#%%
+
+# Model trained on standardized features, predicting from unscaled ones
+
+class ScaledRegressor:
+
+    def __init__(self, model, mean, scale):
+        self.model = model
+        self.mean = mean
+        self.scale = scale
+
+    def predict(self, X):
+        return self.model.predict((np.asarray(X, dtype=np.float64) - self.mean) / self.scale)
+
+
+def feature_moments(path, preprocessor, chunksize=DEFAULT_CHUNKSIZE, test_fraction=TEST_FRACTION):
+    moments = RunningMoments()
+    for X, _ in training_chunks(path, preprocessor, chunksize, 'train', test_fraction):
+        moments.update(X)
+    return moments
+
+
+def train_partial_fit(model, path, preprocessor, chunksize=DEFAULT_CHUNKSIZE, epochs=1, test_fraction=TEST_FRACTION,
+                      random_state=42):
+    moments = feature_moments(path, preprocessor, chunksize, test_fraction)
+    rng = np.random.default_rng(random_state)
+    for _ in range(epochs):
+        for X, y in training_chunks(path, preprocessor, chunksize, 'train', test_fraction):
+            order = rng.permutation(len(y))
+            model.partial_fit((X[order] - moments.mean) / moments.scale, y[order])
+    return ScaledRegressor(model, moments.mean, moments.scale)
+
+
+#%%
+
+def _chunk_iterator(make_chunks, cache_prefix):
+    import xgboost as xgb
+
+    class ChunkIterator(xgb.DataIter):
+
+        def __init__(self):
+            self._chunks = None
+            super().__init__(cache_prefix=cache_prefix, release_data=True)
+
+        def next(self, input_data):
+            if self._chunks is None:
+                self._chunks = make_chunks()
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                return False
+            X, y = chunk
+            input_data(data=X, label=y)
+            return True
+
+        def reset(self):
+            self._chunks = None
+
+    return ChunkIterator()
+
+
+# Returns the Booster; saved as .json it loads back as an XGBRegressor (model_io.load_model).
+# cache_dir holds the external memory pages during the training (a temporary directory by default).
+
+def train_xgboost(path, preprocessor, chunksize=DEFAULT_CHUNKSIZE, params=None, num_boost_round=200,
+                  test_fraction=TEST_FRACTION, cache_dir=None):
+    import xgboost as xgb
+
+    params = dict({'tree_method': 'hist', 'objective': 'reg:squarederror', 'learning_rate': 0.1, 'max_depth': 8},
+                  **(params or {}))
+    with tempfile.TemporaryDirectory(dir=cache_dir) as directory:
+        iterator = _chunk_iterator(lambda: training_chunks(path, preprocessor, chunksize, 'train', test_fraction),
+                                   os.path.join(directory, 'trips'))
+        if hasattr(xgb, 'ExtMemQuantileDMatrix'):
+            dtrain = xgb.ExtMemQuantileDMatrix(iterator, max_bin=params.get('max_bin', 256))
+        else:
+            # xgboost < 2.1
+            dtrain = xgb.DMatrix(iterator)
+        booster = xgb.train(params, dtrain, num_boost_round=num_boost_round)
+        # The cache files are removed with the matrix, before the directory
+        del dtrain, iterator
+    return booster
+
+
+# Chunks of at most chunksize rows in the CSV file at path (from its number of lines)
+
+def count_chunks(path, chunksize=DEFAULT_CHUNKSIZE):
+    lines = 0
+    last = b'\n'
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 24), b''):
+            lines += block.count(b'\n')
+            last = block[-1:]
+    # The header line, and a last line without a newline
+    rows = lines - 1 + (last != b'\n')
+    return max(1, -(-rows // chunksize))
+
+
+# iterations: trees of the final model, each chunk adds iterations // n_chunks of them (at
+# least one). n_chunks is counted from the file when not given.
+
+def train_catboost(path, preprocessor, chunksize=DEFAULT_CHUNKSIZE, params=None, iterations=1000, n_chunks=None,
+                   test_fraction=TEST_FRACTION):
+    from catboost import CatBoostRegressor
+
+    params = dict({'learning_rate': 0.1, 'depth': 8, 'verbose': False}, **(params or {}))
+    if n_chunks is None:
+        n_chunks = count_chunks(path, chunksize)
+    iterations_per_chunk = max(1, iterations // n_chunks)
+    model = None
+    for X, y in training_chunks(path, preprocessor, chunksize, 'train', test_fraction):
+        if model is not None and model.tree_count_ + iterations_per_chunk > max(iterations, n_chunks):
+            break
+        chunk_model = CatBoostRegressor(iterations=iterations_per_chunk, **params)
+        chunk_model.fit(X, y, init_model=model)
+        model = chunk_model
+    return model
+
+
+#%%
+
+# Trees of a boosted model (None for the other models)
+
+def tree_count(model):
+    if hasattr(model, 'num_boosted_rounds'):
+        return model.num_boosted_rounds()
+    return getattr(model, 'tree_count_', None)
+
+
+def _predict(model, X):
+    # Booster of train_xgboost
+    if hasattr(model, 'inplace_predict'):
+        return model.inplace_predict(X)
+    return model.predict(X)
+
+
+# RMSE and RMSLE in seconds on the held out rows
+
+def evaluate(model, path, preprocessor, chunksize=DEFAULT_CHUNKSIZE, test_fraction=TEST_FRACTION):
+    n = 0
+    squared_error = 0.0
+    squared_log_error = 0.0
+    for chunk in cleaned_chunks(path, chunksize, 'test', test_fraction):
+        durations = preprocessor.inverse_transform_target(_predict(model, preprocessor.transform(chunk)))
+        actual = chunk[TARGET].to_numpy(dtype=np.float64)
+        n += len(actual)
+        squared_error += float(((durations - actual) ** 2).sum())
+        squared_log_error += float(((np.log1p(durations) - np.log1p(actual)) ** 2).sum())
+    return {'rows': n, 'rmse': float(np.sqrt(squared_error / n)), 'rmsle': float(np.sqrt(squared_log_error / n))}
+
+
+def train(path, model='xgboost', chunksize=DEFAULT_CHUNKSIZE, test_fraction=TEST_FRACTION, **params):
+    preprocessor = fit_preprocessor(path, chunksize, test_fraction)
+    if model == 'sgd':
+        from sklearn.linear_model import SGDRegressor
+
+        regressor = train_partial_fit(SGDRegressor(**params), path, preprocessor, chunksize, epochs=3,
+                                      test_fraction=test_fraction)
+    elif model == 'xgboost':
+        regressor = train_xgboost(path, preprocessor, chunksize, params, test_fraction=test_fraction)
+    elif model == 'catboost':
+        regressor = train_catboost(path, preprocessor, chunksize, params, test_fraction=test_fraction)
+    else:
+        raise ValueError('Unknown model: {}, expected one of {}'.format(model, ', '.join(MODELS)))
+    return regressor, preprocessor
+
+
+#%%
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Out-of-core training on a trips CSV, one chunk at a time')
+    parser.add_argument('input', help='CSV file with the trips and their trip_duration')
+    parser.add_argument('--model', choices=MODELS, default='xgboost')
+    parser.add_argument('--output', help='model file (extension as in model_io.py)')
+    parser.add_argument('--preprocessor', default='trip_preprocessor.json', help='preprocessor artifact written')
+    parser.add_argument('--chunksize', type=int, default=DEFAULT_CHUNKSIZE)
+    parser.add_argument('--test-fraction', type=float, default=TEST_FRACTION)
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    model, preprocessor = train(args.input, args.model, args.chunksize, args.test_fraction)
+    preprocessor.save(args.preprocessor)
+    if args.output:
+        save_model(model, args.output)
+    print('trained in {:.1f} s, peak RSS {:.0f} MB'.format(time.perf_counter() - start, peak_rss_mb() or 0))
+    if tree_count(model) is not None:
+        print('{} trees'.format(tree_count(model)))
+    if args.test_fraction > 0:
+        print(evaluate(model, args.input, preprocessor, args.chunksize, args.test_fraction))
+
+
+if __name__ == '__main__':
+    main()
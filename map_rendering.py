@@ -0,0 +1,115 @@
+#%%
+# Folium maps of pickup/dropoff points that stay small whatever the number of points.
+#
+# Instead of one folium.Marker per row (added with iterrows), points are aggregated on a
+# regular lat/long grid with numpy and the layers are built from arrays:
+#   - heatmap_layer: one weighted point per grid cell (folium HeatMap)
+#   - marker_layer: a random sample of at most max_points points (folium FastMarkerCluster,
+#     the markers are created by the browser from a single array)
+# The grid is made coarser until the number of cells fits in max_points, so the size of the
+# HTML and the render time are bounded by the point budget, not by the size of the data.
+
+import numpy as np
+
+import folium
+from folium.plugins import FastMarkerCluster, HeatMap
+
+from trip_features import NYC_BOUNDS
+
+NYC_CENTER = [40.734695, -73.990372]
+
+DEFAULT_MAX_POINTS = 5000
+
+# ~200 m
+DEFAULT_CELL_SIZE = 0.002
+
+
+#%%
+
+def outside_bounds(latitudes, longitudes, bounds=NYC_BOUNDS):
+    long_min, lat_min, long_max, lat_max = bounds
+    latitudes = np.asarray(latitudes)
+    longitudes = np.asarray(longitudes)
+    return (longitudes <= long_min) | (latitudes <= lat_min) | (longitudes >= long_max) | (latitudes >= lat_max)
+
+
+# Number of points in each cell of a cell_size x cell_size degree grid,
+# returned as the cell centers and the counts of the non empty cells
+
+def grid_bins(latitudes, longitudes, cell_size=DEFAULT_CELL_SIZE):
+    rows = np.floor(np.asarray(latitudes, dtype=np.float64) / cell_size).astype(np.int64)
+    columns = np.floor(np.asarray(longitudes, dtype=np.float64) / cell_size).astype(np.int64)
+    # Both cell indices packed in one int64 key, so a single np.unique finds the cells
+    keys = (rows << 32) + (columns & 0xFFFFFFFF)
+    keys, counts = np.unique(keys, return_counts=True)
+    cell_rows = keys >> 32
+    cell_columns = ((keys & 0xFFFFFFFF) ^ 0x80000000) - 0x80000000
+    return (cell_rows + 0.5) * cell_size, (cell_columns + 0.5) * cell_size, counts
+
+
+# Grid made coarser (cell size doubled) until there are at most max_points non empty cells.
+# Cells wider than the whole map can still be several (points on both sides of latitude or
+# longitude 0 fall in cells -1 and 0 at any size), those are merged into a single bin at
+# the mean of the points.
+
+def budget_bins(latitudes, longitudes, max_points=DEFAULT_MAX_POINTS, cell_size=DEFAULT_CELL_SIZE):
+    if max_points < 1:
+        raise ValueError('max_points must be at least 1, got {}'.format(max_points))
+    while True:
+        bin_latitudes, bin_longitudes, counts = grid_bins(latitudes, longitudes, cell_size)
+        if len(counts) <= max_points:
+            return bin_latitudes, bin_longitudes, counts
+        if cell_size >= 360:
+            return (np.array([np.mean(latitudes, dtype=np.float64)]), np.array([np.mean(longitudes, dtype=np.float64)]),
+                    np.array([counts.sum()]))
+        cell_size *= 2
+
+
+def downsample(latitudes, longitudes, max_points=DEFAULT_MAX_POINTS, seed=42):
+    latitudes = np.asarray(latitudes)
+    longitudes = np.asarray(longitudes)
+    if len(latitudes) > max_points:
+        index = np.sort(np.random.default_rng(seed).choice(len(latitudes), size=max_points, replace=False))
+        latitudes, longitudes = latitudes[index], longitudes[index]
+    return latitudes, longitudes
+
+
+#%%
+
+def heatmap_layer(latitudes, longitudes, max_points=DEFAULT_MAX_POINTS, cell_size=DEFAULT_CELL_SIZE, name=None, radius=10):
+    bin_latitudes, bin_longitudes, counts = budget_bins(latitudes, longitudes, max_points, cell_size)
+    weights = counts / counts.max() if len(counts) else counts
+    data = np.column_stack([bin_latitudes, bin_longitudes, weights]).round(6)
+    return HeatMap(data.tolist(), name=name, radius=radius)
+
+
+def marker_layer(latitudes, longitudes, max_points=DEFAULT_MAX_POINTS, name=None, seed=42):
+    sample_latitudes, sample_longitudes = downsample(latitudes, longitudes, max_points, seed)
+    data = np.column_stack([sample_latitudes, sample_longitudes]).astype(np.float64).round(6)
+    return FastMarkerCluster(data.tolist(), name=name)
+
+
+# Map of a set of points, kind is 'heatmap' or 'markers'
+
+def points_map(latitudes, longitudes, kind='heatmap', max_points=DEFAULT_MAX_POINTS, location=NYC_CENTER,
+               zoom_start=11, tiles="cartodb positron", name=None):
+    points = folium.Map(location=location, zoom_start=zoom_start, tiles=tiles)
+    if kind == 'heatmap':
+        layer = heatmap_layer(latitudes, longitudes, max_points, name=name)
+    elif kind == 'markers':
+        layer = marker_layer(latitudes, longitudes, max_points, name=name)
+    else:
+        raise ValueError('Unknown kind of map: {}'.format(kind))
+    layer.add_to(points)
+    return points
+
+
+# Map of the pickups (prefix='pickup') or dropoffs (prefix='dropoff') outside of New York.
+# Points at latitude 0 (missing GPS) are left out.
+
+def mapping_outliers(df, prefix='pickup', kind='markers', max_points=DEFAULT_MAX_POINTS, bounds=NYC_BOUNDS, zoom_start=3):
+    latitudes = df['{}_latitude'.format(prefix)].to_numpy()
+    longitudes = df['{}_longitude'.format(prefix)].to_numpy()
+    outliers = outside_bounds(latitudes, longitudes, bounds) & (latitudes.astype(int) != 0)
+    return points_map(latitudes[outliers], longitudes[outliers], kind=kind, max_points=max_points,
+                      zoom_start=zoom_start, name='{} outliers'.format(prefix))
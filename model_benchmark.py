@@ -0,0 +1,237 @@
+#%%
+# Benchmark of every regressor family of new_main.py on the same train/test split, recording
+# accuracy and cost side by side:
+#   fit_seconds, predict_rows_per_second, peak_rss_mb (peak memory of the process that fitted
+#   the model), fit_rss_mb (the part of it added by the fit), model_bytes (saved with
+#   model_io.py), rmse and rmsle
+#
+# The split is written once as .npy files in the feature cache, keyed by a hash of the data,
+# and each model is fitted in its own Python process that memory-maps it, so the memory of
+# one model does not hide the memory of the next and every model sees identical data.
+# Results are a DataFrame (saved as JSON), compare_with_baseline flags the metrics that got
+# worse than a stored baseline by more than a tolerance.
+#
+#   python model_benchmark.py train.csv --output model_benchmark.json --baseline model_benchmark_baseline.json
+
+import argparse
+import hashlib
+import importlib
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from feature_cache import FEATURE_CACHE_DIR
+
+
+# name -> (module, class, parameters, model_io file extension), as configured in new_main.py
+MODEL_FAMILIES = {
+    'linear_regression': ('sklearn.linear_model', 'LinearRegression', {}, '.joblib'),
+    'random_forest': ('sklearn.ensemble', 'RandomForestRegressor', {'n_estimators': 100, 'random_state': 42}, '.joblib'),
+    'catboost': ('catboost', 'CatBoostRegressor', {'iterations': 100, 'learning_rate': 0.1, 'depth': 6, 'verbose': False}, '.cbm'),
+    'xgboost': ('xgboost', 'XGBRegressor', {'n_estimators': 200, 'learning_rate': 0.1, 'max_depth': 6}, '.json'),
+}
+
+# Relative change from the baseline that counts as a regression; for all of them higher is
+# worse except predict_rows_per_second
+DEFAULT_TOLERANCES = {
+    'rmse': 0.02,
+    'rmsle': 0.02,
+    'fit_seconds': 0.25,
+    'predict_rows_per_second': 0.25,
+    'peak_rss_mb': 0.25,
+    'model_bytes': 0.25,
+}
+
+_SPLIT_ARRAYS = ('X_train', 'X_test', 'y_train', 'y_test')
+
+
+#%%
+
+# Train/test split stored in the feature cache, reused as long as X, y and the split
+# parameters are the same
+
+def cached_split(X, y, test_size=0.33, random_state=42, cache_dir=FEATURE_CACHE_DIR):
+    from sklearn.model_selection import train_test_split
+
+    X = np.ascontiguousarray(X, dtype=np.float32)
+    y = np.ascontiguousarray(y, dtype=np.float64)
+    digest = hashlib.blake2b(digest_size=16)
+    for values in (X, y):
+        digest.update(str(values.shape).encode())
+        digest.update(memoryview(values).cast('B'))
+    digest.update('{}-{}'.format(test_size, random_state).encode())
+    directory = os.path.join(cache_dir, 'splits', digest.hexdigest())
+
+    if not os.path.exists(directory):
+        tmp_directory = directory + '.tmp'
+        os.makedirs(tmp_directory, exist_ok=True)
+        arrays = train_test_split(X, y, test_size=test_size, random_state=random_state)
+        for name, values in zip(_SPLIT_ARRAYS, arrays):
+            np.save(os.path.join(tmp_directory, name + '.npy'), values)
+        os.replace(tmp_directory, directory)
+    return directory
+
+
+def load_split(directory, mmap=True):
+    return [np.load(os.path.join(directory, name + '.npy'), mmap_mode='r' if mmap else None) for name in _SPLIT_ARRAYS]
+
+
+def regression_metrics(y_true, y_pred):
+    y_true = np.asarray(y_true, dtype=np.float64)
+    y_pred = np.asarray(y_pred, dtype=np.float64)
+    rmse = float(np.sqrt(np.mean((y_true - y_pred) ** 2)))
+    # Only defined for non negative targets (seconds), predictions below 0 count as 0
+    rmsle = float('nan')
+    if (y_true >= 0).all():
+        rmsle = float(np.sqrt(np.mean((np.log1p(y_true) - np.log1p(np.maximum(y_pred, 0))) ** 2)))
+    return rmse, rmsle
+
+
+#%%
+
+# Fits one model family on a cached split, in the current process.
+# target_lambda: Yeo-Johnson lambda of y, the metrics are then computed in seconds.
+
+def run_model(split_directory, name, target_lambda=None, min_predict_seconds=1.0):
+    from model_io import save_model
+    from power_transform import yeo_johnson_inverse
+    from stage_trace import peak_rss_mb
+
+    module, class_name, params, extension = MODEL_FAMILIES[name]
+    X_train, X_test, y_train, y_test = load_split(split_directory)
+    model = getattr(importlib.import_module(module), class_name)(**params)
+
+    rss_before = peak_rss_mb()
+    start = time.perf_counter()
+    model.fit(X_train, y_train)
+    fit_seconds = time.perf_counter() - start
+    rss_after = peak_rss_mb()
+
+    # Predictions of the whole test set, repeated until min_predict_seconds
+    rows = 0
+    start = time.perf_counter()
+    while True:
+        predictions = model.predict(X_test)
+        rows += len(X_test)
+        if time.perf_counter() - start >= min_predict_seconds:
+            break
+    predict_rows_per_second = rows / (time.perf_counter() - start)
+
+    if target_lambda is not None:
+        y_test = yeo_johnson_inverse(np.asarray(y_test), target_lambda)
+        predictions = yeo_johnson_inverse(np.asarray(predictions, dtype=np.float64), target_lambda)
+    rmse, rmsle = regression_metrics(y_test, predictions)
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = save_model(model, os.path.join(directory, name + extension))
+        model_bytes = os.path.getsize(path)
+
+    return {'model': name, 'fit_seconds': fit_seconds, 'predict_rows_per_second': predict_rows_per_second,
+            'peak_rss_mb': peak_rss_mb(), 'fit_rss_mb': rss_after - rss_before if rss_before is not None else None,
+            'model_bytes': model_bytes, 'rmse': rmse, 'rmsle': rmsle, 'train_rows': len(X_train),
+            'test_rows': len(X_test)}
+
+
+# Every model family in its own process (python model_benchmark.py worker ...), so peak
+# memory is measured per model and a missing library only fails its own row
+
+def benchmark_models(X, y, models=tuple(MODEL_FAMILIES), target_lambda=None, test_size=0.33, random_state=42,
+                     cache_dir=FEATURE_CACHE_DIR):
+    directory = cached_split(X, y, test_size, random_state, cache_dir)
+    rows = []
+    for name in models:
+        command = [sys.executable, os.path.abspath(__file__), 'worker', directory, name]
+        if target_lambda is not None:
+            command += ['--target-lambda', repr(float(target_lambda))]
+        process = subprocess.run(command, capture_output=True, text=True)
+        if process.returncode == 0:
+            rows.append(json.loads(process.stdout.strip().splitlines()[-1]))
+        else:
+            error = process.stderr.strip().splitlines()
+            rows.append({'model': name, 'error': error[-1] if error else 'exit code {}'.format(process.returncode)})
+    return pd.DataFrame(rows).set_index('model')
+
+
+#%%
+
+def save_results(results, path):
+    results.reset_index().to_json(path, orient='records', indent=2)
+
+
+def load_results(path):
+    return pd.read_json(path, orient='records').set_index('model')
+
+
+# Relative change of every metric against the baseline, and the list of the metrics that got
+# worse by more than their tolerance in a `regressions` column
+
+def compare_with_baseline(results, baseline, tolerances=DEFAULT_TOLERANCES):
+    comparison = pd.DataFrame(index=results.index)
+    regressions = pd.Series([[] for _ in results.index], index=results.index)
+    for metric, tolerance in tolerances.items():
+        if metric not in results or metric not in baseline:
+            continue
+        change = results[metric] / baseline[metric].reindex(results.index) - 1
+        comparison[metric + '_change'] = change
+        worse = change < -tolerance if metric == 'predict_rows_per_second' else change > tolerance
+        for model in change.index[worse.fillna(False)]:
+            regressions[model].append(metric)
+    comparison['regressions'] = regressions
+    return comparison
+
+
+#%%
+
+def _trip_matrix(path):
+    from feature_cache import load_trip_features
+    from preprocessing_pipeline import TripPreprocessor
+    from row_filters import trip_row_filter
+
+    trips = trip_row_filter().apply(load_trip_features(path))
+    preprocessor = TripPreprocessor().fit(trips, trips['trip_duration'])
+    return (preprocessor.transform(trips), preprocessor.transform_target(trips['trip_duration']),
+            preprocessor.target_lambda_)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Fit time, predict throughput, memory, size and accuracy '
+                                                 'of every model family.')
+    commands = parser.add_subparsers(dest='command')
+    worker = commands.add_parser('worker', help=argparse.SUPPRESS)
+    worker.add_argument('split')
+    worker.add_argument('model')
+    worker.add_argument('--target-lambda', type=float)
+    if argv is None:
+        argv = sys.argv[1:]
+    if argv[:1] == ['worker']:
+        args = parser.parse_args(argv)
+        print(json.dumps(run_model(args.split, args.model, args.target_lambda)))
+        return
+
+    parser = argparse.ArgumentParser(description=parser.description)
+    parser.add_argument('data', help='trips CSV with trip_duration, e.g. train.csv')
+    parser.add_argument('--models', nargs='+', default=list(MODEL_FAMILIES), choices=list(MODEL_FAMILIES))
+    parser.add_argument('--output', default='model_benchmark.json', help='results table (JSON)')
+    parser.add_argument('--baseline', help='results of a previous run to compare with')
+    args = parser.parse_args(argv)
+
+    X, y, target_lambda = _trip_matrix(args.data)
+    results = benchmark_models(X, y, args.models, target_lambda)
+    save_results(results, args.output)
+    with pd.option_context('display.width', 200, 'display.max_columns', None):
+        print(results)
+        if args.baseline:
+            comparison = compare_with_baseline(results, load_results(args.baseline))
+            print(comparison)
+            if comparison['regressions'].map(len).any():
+                sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
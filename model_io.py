@@ -0,0 +1,63 @@
+#%%
+# Saving and loading the fitted regressors of the scripts, in the native format of each library
+# (the file extension picks the format):
+#   .cbm            CatBoost (save_model / load_model)
+#   .json / .ubj    XGBoost
+#   .trees          any tree ensemble as flat numpy arrays (flat_trees.py), a directory loaded
+#                   memory-mapped and predicted with numpy only
+#   anything else   joblib pickle (sklearn models: LinearRegression, RandomForestRegressor...)
+# The libraries are imported when a model of theirs is saved or loaded, so loading a .trees
+# model imports none of them.
+
+import os
+
+
+CATBOOST_EXTENSIONS = ('.cbm',)
+
+XGBOOST_EXTENSIONS = ('.json', '.ubj')
+
+FLAT_TREES_EXTENSIONS = ('.trees',)
+
+
+#%%
+
+def _extension(path):
+    return os.path.splitext(path)[1].lower()
+
+
+def save_model(model, path):
+    extension = _extension(path)
+    if extension in FLAT_TREES_EXTENSIONS:
+        from flat_trees import FlatTreeModel
+
+        FlatTreeModel.from_model(model).save(path)
+    elif extension in CATBOOST_EXTENSIONS or extension in XGBOOST_EXTENSIONS:
+        model.save_model(path)
+    else:
+        import joblib
+
+        joblib.dump(model, path)
+    return path
+
+
+# mmap=False reads the arrays of a .trees model into memory instead of mapping them
+
+def load_model(path, mmap=True):
+    extension = _extension(path)
+    if extension in FLAT_TREES_EXTENSIONS:
+        from flat_trees import FlatTreeModel
+
+        return FlatTreeModel.load(path, mmap=mmap)
+    if extension in CATBOOST_EXTENSIONS:
+        from catboost import CatBoostRegressor
+
+        return CatBoostRegressor().load_model(path)
+    if extension in XGBOOST_EXTENSIONS:
+        import xgboost as xgb
+
+        model = xgb.XGBRegressor()
+        model.load_model(path)
+        return model
+    import joblib
+
+    return joblib.load(path)
@@ -38,9 +38,7 @@ current_dir = os.path.dirname(os.path.abspath(__file__))
 # Adding the parent directory to the Python path
 sys.path.append(os.path.dirname(current_dir))
 
-# from Outliers_detection import find_limits, clip_variables
 
-# from Outliers_detection import mapping_outliers
 import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
@@ -49,14 +47,30 @@ import seaborn as sns
 import folium
 from sklearn.cluster import KMeans
 from sklearn.linear_model import LinearRegression
-from sklearn.preprocessing import PowerTransformer
 from sklearn.ensemble import RandomForestRegressor
 from sklearn.model_selection import train_test_split
+from scipy.stats import randint, uniform
 from catboost import CatBoostRegressor
 
 from sklearn.metrics import mean_squared_error
 from sklearn.metrics import mean_squared_log_error
 
+from aggregate_store import FEATURE_NAMES as AGGREGATE_FEATURES, AggregateStore
+from density_plots import plot_density
+from feature_cache import load_trip_features
+from frame_memory import compact_frame, format_report, prediction_drift
+from map_rendering import mapping_outliers
+from model_benchmark import benchmark_models, compare_with_baseline, load_results, save_results
+from model_io import save_model
+from Outliers_detection import Clipper
+from power_transform import YeoJohnson
+from preprocessing_pipeline import TripPreprocessor
+from row_filters import trip_row_filter
+from stage_trace import StageTracer
+from trip_duplicates import NEAR_DUPLICATE_TOLERANCES, TRIP_KEY_COLUMNS, duplicate_index
+from trip_features import trip_duration_seconds
+from tuning import HalvingSearch
+
 
 from sklearn.metrics import mean_squared_error
 from sklearn.metrics import mean_squared_log_error
@@ -69,8 +83,15 @@ from sklearn.metrics import mean_squared_log_error
 # Get the current working directory
 current_directory = os.getcwd()
 
-# Reading the CSV file
-df = pd.read_csv(os.path.join(current_directory, "train.csv"))
+# Wall time, CPU time, memory and rows of every stage below (stage_trace.py), written at the
+# end as pipeline_trace.json (opens in chrome://tracing or ui.perfetto.dev) with a summary table.
+# STAGE_TRACE_MEMORY=1 adds the tracemalloc peak of every stage, at the cost of a slower run
+tracer = StageTracer()
+
+# Reading the CSV file together with the derived trip features (cached on disk after the first run)
+with tracer.stage('load') as stage:
+    df = load_trip_features(os.path.join(current_directory, "train.csv"))
+    stage['rows_out'] = df
 
 print(df.head())
 
@@ -81,75 +102,8 @@ print(df.info())
 
 ## Data Cleaning
 
-#%%[markdown]
-
-# Calculating haversine distance between 2 sets of GPS coordinates in the dataframe
-
-#%%
-
-def find_limits(data, variables, fold):
-    limits = dict()
-    for variable in variables:
-        IQR = data[variable].quantile(0.75) - data[variable].quantile(0.25)
-        lower_limit = data[variable].quantile(0.25) - (IQR * fold)
-        upper_limit = data[variable].quantile(0.75) + (IQR * fold)
-        limits[variable] = (lower_limit, upper_limit)
-    return limits
-
-#%%
-def clip_variables(data, limits):
-    clipped_data = data.copy()
-    for variable, (lower_limit, upper_limit) in limits.items():
-        clipped_data[variable] = clipped_data[variable].clip(lower=lower_limit, upper=upper_limit)
-    return clipped_data
-
-
-def haversine_distance(df, lat1, lat2, long1, long2):
-    
-    r = 6371 #average radius of earth in kilometers
-    
-    phi1 = np.radians(df[lat1])
-    
-    phi2 = np.radians(df[lat2])
-    
-    delta_phi = np.radians(df[lat2] - df[lat1])
-    
-    delta_lambda = np.radians(df[long2] - df[long1])
-    
-    a = np.sin(delta_phi/2) ** 2 + np.cos(phi1) * np.cos(phi2) * np.sin(delta_lambda/2)**2
-    
-    c = 2 * np.arctan2(np.sqrt(a), np.sqrt(1-a))
-    
-    d = r * c
-    
-    return d
-
 
 
-def dummy_manhattan_distance(df, lat1, long1, lat2, long2):
-    a = haversine_distance(df, lat1, lat1, long1, long2)
-    b = haversine_distance(df, lat1, lat2, long1, long1)
-    return a + b
-
-
-def bearing_array(df,lat1, long1, lat2, long2):
-    AVG_EARTH_RADIUS = 6371  # in km
-    long_delta_rad = np.radians(long2 - long1)
-    lat1, long1, lat2, long2 = map(np.radians, (lat1, long1, lat2, long2))
-    y = np.sin(long_delta_rad) * np.cos(lat2)
-    x = np.cos(lat1) * np.sin(lat2) - np.sin(lat1) * np.cos(lat2) * np.cos(long_delta_rad)
-    return np.degrees(np.arctan2(y, x))
-
-
-
-df.loc[:, 'trip_distance(km)'] = haversine_distance(df, 'pickup_latitude', 'dropoff_latitude', 'pickup_longitude','dropoff_longitude')
-
-df.loc[:, 'center_latitude'] = (df['pickup_latitude'].values + df['dropoff_latitude'].values) / 2
-df.loc[:, 'center_longitude'] = (df['pickup_longitude'].values + df['dropoff_longitude'].values) / 2
-
-df.loc[:, 'distance_manhattan'] = dummy_manhattan_distance(df,'pickup_latitude', 'pickup_longitude', 'dropoff_latitude', 'dropoff_longitude')
-df.loc[:, 'direction'] = bearing_array(df,df['pickup_latitude'].values, df['pickup_longitude'].values,df['dropoff_latitude'].values, df['dropoff_longitude'].values)
-
 
 
 
@@ -159,7 +113,10 @@ print(df.isnull().sum())
 # No Null Values
 
 # Check for Duplicates
-print('Number of duplicates, trip ids: {}'.format(len(df) - len(df.drop_duplicates())))  
+print('Number of duplicates, trip ids: {}'.format(len(duplicate_index(df))))
+print('Same trip under another id: {}'.format(len(duplicate_index(df, TRIP_KEY_COLUMNS))))
+print('Near duplicates (same vendor, within a minute and ~10 m): {}'.format(
+    len(duplicate_index(df, TRIP_KEY_COLUMNS, NEAR_DUPLICATE_TOLERANCES))))
 # No duplicates
 
 #%%
@@ -183,101 +140,120 @@ print('Passengers: {} to {}'.format(df.passenger_count.min(), df.passenger_count
 # Finding empty trips
 print('Empty trips: {}'.format(df[df.passenger_count == 0].shape[0]))
 
-# Remove these rides which have 0 passenger (60 Trips)
-df = df[df['passenger_count'] > 0]
+# These rides which have 0 passenger (60 Trips) are removed by the row filter below
 
 # %%
 # Taxi can accomodate only 6 members at max 
-# Removing other passenger counts (7,8,9)
+# Other passenger counts (7,8,9) are removed by the row filter below
 print('Trips with Passanger count - 7 : {}'.format(df[df.passenger_count == 9].shape[0])) # 
 
 print('Trips with Passanger count - 8 : {}'.format(df[df.passenger_count == 8].shape[0]))
 
 print('Trips with Passanger count - 9 : {}'.format(df[df.passenger_count == 7].shape[0]))
 
-df = df[df['passenger_count'] < 7]
 
 # %%
 # df.columns
 
-df['pickup_datetime'] = pd.to_datetime(df.pickup_datetime)
-df['dropoff_datetime'] = pd.to_datetime(df.dropoff_datetime)
-
-df['month'] = df.pickup_datetime.dt.month
-df['week'] = df['pickup_datetime'].dt.isocalendar().week
-df['weekday'] = df.pickup_datetime.dt.weekday
-df['hour'] = df.pickup_datetime.dt.hour
-df['minute'] = df.pickup_datetime.dt.minute
-df['minute_oftheday'] = df['hour'] * 60 + df['minute']
-df.drop(['minute'], axis=1, inplace=True)
-
 # df.loc[:, 'pickup_date'] = df['pickup_datetime'].dt.date
 
 # df.loc[:, 'dropoff_date'] = df['dropoff_datetime'].dt.date
 
 # Creating a seprate column for trip duration using pickup time and drop off time 
-df['check_trip_duration'] = (df['dropoff_datetime'] - df['pickup_datetime']).map(lambda x : x.total_seconds())
+df['check_trip_duration'] = trip_duration_seconds(df['pickup_datetime'].values, df['dropoff_datetime'].values)
 
 duration_difference = df[np.abs(df['check_trip_duration'].values  - df['trip_duration'].values) > 1]
 
 print(f"Trip Duration with 0 mins: {duration_difference}")
 
-# Removing the rows with trip duration : 0 mins
+# Rows with trip duration : 0 mins
 print(df[df['trip_duration'] == 0]) # 0 Rows
-df[df['trip_duration'] != 0]
 
-# Removing the rows with more than 100 hours of trip  duration 
-df[df['trip_duration'] < 360000] # 4 rows
-
-df.rename(columns={'trip_duration': 'trip_duration(sec)'}, inplace=True)
+# Rows with more than 100 hours of trip  duration 
+print(df[df['trip_duration'] >= 360000]) # 4 rows
 
 #%%
 # Removing rows with trip distance less than 1 metre
 
 num_rows_distance_less_than_1_metre = len(df[df['trip_distance(km)'] <= 0.001])
 print(f'Number of rows with trip distance less than 1 metre : {num_rows_distance_less_than_1_metre}')
- 
-df = df[df['trip_distance(km)'] > 0.001]
+
+#%%
+# Removing the empty trips, trips with more than 6 passengers, trips with 0 or more than 100 hours
+# of duration and trips shorter than 1 metre, with a single copy of the frame
+with tracer.stage('row_filter', rows_in=df) as stage:
+    row_filter = trip_row_filter()
+    df = row_filter.apply(df)
+    stage['rows_out'] = df
+print(row_filter.report())
+
+df.rename(columns={'trip_duration': 'trip_duration(sec)'}, inplace=True)
 
 #%%
 # Visulazing distribution of Trip Duration(Sec) 
-sns.kdeplot(df['trip_duration(sec)'], fill=True)
-plt.title('Density Plot of Trip Duration')
-plt.xlabel('Trip Duration')
-plt.ylabel('Density')
-plt.show()
+# Binned FFT density (density_plots.py); with TRIP_PLOTS_DIR set the figures are written there instead of shown
+plot_density(df['trip_duration(sec)'], 'Density Plot of Trip Duration', 'Trip Duration', name='trip_duration_raw')
 
 #%%[markdown]
 ## Outlier Detection 
 
 #%%
 # Plotting Pickup cordinates which are outside of New-York (pickup)
-outlier_locations_pickup = df[((df.pickup_longitude <= -74.15) | (df.pickup_latitude <= 40.5774)| \
-                (df.pickup_longitude >= -73.7004) | (df.pickup_latitude >= 40.9176))]
-
-map_osm_pickup = folium.Map(location=[40.734695, -73.990372], zoom_start=3, tiles="cartodb positron")
-
-# Plotting Outliers on Map (pickup)
-sample_locations = outlier_locations_pickup.head(10000)
-for i,j in sample_locations.iterrows():
-    if int(j['pickup_latitude']) != 0:
-        folium.Marker(list((j['pickup_latitude'],j['pickup_longitude']))).add_to(map_osm_pickup)
+# All the outliers are drawn, sampled down to a fixed number of markers (see map_rendering.py)
+map_osm_pickup = mapping_outliers(df, 'pickup')
 map_osm_pickup
 
 # Plotting dropoff cordinates which are outside of New-York (dropoff)
-outlier_locations_dropoff = df[((df.dropoff_longitude <= -74.15) | (df.dropoff_latitude <= 40.5774)| \
-                (df.dropoff_longitude >= -73.7004) | (df.dropoff_latitude >= 40.9176))]
+map_osm_dropoff = mapping_outliers(df, 'dropoff')
+map_osm_dropoff
 
-map_osm_dropoff = folium.Map(location=[40.734695, -73.990372], zoom_start=3, tiles="cartodb positron")
 
-# Plotting Outliers on Map (dropoff)
-sample_locations = outlier_locations_dropoff.head(10000)
-for i,j in sample_locations.iterrows():
-    if int(j['pickup_latitude']) != 0:
-        folium.Marker(list((j['dropoff_latitude'],j['dropoff_longitude']))).add_to(map_osm_dropoff)
-map_osm_dropoff
+
+#%%
+# The whole preprocessing chain below (one-hot encoding, power transform, IQR limits, pickup
+# clusters) fitted once on the training trips and saved with a model trained on its features,
+# so new trips can be scored without this script:
+#   python predict.py test.csv predictions.csv --model trip_model.cbm --preprocessor trip_preprocessor.json
+# The preprocessor holds the aggregate store of the training trips (aggregate_store.py, saved as
+# trip_preprocessor_store.npz) and the scored trips are looked up in it; the training trips get
+# out-of-fold store features from fit_transform.
+trips_train, trips_test = train_test_split(df, test_size=0.33, random_state=42)
+with tracer.stage('scoring_preprocessor', rows_in=trips_train) as stage:
+    preprocessor = TripPreprocessor(aggregate_store=AggregateStore())
+    X_scoring_train = preprocessor.fit_transform(trips_train, trips_train['trip_duration(sec)'])
+    preprocessor.save(os.path.join(current_directory, 'trip_preprocessor.json'))
+    stage['rows_out'] = X_scoring_train
+
+with tracer.stage('scoring_model', rows_in=trips_train) as stage:
+    scoring_model = CatBoostRegressor(iterations=100, learning_rate=0.1, depth=6, verbose=False)
+    scoring_model.fit(X_scoring_train, preprocessor.transform_target(trips_train['trip_duration(sec)']))
+    save_model(scoring_model, os.path.join(current_directory, 'trip_model.cbm'))
+    # Same model as flat numpy trees: scoring processes load it memory-mapped, without importing catboost
+    save_model(scoring_model, os.path.join(current_directory, 'trip_model.trees'))
+    stage['rows_out'] = trips_train
+
+predictions_scoring = preprocessor.inverse_transform_target(scoring_model.predict(preprocessor.transform(trips_test)))
+print('RMSLE of the saved model:', np.sqrt(mean_squared_log_error(trips_test['trip_duration(sec)'], predictions_scoring)))
+del trips_train, trips_test, X_scoring_train
 
 
+#%%
+# Historical traffic of the pickup cell at the pickup weekday and hour (aggregate_store.py):
+# trip count, median speed and quartiles of the duration. The store only holds the training
+# rows of the split made before the models (same test_size and random_state, so the same rows):
+# it is the one of the scoring preprocessor above, filled with the same split of df.
+# The training rows get out-of-fold values, their own duration is not in their features.
+with tracer.stage('aggregate_store', rows_in=df) as stage:
+    store_train_index, store_test_index = train_test_split(df.index, test_size=0.33, random_state=42)
+    aggregate_store = preprocessor.aggregate_store
+
+    store_features = pd.DataFrame(index=df.index, columns=AGGREGATE_FEATURES, dtype=np.float32)
+    store_features.loc[store_train_index] = aggregate_store.out_of_fold_frame(df.loc[store_train_index],
+                                                                              target='trip_duration(sec)')
+    store_features.loc[store_test_index] = aggregate_store.lookup_frame(df.loc[store_test_index])
+    del store_train_index, store_test_index
+    stage['rows_out'] = store_features
+
 
 #%%
 
@@ -318,10 +294,18 @@ cols_to_transform = df.drop(cols_to_exclude, axis = 1).columns
 
 # print(df[cols_to_transform].columns)
 
-transformer = PowerTransformer(method='yeo-johnson', standardize=False)
-transformer.set_output(transform='pandas')
+# Lambdas estimated on a 200k row subsample, the columns fitted in parallel
+with tracer.stage('yeo_johnson', rows_in=df) as stage:
+    transformer = YeoJohnson(sample_size=200_000).fit(df[cols_to_transform])
+    print('Yeo-Johnson lambdas fitted in {:.1f} s'.format(transformer.fit_seconds_))
+
+    check_lambda_drift = False # refits every column on all the rows
 
-df[cols_to_transform] = transformer.fit_transform(df[cols_to_transform])
+    if check_lambda_drift:
+        print(transformer.lambda_drift(df[cols_to_transform]))
+
+    df[cols_to_transform] = transformer.transform(df[cols_to_transform])
+    stage['rows_out'] = df
 
 
 #%%
@@ -338,43 +322,32 @@ Outlier_detection_IQR = True # IQR = 1.5
 if Outlier_detection_IQR:
     variable_list = ['trip_duration(sec)','pickup_latitude','pickup_longitude','dropoff_latitude','dropoff_longitude','trip_distance(km)', 'avg_speed_h', 'avg_speed_m']
     fold_value = 1.5
-    result = find_limits(df, variable_list, fold_value)
-
-    df = clip_variables(df, result)
+    # Clips df in place, the fitted limits stay in clipper.limits_ for new data
+    with tracer.stage('clipping', rows_in=df) as stage:
+        clipper = Clipper(variable_list, fold=fold_value)
+        clipper.fit_transform(df)
+        stage['rows_out'] = df
     print("Cleaned Data")
+    print("Clipped values (below lower limit, above upper limit):", clipper.clip_counts_)
 
 
 #%%
 # Visulazing distribution of Trip Duration(Sec) 
-sns.kdeplot(df['trip_duration(sec)'], fill=True)
-plt.title('Density Plot of Trip Duration')
-plt.xlabel('Trip Duration')
-plt.ylabel('Density')
-plt.show()
+plot_density(df['trip_duration(sec)'], 'Density Plot of Trip Duration', 'Trip Duration', name='trip_duration')
 
 #%%
 # Visulazing distribution of Trip Duration(Sec) - log Normal
-sns.kdeplot(np.log(df['trip_duration(sec)'] + 1), fill=True)
-plt.title('Density Plot of Trip Duration - log Normal')
-plt.xlabel('Trip Duration')
-plt.ylabel('Density')
-plt.show()
+plot_density(np.log(df['trip_duration(sec)'] + 1), 'Density Plot of Trip Duration - log Normal', 'Trip Duration',
+             name='trip_duration_log')
 
 #%%
 # Visulazing distribution of Trip Distance(km) 
-sns.kdeplot(df['trip_distance(km)'], fill=True)
-plt.title('Density Plot of Trip Distance')
-plt.xlabel('Trip Distance')
-plt.ylabel('Density')
-plt.show()
+plot_density(df['trip_distance(km)'], 'Density Plot of Trip Distance', 'Trip Distance', name='trip_distance')
 
 # %%
 # Visulazing distribution of Trip Distance(km) - log Normal
-sns.kdeplot(np.log(df['trip_distance(km)']), fill=True)
-plt.title('Density Plot of Trip Distance - log Normal')
-plt.xlabel('Trip Distance')
-plt.ylabel('Density')
-plt.show()
+plot_density(np.log(df['trip_distance(km)']), 'Density Plot of Trip Distance - log Normal', 'Trip Distance',
+             name='trip_distance_log')
 
 # %%
 np.mean(df["trip_duration(sec)"])
@@ -468,8 +441,10 @@ pickup_locations = df[['pickup_longitude', 'pickup_latitude']]
 num_clusters = 4
 
 # Fit K-means clustering model
-kmeans = KMeans(n_clusters=num_clusters, random_state=42)
-df['pickup_cluster'] = kmeans.fit_predict(pickup_locations)
+with tracer.stage('kmeans', rows_in=pickup_locations) as stage:
+    kmeans = KMeans(n_clusters=num_clusters, random_state=42)
+    df['pickup_cluster'] = kmeans.fit_predict(pickup_locations)
+    stage['rows_out'] = df['pickup_cluster']
 
 #%%
 # df.head()
@@ -502,7 +477,9 @@ print(most_common_pickup_locations_per_cluster)
 
 y = df["trip_duration(sec)"]
 df.drop(["trip_duration(sec)"], axis=1, inplace=True)
-df.drop(['id', 'pickup_datetime', 'dropoff_datetime', 'pickup_cluster'], axis=1, inplace=True)
+df.drop(['id', 'pickup_datetime', 'dropoff_datetime'], axis=1, inplace=True)
+# The pickup cluster is kept as a feature, with the historical traffic of the pickup cell
+df[AGGREGATE_FEATURES] = store_features
 X = df
 
 
@@ -518,10 +495,12 @@ X_train.shape, y_train.shape, X_test.shape, y_test.shape
 model = CatBoostRegressor(iterations=100, learning_rate=0.1, depth=6)
 
 # Fit the model
-model.fit(X_train, y_train)
+with tracer.stage('catboost', rows_in=X_train) as stage:
+    model.fit(X_train, y_train)
 
-# Generate predictions
-predictions_catboost = model.predict(X_test)
+    # Generate predictions
+    predictions_catboost = model.predict(X_test)
+    stage['rows_out'] = predictions_catboost
 # %%
 
 
@@ -530,63 +509,82 @@ rmse = np.sqrt(mean_squared_error(y_test, predictions_catboost))
 print(rmse)
 
 
+# %%
+# Smallest safe dtype of every feature (frame_memory.py): one-hot int64 to int8, float64 to
+# float32, integral floats to integers. The target y is left as it is. The catboost model fitted
+# on the original features scores the compacted test rows, and the next models only train on
+# the compacted features when its predictions stay within 1e-3 standard deviations of y.
+with tracer.stage('compact_frame', rows_in=X) as stage:
+    X_compact, memory_report = compact_frame(X)
+    stage['rows_out'] = X_compact
+print(format_report(memory_report))
+compact_drift = prediction_drift(model, X_test, X_compact.loc[X_test.index])
+print('Largest catboost prediction difference on the compacted features: {:.3g}'.format(compact_drift))
+if compact_drift <= 1e-3 * y.std():
+    X = df = X_compact
+    X_train, X_test = X_compact.loc[X_train.index], X_compact.loc[X_test.index]
+del X_compact
 
 
-# %%
 
-n_cores = multiprocessing.cpu_count()
 
-xgb_model = xgb.XGBRegressor(n_jobs=n_cores)
+# %%
 
 # Random Search hyperparameter grid - XGBoost
+# The number of trees (50 to 200 before) is the resource of the successive halving:
+# all the configurations get a few rounds, only the best ones are trained up to max_rounds
 param_dist = {
     'learning_rate': uniform(0.01, 0.2),
-    'n_estimators': randint(50, 200),
     'max_depth': randint(3, 10),
 }
 
-# RandomizedSearchCV 
-random_search = RandomizedSearchCV(
-    xgb_model,
-    param_distributions=param_dist,
-    n_iter=10,
-    scoring='neg_mean_squared_error',  # Using negative MSE for regression
-    cv=5,
-    verbose=1,
+# The cores are split between parallel trials and the threads of each model,
+# finished trials are logged so an interrupted search can be resumed. A log of a search on
+# other data (features changed since) is moved to xgb_trials.jsonl.stale and the search restarts
+random_search = HalvingSearch(
+    param_dist,
+    n_trials=20,
+    max_rounds=200,
+    n_folds=5,
     random_state=123,
-    n_jobs=n_cores,
+    log_path=os.path.join(current_directory, 'xgb_trials.jsonl'),
+    stale_log='restart',
 )
 
-# Fit RandomizedSearchCV 
-random_search.fit(X_train, y_train)
+with tracer.stage('xgboost_search', rows_in=X_train) as stage:
+    random_search.fit(X_train, y_train)
+    stage['rows_out'] = random_search.trials_
+print(random_search.trials_)
 
 best_xgb_model = random_search.best_estimator_
 
-y_pred_xgb = best_xgb_model.predict(X_test)
+y_pred_xgb = random_search.predict(X_test)
 
 # Root mean squared error on the test set
 rmse_xgb = np.sqrt(mean_squared_error(y_test, y_pred_xgb))
 print("Root Mean Squared Error on Test Set (XGBoost):", rmse_xgb)
 
-# Best hyperparameters from the RandomizedSearchCV
-print("Best Hyperparameters:", random_search.best_params_)
+# Best hyperparameters from the search
+print("Best Hyperparameters:", random_search.best_params_, "with", random_search.best_rounds_, "trees")
 
 
 
 
 mse = mean_squared_error(y_test, y_pred_xgb)
-print(f'Mean Squared Error for catboost: {mse}')
+print(f'Mean Squared Error for XGBoost: {mse}')
 
 
 
 
 # %%
 
-lr = LinearRegression()
+with tracer.stage('linear_regression', rows_in=X_train) as stage:
+    lr = LinearRegression()
 
-lr.fit(X_train, y_train)
+    lr.fit(X_train, y_train)
 
-y_pred_lr = lr.predict(X_test)
+    y_pred_lr = lr.predict(X_test)
+    stage['rows_out'] = y_pred_lr
 
 
 
@@ -603,13 +601,15 @@ print("Root Mean Squared Error on Test Set (linear regression):", rmse_lr)
 
 # %%
 
-rf_regressor = RandomForestRegressor(n_estimators=100, random_state=42)
+with tracer.stage('random_forest', rows_in=X_train) as stage:
+    rf_regressor = RandomForestRegressor(n_estimators=100, random_state=42)
 
-# 5. Fit the model on the training data
-rf_regressor.fit(X_train, y_train)
+    # 5. Fit the model on the training data
+    rf_regressor.fit(X_train, y_train)
 
-# 6. Make predictions on the test data (if applicable)
-y_pred_rf = rf_regressor.predict(X_test)
+    # 6. Make predictions on the test data (if applicable)
+    y_pred_rf = rf_regressor.predict(X_test)
+    stage['rows_out'] = y_pred_rf
 
 # Evaluate the model
 # mse_rf = mean_squared_error(y_test, y_pred_rf)
@@ -622,3 +622,23 @@ print("Root Mean Squared Error on Test Set (RFM):", rmse_rf)
 
 
 # %%
+# Every model family on the same cached split, each fitted in its own process, with its cost
+# next to its accuracy: fit time, predict throughput, peak memory, size on disk, RMSE and
+# RMSLE (in seconds, the target is transformed back with its Yeo-Johnson lambda)
+target_lambda = transformer.lambdas_[list(cols_to_transform).index('trip_duration(sec)')]
+with tracer.stage('model_benchmark', rows_in=X) as stage:
+    model_results = benchmark_models(X, y, target_lambda=target_lambda)
+    stage['rows_out'] = model_results
+save_results(model_results, os.path.join(current_directory, 'model_benchmark.json'))
+print(model_results)
+
+# Regressions against a previous run kept as the baseline
+baseline_path = os.path.join(current_directory, 'model_benchmark_baseline.json')
+if os.path.exists(baseline_path):
+    print(compare_with_baseline(model_results, load_results(baseline_path)))
+
+
+# %%
+# Where the time and the memory of the run went
+tracer.save(os.path.join(current_directory, 'pipeline_trace.json'))
+print(tracer.report())
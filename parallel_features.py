@@ -0,0 +1,191 @@
+#%%
+# The trip features of trip_features.py computed by a pool of processes over shared memory,
+# for files of tens of millions of trips.
+#
+# The input columns (4 coordinates, pickup times as int64 seconds) are copied once into
+# multiprocessing.shared_memory blocks, and the output columns are allocated there too.
+# The workers attach to the blocks by name when the pool starts, a task is only a
+# (start, stop) row range: no array is pickled in either direction. Each task runs the numpy
+# kernels of trip_features on its rows and writes the results into the output arrays in place:
+#   - geodesic features (distance, manhattan distance, direction, center point)
+#   - datetime features (month, week, weekday, hour, minute of the day)
+#   - closest cluster center, when centers are given (same as KMeans.predict)
+#
+# The pool starts its workers with forkserver where it exists (spawn elsewhere), never with
+# fork: forking a process that already runs BLAS, OpenMP or numba thread pools (an interactive
+# session after a model fit) can deadlock the children. The workers run _run_block of this
+# module, but like with spawn they import the main module of the caller first: a script using
+# the pool needs an `if __name__ == '__main__':` guard, interactive sessions and notebooks
+# have no main file to import. With n_jobs=1 or fewer rows than one block, everything runs in
+# the calling process.
+#
+# The pool is opt-in: nothing enables it by default, feature_cache.load_trip_features and
+# file_main.py / new_main.py compute the features in one process (n_jobs=1). Why:
+#   - it has only been measured on a single core, where it is slower. benchmarks/
+#     bench_parallel_features.py on 10M rows, one core:
+#         add_trip_features 4.35 s, n_jobs=1 3.59 s, n_jobs=2 5.39 s, n_jobs=4 6.08 s, n_jobs=8 6.82 s
+#     (starting the workers and copying the columns in and out of shared memory, with nothing
+#     to overlap them with). The tasks only share the memory bandwidth, so scaling on several
+#     cores is expected, but it is not measured: run the benchmark on the target machine and
+#     pass n_jobs only where it shows a gain.
+#   - file_main.py and new_main.py are cell-by-cell scripts without a __main__ guard, which
+#     the workers need.
+
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from trip_features import GEO_FEATURES, datetime_features, epoch_seconds, geodesic_features, nearest_center
+
+
+# Rows per task, a few MB of temporaries per worker
+DEFAULT_BLOCK_SIZE = 500_000
+
+COORDINATE_COLUMNS = ['pickup_latitude', 'pickup_longitude', 'dropoff_latitude', 'dropoff_longitude']
+
+CLUSTER_FEATURE = 'pickup_cluster'
+
+DATETIME_DTYPES = {'month': np.int8, 'week': np.int8, 'weekday': np.int8, 'hour': np.int8, 'minute_oftheday': np.int16}
+
+
+#%%
+
+# Named numpy arrays in shared memory blocks. specs (name -> block name, shape, dtype) is all
+# another process needs to attach to the same arrays.
+
+class SharedArrays:
+
+    def __init__(self):
+        self.arrays = {}
+        self.specs = {}
+        self._blocks = []
+
+    def create(self, name, shape, dtype):
+        dtype = np.dtype(dtype)
+        size = max(int(np.prod(shape)) * dtype.itemsize, 1)
+        block = shared_memory.SharedMemory(create=True, size=size)
+        self._blocks.append(block)
+        self.arrays[name] = np.ndarray(shape, dtype=dtype, buffer=block.buf)
+        self.specs[name] = (block.name, shape, dtype.str)
+        return self.arrays[name]
+
+    def close(self):
+        # The views have to go before the blocks can be closed
+        self.arrays = {}
+        for block in self._blocks:
+            block.close()
+            block.unlink()
+        self._blocks = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def attach(specs):
+    blocks = []
+    arrays = {}
+    for name, (block_name, shape, dtype) in specs.items():
+        block = shared_memory.SharedMemory(name=block_name)
+        blocks.append(block)
+        arrays[name] = np.ndarray(shape, dtype=np.dtype(dtype), buffer=block.buf)
+    return arrays, blocks
+
+
+#%%
+
+# Features of rows start:stop of the input arrays, written into the output arrays
+
+def _compute_block(arrays, centers, start, stop):
+    rows = slice(start, stop)
+    lat1, long1, lat2, long2 = (arrays[column][rows] for column in COORDINATE_COLUMNS)
+    # numpy kernel, the processes already use the cores
+    geodesic_features(lat1, long1, lat2, long2, engine='numpy',
+                      out={column: arrays[column][rows] for column in GEO_FEATURES})
+    for column, values in datetime_features(arrays['pickup_seconds'][rows].view('datetime64[s]')).items():
+        arrays[column][rows] = values
+    if centers is not None:
+        nearest_center(lat1, long1, centers, out=arrays[CLUSTER_FEATURE][rows])
+
+
+# State of a worker process: the attached arrays (and their blocks, which must stay open)
+
+_worker = {}
+
+
+def _init_worker(specs, centers):
+    arrays, blocks = attach(specs)
+    _worker.update(arrays=arrays, blocks=blocks, centers=centers)
+
+
+def _run_block(start, stop):
+    _compute_block(_worker['arrays'], _worker['centers'], start, stop)
+    return stop - start
+
+
+# forkserver where it exists, else spawn. The fork server imports this module once, every
+# worker is then forked from it with numpy and the kernels already imported.
+
+def pool_context():
+    if 'forkserver' not in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context('spawn')
+    context = multiprocessing.get_context('forkserver')
+    context.set_forkserver_preload([__name__])
+    return context
+
+
+#%%
+
+# data: frame or dict of arrays with the coordinate columns and pickup_datetime (parsed).
+# centers: cluster centers as (longitude, latitude) rows, adds the pickup_cluster column.
+# Returns a dict with the GEO_FEATURES, DATETIME_FEATURES (and pickup_cluster) columns,
+# same values and dtypes as trip_features.geodesic_features / datetime_features.
+
+def parallel_trip_features(data, centers=None, n_jobs=-1, block_size=DEFAULT_BLOCK_SIZE, dtype=np.float32):
+    n_rows = len(data[COORDINATE_COLUMNS[0]])
+    if n_jobs is None or n_jobs < 1:
+        n_jobs = os.cpu_count() or 1
+    n_jobs = min(n_jobs, -(-n_rows // block_size))
+    centers = None if centers is None else np.asarray(centers, dtype=np.float64)
+
+    outputs = {column: dtype for column in GEO_FEATURES}
+    outputs.update(DATETIME_DTYPES)
+    if centers is not None:
+        outputs[CLUSTER_FEATURE] = np.int32
+
+    if n_jobs <= 1:
+        arrays = {column: np.asarray(data[column]) for column in COORDINATE_COLUMNS}
+        arrays['pickup_seconds'] = epoch_seconds(data['pickup_datetime'])
+        arrays.update((column, np.empty(n_rows, dtype=column_dtype)) for column, column_dtype in outputs.items())
+        _compute_block(arrays, centers, 0, n_rows)
+        return {column: arrays[column] for column in outputs}
+
+    with SharedArrays() as shared:
+        for column in COORDINATE_COLUMNS:
+            values = np.asarray(data[column])
+            shared.create(column, values.shape, values.dtype)[:] = values
+        shared.create('pickup_seconds', (n_rows,), np.int64)[:] = epoch_seconds(data['pickup_datetime'])
+        for column, column_dtype in outputs.items():
+            shared.create(column, (n_rows,), column_dtype)
+
+        starts = list(range(0, n_rows, block_size))
+        with ProcessPoolExecutor(max_workers=n_jobs, mp_context=pool_context(), initializer=_init_worker,
+                                 initargs=(shared.specs, centers)) as pool:
+            done = sum(pool.map(_run_block, starts, [min(start + block_size, n_rows) for start in starts]))
+        if done != n_rows:
+            raise RuntimeError('Only {} of {} rows were computed'.format(done, n_rows))
+        # Copied out of the shared blocks, which are released on exit
+        return {column: shared.arrays[column].copy() for column in outputs}
+
+
+# Same columns as trip_features.add_trip_features (plus pickup_cluster with centers)
+
+def add_trip_features_parallel(df, centers=None, n_jobs=-1, block_size=DEFAULT_BLOCK_SIZE, dtype=np.float32):
+    for column, values in parallel_trip_features(df, centers, n_jobs, block_size, dtype).items():
+        df[column] = values
+    return df
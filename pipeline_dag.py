@@ -0,0 +1,399 @@
+#%%
+# A pipeline as a DAG of pure stages, each output cached on disk and recomputed only when
+# something it depends on changed.
+#
+# A Stage is a function, the names of the stages whose outputs are its positional arguments
+# (inputs) and keyword parameters (params). Its cache key is a hash of:
+#   - the code of the function: its source, and the functions, classes and constants it uses,
+#     followed through the code of the same directory (code_dependencies). Only an edit of
+#     that code invalidates the stage: the train_<model> stages of trip_pipeline.py rerun when
+#     the hyperparameters in model_benchmark.MODEL_FAMILIES change, the encoded stage when
+#     preprocessing_pipeline.CATEGORICAL_FEATURES does, but the load and feature stages rerun
+#     for neither, nor for an edit of another stage of their module.
+#   - its params, and the contents of its input files (files, e.g. the CSV of a load stage)
+#   - the keys of its inputs, so a change propagates to everything downstream of it
+# Pipeline.run(targets) walks back from the targets and stops at the stages found in the
+# cache: only the stages whose key is missing run, in dependency order. Outputs are stored
+# like the entries of feature_cache.py: frames as one .npy file per column and arrays as
+# .npy, memory-mapped when read back (read-only: a stage must not modify its inputs), any other
+# object with joblib.
+#
+# With n_jobs > 1 the stages whose inputs are ready run at the same time in worker processes
+# (forkserver or spawn, like parallel_features.py, so the stage functions must be importable
+# and a script running the pipeline needs a __main__ guard): a worker reads its inputs from
+# the cache and writes its output there, nothing big goes through pickling. Independent
+# branches (plots, each model) run in parallel.
+
+import ast
+import hashlib
+import importlib
+import inspect
+import json
+import os
+import shutil
+import sys
+import textwrap
+import time
+import types
+import uuid
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+
+PIPELINE_CACHE_DIR = '.pipeline_cache'
+
+_META_FILE = 'stage.json'
+
+
+#%%
+
+# Code a stage depends on, followed from its function through the names it uses: the globals
+# of its module it reads, the attributes of the modules it reads (module.name) and the names it
+# imports in its body. Functions and classes defined in the stage's directory count with their
+# source (under their own module.qualname, whatever name they were reached by) and are followed
+# in turn, plain data constants (numbers, strings and containers of them) with their value.
+# Anything else does not count: numpy, pandas, sklearn..., and module state set at run time
+# (a global left to None, a compiled numba kernel), so the key does not change once it is set.
+
+_NOT_CONSTANT = object()
+
+
+def _constant(value):
+    if isinstance(value, (bool, int, float, complex, str, bytes)) or value is None:
+        return repr(value)
+    if isinstance(value, dict):
+        items = [_constant(item) for pair in value.items() for item in pair]
+    elif isinstance(value, (list, tuple, set, frozenset)):
+        items = [_constant(item) for item in value]
+    else:
+        return _NOT_CONSTANT
+    if _NOT_CONSTANT in items:
+        return _NOT_CONSTANT
+    if isinstance(value, (set, frozenset)):
+        items.sort()
+    return '{}({})'.format(type(value).__name__, ', '.join(items))
+
+
+def _source_path(value):
+    try:
+        path = inspect.getsourcefile(value)
+    except TypeError:
+        return None
+    # Frozen modules (os, ...) have names like '<frozen os>'
+    return os.path.abspath(path) if path and os.path.isfile(path) else None
+
+
+# Name of the module of a source file: the same whether the file runs as __main__ or is imported
+
+def _module_name(path):
+    return os.path.splitext(os.path.basename(path))[0]
+
+
+def _is_local_module(name, directory):
+    return os.path.isfile(os.path.join(directory, name.split('.')[0] + '.py'))
+
+
+# Modules are only imported by the hashing when they are in directory or already imported
+
+def _import(name, directory):
+    if name in sys.modules or _is_local_module(name, directory):
+        try:
+            return importlib.import_module(name)
+        except ImportError:
+            return None
+    return None
+
+
+# Qualified name -> value of the names used by the source of a function or class
+
+def _references(value, directory):
+    tree = ast.parse(textwrap.dedent(inspect.getsource(value)))
+    module_name = _module_name(_source_path(value))
+    namespace = dict(value.__globals__ if inspect.isfunction(value) else vars(sys.modules[module_name]))
+    for node in ast.walk(tree):
+        if isinstance(node, ast.ImportFrom) and node.module and not node.level:
+            module = _import(node.module, directory)
+            for alias in node.names:
+                if module is not None and hasattr(module, alias.name):
+                    namespace[alias.asname or alias.name] = getattr(module, alias.name)
+        elif isinstance(node, ast.Import):
+            for alias in node.names:
+                name = alias.name if alias.asname else alias.name.split('.')[0]
+                module = _import(name, directory)
+                if module is not None:
+                    namespace[alias.asname or name] = module
+
+    references = {}
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Attribute) and isinstance(node.value, ast.Name):
+            module = namespace.get(node.value.id)
+            if isinstance(module, types.ModuleType) and hasattr(module, node.attr):
+                references['{}.{}'.format(module.__name__, node.attr)] = getattr(module, node.attr)
+        elif isinstance(node, ast.Name) and node.id in namespace:
+            if not isinstance(namespace[node.id], types.ModuleType):
+                references['{}.{}'.format(module_name, node.id)] = namespace[node.id]
+    return references
+
+
+def _walk_code(name, value, directory, dependencies):
+    # numba dispatchers stand for the Python function they compile
+    value = getattr(value, 'py_func', value)
+    if inspect.isfunction(value) or inspect.isclass(value):
+        path = _source_path(value)
+        if path is not None and os.path.dirname(path) == directory:
+            name = '{}.{}'.format(_module_name(path), value.__qualname__)
+            if name not in dependencies:
+                dependencies[name] = inspect.getsource(value)
+                for reference, referenced in sorted(_references(value, directory).items()):
+                    _walk_code(reference, referenced, directory, dependencies)
+            return
+    if value is not None:
+        constant = _constant(value)
+        if constant is not _NOT_CONSTANT:
+            dependencies[name] = constant
+
+
+# Qualified name -> source (functions, classes) or repr (constants) of everything the key of a
+# stage running function covers
+
+def code_dependencies(function):
+    dependencies = {}
+    _walk_code(None, function, os.path.dirname(_source_path(function)), dependencies)
+    return dependencies
+
+
+def code_digest(function):
+    digest = hashlib.blake2b(digest_size=16)
+    for name, value in sorted(code_dependencies(function).items()):
+        digest.update(name.encode())
+        digest.update(value.encode())
+    return digest.hexdigest()
+
+
+class Stage:
+
+    def __init__(self, name, function, inputs=(), params=None, files=()):
+        self.name = name
+        self.function = function
+        self.inputs = list(inputs)
+        self.params = dict(params or {})
+        self.files = list(files)
+
+    def key(self, input_keys):
+        from feature_cache import file_digest
+
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update(self.name.encode())
+        digest.update(code_digest(self.function).encode())
+        digest.update(json.dumps(self.params, sort_keys=True, default=repr).encode())
+        for path in self.files:
+            digest.update(file_digest(path).encode())
+        for key in input_keys:
+            digest.update(key.encode())
+        return digest.hexdigest()
+
+    def __repr__(self):
+        return 'Stage({!r}, inputs={})'.format(self.name, self.inputs)
+
+
+#%%
+
+# Outputs on disk: frames and arrays memory-mapped back, anything else with joblib
+
+def save_output(value, directory, seconds):
+    import numpy as np
+    import pandas as pd
+
+    from feature_cache import save_frame
+
+    tmp_directory = '{}.tmp-{}'.format(directory, uuid.uuid4().hex)
+    os.makedirs(tmp_directory)
+    if isinstance(value, pd.DataFrame):
+        kind = 'frame'
+        save_frame(value, os.path.join(tmp_directory, 'frame'))
+    elif isinstance(value, np.ndarray) and value.dtype != object:
+        kind = 'array'
+        np.save(os.path.join(tmp_directory, 'array.npy'), value)
+    else:
+        import joblib
+
+        kind = 'joblib'
+        joblib.dump(value, os.path.join(tmp_directory, 'value.joblib'))
+    with open(os.path.join(tmp_directory, _META_FILE), 'w') as f:
+        json.dump({'kind': kind, 'seconds': seconds}, f)
+    try:
+        os.rename(tmp_directory, directory)
+    except OSError:
+        # Stored by another run in the meantime
+        shutil.rmtree(tmp_directory, ignore_errors=True)
+
+
+def load_output(directory):
+    with open(os.path.join(directory, _META_FILE)) as f:
+        kind = json.load(f)['kind']
+    if kind == 'frame':
+        from feature_cache import load_frame
+
+        return load_frame(os.path.join(directory, 'frame'))
+    if kind == 'array':
+        import numpy as np
+
+        return np.load(os.path.join(directory, 'array.npy'), mmap_mode='r')
+    import joblib
+
+    return joblib.load(os.path.join(directory, 'value.joblib'))
+
+
+# Runs a stage on inputs read from their entries and stores its output, in a worker process
+
+def _run_stage(stage, input_directories, directory):
+    inputs = [load_output(input_directory) for input_directory in input_directories]
+    start = time.perf_counter()
+    value = stage.function(*inputs, **stage.params)
+    seconds = time.perf_counter() - start
+    save_output(value, directory, seconds)
+    return seconds
+
+
+#%%
+
+class Pipeline:
+
+    def __init__(self, stages, cache_dir=PIPELINE_CACHE_DIR):
+        self.stages = {}
+        for stage in stages:
+            if stage.name in self.stages:
+                raise ValueError('Two stages are named {}'.format(stage.name))
+            self.stages[stage.name] = stage
+        self.cache_dir = cache_dir
+        self.order = self._topological_order()
+        self.log_ = []
+
+    def _topological_order(self):
+        order = []
+        state = {}
+
+        def visit(name, path):
+            if name not in self.stages:
+                raise ValueError('Unknown stage {} (input of {})'.format(name, path[-1] if path else None))
+            if state.get(name) == 'done':
+                return
+            if state.get(name) == 'visiting':
+                raise ValueError('Cycle through the stages {}'.format(' -> '.join(path + [name])))
+            state[name] = 'visiting'
+            for input_name in self.stages[name].inputs:
+                visit(input_name, path + [name])
+            state[name] = 'done'
+            order.append(name)
+
+        for name in self.stages:
+            visit(name, [])
+        return order
+
+    # Cache key of every stage, in dependency order
+
+    def keys(self):
+        keys = {}
+        for name in self.order:
+            stage = self.stages[name]
+            keys[name] = stage.key([keys[input_name] for input_name in stage.inputs])
+        return keys
+
+    def _directory(self, name, key):
+        return os.path.join(self.cache_dir, '{}-{}'.format(name, key))
+
+    def _cached(self, name, key):
+        return os.path.exists(os.path.join(self._directory(name, key), _META_FILE))
+
+    # Stages that have to run for the targets: missing from the cache (or forced), and all the
+    # missing stages upstream of them
+
+    def plan(self, targets=None, force=()):
+        keys = self.keys()
+        targets = list(self.order if targets is None else targets)
+        to_run = set()
+        pending = list(targets)
+        while pending:
+            name = pending.pop()
+            if name not in self.stages:
+                raise ValueError('Unknown stage {}'.format(name))
+            if name in to_run or (self._cached(name, keys[name]) and name not in force):
+                continue
+            to_run.add(name)
+            pending += self.stages[name].inputs
+        return [name for name in self.order if name in to_run], keys
+
+    # Runs what is missing for the targets and returns their outputs (name -> value)
+
+    def run(self, targets=None, n_jobs=1, force=(), verbose=True):
+        targets = list(self.order if targets is None else targets)
+        to_run, keys = self.plan(targets, force)
+        os.makedirs(self.cache_dir, exist_ok=True)
+        for name in force:
+            if name in to_run:
+                shutil.rmtree(self._directory(name, keys[name]), ignore_errors=True)
+        self.log_ = [{'stage': name, 'status': 'cached', 'seconds': 0.0}
+                     for name in self.order if name in targets and name not in to_run]
+
+        if n_jobs is None or n_jobs < 1:
+            n_jobs = os.cpu_count() or 1
+        if n_jobs == 1:
+            self._run_serial(to_run, keys, verbose)
+        else:
+            self._run_parallel(to_run, keys, n_jobs, verbose)
+        return {name: load_output(self._directory(name, keys[name])) for name in targets}
+
+    def _record(self, name, seconds, verbose):
+        self.log_.append({'stage': name, 'status': 'ran', 'seconds': seconds})
+        if verbose:
+            print('{:<24} ran in {:.2f} s'.format(name, seconds))
+
+    def _run_serial(self, to_run, keys, verbose):
+        # Outputs computed in this run kept in memory for the stages after them
+        outputs = {}
+        for name in to_run:
+            stage = self.stages[name]
+            inputs = [outputs[input_name] if input_name in outputs else
+                      load_output(self._directory(input_name, keys[input_name])) for input_name in stage.inputs]
+            start = time.perf_counter()
+            value = stage.function(*inputs, **stage.params)
+            seconds = time.perf_counter() - start
+            save_output(value, self._directory(name, keys[name]), seconds)
+            outputs[name] = value
+            self._record(name, seconds, verbose)
+
+    def _run_parallel(self, to_run, keys, n_jobs, verbose):
+        from parallel_features import pool_context
+
+        waiting = list(to_run)
+        running = {}
+        with ProcessPoolExecutor(max_workers=n_jobs, mp_context=pool_context()) as pool:
+            while waiting or running:
+                for name in list(waiting):
+                    if any(input_name in waiting or input_name in running.values()
+                           for input_name in self.stages[name].inputs):
+                        continue
+                    waiting.remove(name)
+                    stage = self.stages[name]
+                    future = pool.submit(_run_stage, stage, [self._directory(input_name, keys[input_name])
+                                                             for input_name in stage.inputs],
+                                         self._directory(name, keys[name]))
+                    running[future] = name
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    self._record(running.pop(future), future.result(), verbose)
+
+    def status(self, targets=None):
+        to_run, keys = self.plan(targets)
+        return {name: 'to run' if name in to_run else 'cached' for name in self.order
+                if targets is None or name in to_run or name in targets}
+
+    # Entries of the cache that no stage of this pipeline points to any more
+
+    def prune(self):
+        current = {os.path.basename(self._directory(name, key)) for name, key in self.keys().items()}
+        removed = []
+        for entry in os.listdir(self.cache_dir) if os.path.isdir(self.cache_dir) else []:
+            if entry not in current:
+                shutil.rmtree(os.path.join(self.cache_dir, entry), ignore_errors=True)
+                removed.append(entry)
+        return removed
@@ -0,0 +1,266 @@
+#%%
+# Yeo-Johnson power transform with numpy only, the equivalent of sklearn's
+# PowerTransformer(method='yeo-johnson', standardize=False).
+#
+# Same formulas as scipy.stats.yeojohnson (the expm1/log1p form). yeo_johnson computes in the
+# dtype of its input, optionally in place. The fitted transforms (yeo_johnson_columns,
+# YeoJohnson) compute in float64 and return float64: the lambdas of the float32 coordinates
+# are extreme (-7 to +6), and the transformed values then differ in their 8th-9th digit
+# (dropoff_longitude becomes -0.236 +- 1e-9), which float32 math or a float32 result collapses
+# to a handful of distinct values.
+#
+# YeoJohnson fits the lambdas itself: each column's lambda is estimated on a random
+# subsample of its rows (the maximum likelihood lambda barely moves past a few 100k rows),
+# the columns are fitted in parallel with joblib, and the transform is then applied to all
+# the rows. lambda_drift compares the subsampled lambdas with the ones fitted on all rows.
+# pandas and joblib are imported when they are needed, transforming arrays (the scoring path)
+# only needs numpy.
+
+import math
+import sys
+import time
+
+import numpy as np
+
+
+#%%
+
+# Both branches of the transform (x >= 0 and x < 0), computed in the dtype of x
+
+def _yeo_johnson_positive(x, lmbda, eps):
+    if abs(lmbda) < eps:
+        return np.log1p(x)
+    return np.expm1(lmbda * np.log1p(x)) / lmbda
+
+
+def _yeo_johnson_negative(x, lmbda, eps):
+    if abs(lmbda - 2) > eps:
+        return -np.expm1((2 - lmbda) * np.log1p(-x)) / (2 - lmbda)
+    return -np.log1p(-x)
+
+
+def _inverse_positive(y, lmbda, eps):
+    if abs(lmbda) < eps:
+        return np.expm1(y)
+    return np.expm1(np.log1p(y * lmbda) / lmbda)
+
+
+def _inverse_negative(y, lmbda, eps):
+    if abs(lmbda - 2) > eps:
+        return -np.expm1(np.log1p(-(2 - lmbda) * y) / (2 - lmbda))
+    return -np.expm1(-y)
+
+
+# Each branch is a power term plus a constant:
+#   x >= 0: ((1 + x)^l - 1) / l = (1 + x)^l / l - 1 / l
+#   x < 0:  -((1 - x)^(2 - l) - 1) / (2 - l) = -(1 - x)^(2 - l) / (2 - l) + 1 / (2 - l)
+# With an extreme lambda the power term is tiny next to the constant: center_latitude
+# (lambda -6.9) becomes 0.145 plus variations of 1e-14, which even float64 rounds to a
+# thousand distinct values. The shifted transform (yeo_johnson with shift=yeo_johnson_shift)
+# returns the values minus the constant, computed from the power term alone.
+
+def _shifted_positive(x, lmbda, eps, shift):
+    if abs(lmbda) >= eps and shift == -1 / lmbda:
+        return np.exp(lmbda * np.log1p(x)) / lmbda
+    return _yeo_johnson_positive(x, lmbda, eps) - shift
+
+
+def _shifted_negative(x, lmbda, eps, shift):
+    if abs(lmbda - 2) > eps and shift == 1 / (2 - lmbda):
+        return -np.exp((2 - lmbda) * np.log1p(-x)) / (2 - lmbda)
+    return _yeo_johnson_negative(x, lmbda, eps) - shift
+
+
+# Constant of the branch of `center` (e.g. the median of the column) when its power term is
+# smaller than the constant and would be lost next to it, else 0 (no shift)
+
+def yeo_johnson_shift(lmbda, center):
+    eps = np.finfo(np.float64).eps
+    if center >= 0 and abs(lmbda) >= eps and (1 + center) ** lmbda < 0.5:
+        return -1 / lmbda
+    if center < 0 and abs(lmbda - 2) > eps and (1 - center) ** (2 - lmbda) < 0.5:
+        return 1 / (2 - lmbda)
+    return 0.0
+
+
+# Most columns are all positive (distances, hours...) or all negative (longitudes),
+# the boolean indexing is only paid for mixed columns
+
+def _apply(x, lmbda, out, positive, negative):
+    x = np.asarray(x)
+    # Python float, so float32 data is not promoted to float64
+    lmbda = float(lmbda)
+    if out is None:
+        out = np.empty_like(x, dtype=np.result_type(x.dtype, np.float32))
+    eps = np.finfo(out.dtype).eps
+    pos = x >= 0
+    if pos.all():
+        out[...] = positive(x, lmbda, eps)
+    elif not pos.any():
+        out[...] = negative(x, lmbda, eps)
+    else:
+        neg = ~pos
+        out[pos] = positive(x[pos], lmbda, eps)
+        out[neg] = negative(x[neg], lmbda, eps)
+    return out
+
+
+# The transformed values minus `shift` (see yeo_johnson_shift)
+
+def yeo_johnson(x, lmbda, out=None, shift=0.0):
+    if shift:
+        return _apply(x, lmbda, out, lambda x, lmbda, eps: _shifted_positive(x, lmbda, eps, shift),
+                      lambda x, lmbda, eps: _shifted_negative(x, lmbda, eps, shift))
+    return _apply(x, lmbda, out, _yeo_johnson_positive, _yeo_johnson_negative)
+
+
+def yeo_johnson_inverse(y, lmbda, out=None):
+    return _apply(y, lmbda, out, _inverse_positive, _inverse_negative)
+
+
+# Single value with the math module (scoring one trip at a time)
+
+def yeo_johnson_value(x, lmbda, shift=0.0):
+    eps = np.finfo(np.float64).eps
+    if x >= 0:
+        if abs(lmbda) < eps:
+            return math.log1p(x) - shift
+        if shift and shift == -1 / lmbda:
+            return math.exp(lmbda * math.log1p(x)) / lmbda
+        return math.expm1(lmbda * math.log1p(x)) / lmbda - shift
+    if abs(lmbda - 2) > eps:
+        if shift and shift == 1 / (2 - lmbda):
+            return -math.exp((2 - lmbda) * math.log1p(-x)) / (2 - lmbda)
+        return -math.expm1((2 - lmbda) * math.log1p(-x)) / (2 - lmbda) - shift
+    return -math.log1p(-x) - shift
+
+
+# Column j of the 2d array X transformed with lambdas[j] (minus shifts[j] when given), computed
+# in float64. With inplace=True the result is written into X (which must be a float array), else
+# into a new float64 array.
+
+def yeo_johnson_columns(X, lambdas, inplace=False, shifts=None):
+    X = np.asarray(X)
+    out = X if inplace else np.empty(X.shape, dtype=np.float64)
+    for j, lmbda in enumerate(lambdas):
+        shift = shifts[j] if shifts is not None else 0.0
+        out[:, j] = yeo_johnson(X[:, j].astype(np.float64, copy=False), lmbda, shift=shift)
+    return out
+
+
+#%%
+
+# Maximum likelihood lambda of one column, with the optimizer of sklearn's PowerTransformer
+
+def fit_lambda(x):
+    from sklearn.preprocessing import PowerTransformer
+
+    x = np.asarray(x, dtype=np.float64)
+    return float(PowerTransformer(method='yeo-johnson', standardize=False).fit(x[:, None]).lambdas_[0])
+
+
+def _standardize(values):
+    std = values.std()
+    return (values - values.mean()) / std if std > 0 else values - values.mean()
+
+
+# A frame can only come from a pandas that is already imported
+
+def _is_frame(X):
+    pandas = sys.modules.get('pandas')
+    return pandas is not None and isinstance(X, pandas.DataFrame)
+
+
+def _column_values(X, j):
+    return X.iloc[:, j].to_numpy() if _is_frame(X) else np.asarray(X)[:, j]
+
+
+# X: 2d array or frame. sample_size rows (None for all of them) are drawn once and shared by
+# all the columns. prefer is joblib's 'threads' or 'processes'.
+
+class YeoJohnson:
+
+    def __init__(self, sample_size=200_000, n_jobs=-1, prefer='threads', random_state=42, lambdas=None):
+        self.sample_size = sample_size
+        self.n_jobs = n_jobs
+        self.prefer = prefer
+        self.random_state = random_state
+        self.lambdas_ = list(lambdas) if lambdas is not None else None
+        self.columns_ = None
+        self.fit_seconds_ = None
+
+    def _sample_index(self, n_rows):
+        if not self.sample_size or n_rows <= self.sample_size:
+            return None
+        rng = np.random.default_rng(self.random_state)
+        return np.sort(rng.choice(n_rows, size=self.sample_size, replace=False))
+
+    def _fit_lambdas(self, X, index):
+        from joblib import Parallel, cpu_count, delayed
+
+        n_jobs = cpu_count() if self.n_jobs is None or self.n_jobs < 1 else self.n_jobs
+        columns = []
+        for j in range(X.shape[1]):
+            values = _column_values(X, j)
+            columns.append(values if index is None else values[index])
+        return Parallel(n_jobs=min(n_jobs, len(columns)), prefer=self.prefer)(
+            delayed(fit_lambda)(values) for values in columns)
+
+    def fit(self, X):
+        start = time.perf_counter()
+        self.columns_ = list(X.columns) if _is_frame(X) else None
+        self.lambdas_ = self._fit_lambdas(X, self._sample_index(len(X)))
+        self.fit_seconds_ = time.perf_counter() - start
+        return self
+
+    # A frame is transformed column by column (in place with inplace=True), an array with
+    # yeo_johnson_columns. Both in float64, like fit, the columns of a frame become float64.
+
+    def transform(self, X, inplace=False):
+        if self.lambdas_ is None:
+            raise ValueError('YeoJohnson is not fitted yet, call fit() first')
+        if not _is_frame(X):
+            return yeo_johnson_columns(X, self.lambdas_, inplace=inplace)
+        data = X if inplace else X.copy()
+        for j, lmbda in enumerate(self.lambdas_):
+            data[data.columns[j]] = yeo_johnson(_column_values(data, j).astype(np.float64), lmbda)
+        return data
+
+    def fit_transform(self, X, inplace=False):
+        return self.fit(X).transform(X, inplace=inplace)
+
+    def inverse_transform(self, X):
+        X = np.asarray(X)
+        out = np.empty(X.shape, dtype=np.float64)
+        for j, lmbda in enumerate(self.lambdas_):
+            out[:, j] = yeo_johnson_inverse(X[:, j].astype(np.float64, copy=False), lmbda)
+        return out
+
+    # Subsampled lambdas against the lambdas fitted on all the rows of X, and the mean and
+    # largest difference of the standardized transformed values (the largest is at outliers). The lambdas of columns far from 0
+    # with a narrow range (the coordinates) are poorly determined, very different lambdas
+    # give almost the same shape there, which the value difference shows.
+
+    def lambda_drift(self, X):
+        import pandas as pd
+
+        full = self._fit_lambdas(X, None)
+        rows = []
+        for j, (sampled, exact) in enumerate(zip(self.lambdas_, full)):
+            values = _column_values(X, j).astype(np.float64)
+            difference = np.abs(_standardize(yeo_johnson(values, sampled)) - _standardize(yeo_johnson(values, exact)))
+            rows.append((sampled, exact, abs(sampled - exact), difference.mean(), difference.max()))
+        index = self.columns_ if self.columns_ is not None else range(len(rows))
+        return pd.DataFrame(rows, index=index,
+                            columns=['sample_lambda', 'full_lambda', 'lambda_difference', 'mean_value_difference',
+                                  'max_value_difference'])
+
+    def to_dict(self):
+        return {'sample_size': self.sample_size, 'random_state': self.random_state,
+                'columns': self.columns_, 'lambdas': self.lambdas_}
+
+    @classmethod
+    def from_dict(cls, params):
+        transformer = cls(sample_size=params['sample_size'], random_state=params['random_state'], lambdas=params['lambdas'])
+        transformer.columns_ = params['columns']
+        return transformer
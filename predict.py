@@ -0,0 +1,105 @@
+#%%
+# Batch predictions for a trips CSV (Kaggle test.csv, a month of TLC data...) with a saved
+# model (model_io.py) and preprocessor (preprocessing_pipeline.py), without the analysis scripts:
+#
+#   python predict.py test.csv predictions.csv --model trip_model.cbm --preprocessor trip_preprocessor.json
+#
+# The file is streamed in chunks: read (trip_loader.iter_trips) -> preprocessor.transform ->
+# model.predict -> id,trip_duration rows appended to the output, so the memory used depends on
+# the chunk size and not on the size of the file. With --threads the next chunk is read and the
+# previous predictions are written in background threads while a chunk is being predicted.
+# The model is expected to predict the transformed target (preprocessor.transform_target),
+# predictions are turned back into seconds. Rows/s and the peak RSS are printed at the end.
+
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+from model_io import load_model
+from preprocessing_pipeline import RAW_FEATURES, TripPreprocessor
+from stage_trace import peak_rss_mb
+from trip_loader import DEFAULT_CHUNKSIZE, iter_trips
+
+
+#%%
+
+def predict_chunk(chunk, model, preprocessor):
+    predictions = model.predict(preprocessor.transform(chunk))
+    if preprocessor.target_lambda_ is not None:
+        predictions = preprocessor.inverse_transform_target(predictions)
+    return pd.DataFrame({'id': chunk['id'].to_numpy(), 'trip_duration': predictions})
+
+
+# id,trip_duration lines formatted directly, ~3x faster than DataFrame.to_csv
+
+def format_predictions(predictions):
+    return ''.join(map('{},{:.1f}\n'.format, predictions['id'].tolist(), predictions['trip_duration'].tolist()))
+
+
+# Streams input_path through the preprocessor and the model into output_path.
+# Returns the number of rows, the time taken, rows/s and the peak RSS.
+
+def predict_csv(input_path, output_path, model, preprocessor, chunksize=DEFAULT_CHUNKSIZE, threads=False):
+    start = time.perf_counter()
+    chunks = iter_trips(input_path, chunksize, usecols=['id'] + RAW_FEATURES)
+    n_rows = 0
+
+    with open(output_path, 'w', newline='') as f:
+        f.write('id,trip_duration\n')
+
+        def write(predictions):
+            f.write(format_predictions(predictions))
+
+        if threads:
+            # One thread each, so chunks are read and written in order
+            with ThreadPoolExecutor(max_workers=1) as reader, ThreadPoolExecutor(max_workers=1) as writer:
+                next_chunk = reader.submit(next, chunks, None)
+                written = None
+                while True:
+                    chunk = next_chunk.result()
+                    if chunk is None:
+                        break
+                    next_chunk = reader.submit(next, chunks, None)
+                    predictions = predict_chunk(chunk, model, preprocessor)
+                    # At most one chunk of predictions waiting to be written
+                    if written is not None:
+                        written.result()
+                    written = writer.submit(write, predictions)
+                    n_rows += len(chunk)
+                if written is not None:
+                    written.result()
+        else:
+            for chunk in chunks:
+                write(predict_chunk(chunk, model, preprocessor))
+                n_rows += len(chunk)
+
+    seconds = time.perf_counter() - start
+    return {'rows': n_rows, 'seconds': seconds, 'rows_per_second': n_rows / seconds if seconds else 0.0,
+            'peak_rss_mb': peak_rss_mb()}
+
+
+#%%
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Predict trip durations for a trips CSV file.')
+    parser.add_argument('input', help='trips CSV file, e.g. test.csv')
+    parser.add_argument('output', help='CSV file written with id,trip_duration')
+    parser.add_argument('--model', default='trip_model.cbm', help='saved model, see model_io.py')
+    parser.add_argument('--preprocessor', default='trip_preprocessor.json', help='saved TripPreprocessor')
+    parser.add_argument('--chunksize', type=int, default=DEFAULT_CHUNKSIZE, help='rows per chunk')
+    parser.add_argument('--threads', action='store_true', help='read and write in background threads')
+    args = parser.parse_args(argv)
+
+    model = load_model(args.model)
+    preprocessor = TripPreprocessor.load(args.preprocessor)
+    stats = predict_csv(args.input, args.output, model, preprocessor, args.chunksize, args.threads)
+
+    peak = 'n/a' if stats['peak_rss_mb'] is None else '{:,.0f} MB'.format(stats['peak_rss_mb'])
+    print('{:,} rows in {:.1f} s, {:,.0f} rows/s, peak RSS {}'.format(
+        stats['rows'], stats['seconds'], stats['rows_per_second'], peak))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,385 @@
+#%%
+# The preprocessing chain of new_main.py / file_main.py packaged as one fitted object that
+# can be saved with the model and applied to new trips:
+#   trip features (trip_features.py) -> one-hot encoding of store_and_fwd_flag and vendor_id
+#   -> Yeo-Johnson power transform (power_transform.py) -> IQR clipping -> standardization
+#   -> pickup cluster of the KMeans model
+#   -> with an aggregate_store (aggregate_store.AggregateStore), the historical traffic features
+#      of the pickup cell, weekday and hour (FEATURE_NAMES of aggregate_store.py)
+#
+# The power transform, the clipping and the standardization are computed in float64 and only the
+# standardized values are written to float32. The lambdas of the coordinates are extreme (-7 to +6):
+# their transformed values are around +-1e16, or differ in their 9th digit, and cast to float32
+# before standardizing, pickup_latitude kept 4 of its 37,154 distinct values on 200k trips and
+# dropoff_longitude and center_latitude a single one. center_latitude (lambda -6.9) even loses
+# them in float64, so the columns are transformed minus the constant of their branch
+# (shifts_, see yeo_johnson_shift in power_transform.py); the limits are in that shifted space
+# and the standardization removes the shift anyway.
+#
+# Importing this module only imports numpy, pandas/sklearn are imported by the fits.
+# fit() works on a training frame with pandas/sklearn, fit_stream() on a stream of frames that
+# do not fit in memory together (see incremental_training.py). transform() is the fast path used for
+# scoring: it works on plain numpy arrays (a frame or a dict of arrays, raw trips are
+# featurized with the trip_features kernels) and returns a C-contiguous float32 matrix.
+# The trip duration (target) has its own power transform and limits, see transform_target
+# and inverse_transform_target.
+#
+# The aggregate store is filled by fit() with the training trips and their durations (fit_stream()
+# does not fill it). transform() and transform_one() look the trips up in it; fit_transform()
+# gives the training trips their out-of-fold features instead (AggregateStore.out_of_fold), as a
+# model trained on lookups of its own trips would learn from features that contain its target.
+# save() writes the store next to the json (<name>_store.npz) and load() reads it back.
+#
+# check_trip_duration and avg_speed_h / avg_speed_m of the scripts are computed from the trip
+# duration itself; they are not known when scoring a new trip, so they are not features here.
+
+import json
+import os
+
+import numpy as np
+
+from Outliers_detection import QuantileSketch, find_limits, limits_from_quartiles
+from power_transform import (YeoJohnson, yeo_johnson, yeo_johnson_columns, yeo_johnson_inverse, yeo_johnson_shift,
+                             yeo_johnson_value)
+from trip_features import (DATETIME_FEATURES, GEO_FEATURES, datetime_features, geodesic_features, nearest_center,
+                           trip_datetime_features, trip_geodesic_features)
+from streaming_stats import ReservoirSample
+
+
+# Columns of a raw trip (as in test.csv) that transform() needs
+RAW_FEATURES = ['vendor_id', 'pickup_datetime', 'passenger_count', 'pickup_longitude', 'pickup_latitude',
+                'dropoff_longitude', 'dropoff_latitude', 'store_and_fwd_flag']
+
+NUMERIC_FEATURES = ['passenger_count', 'pickup_longitude', 'pickup_latitude', 'dropoff_longitude',
+                    'dropoff_latitude'] + GEO_FEATURES + DATETIME_FEATURES
+
+CLIPPED_FEATURES = ['pickup_latitude', 'pickup_longitude', 'dropoff_latitude', 'dropoff_longitude', 'trip_distance(km)']
+
+# One-hot encoded columns and the names of their indicator columns, like pd.get_dummies in the scripts
+CATEGORICAL_FEATURES = {'store_and_fwd_flag': ['N', 'Y'], 'vendor_id': [1, 2]}
+
+TARGET = 'trip_duration'
+
+ARTIFACT_VERSION = 3
+
+
+#%%
+
+# Numpy arrays of every numeric feature; the geodesic and datetime features are computed
+# from the raw trip columns when the frame does not have them already
+
+def feature_arrays(data):
+    columns = {}
+    missing_geo = [column for column in GEO_FEATURES if column not in data]
+    if missing_geo:
+        columns.update(geodesic_features(np.asarray(data['pickup_latitude']), np.asarray(data['pickup_longitude']),
+                                         np.asarray(data['dropoff_latitude']), np.asarray(data['dropoff_longitude'])))
+    if any(column not in data for column in DATETIME_FEATURES):
+        columns.update(datetime_features(np.asarray(data['pickup_datetime'])))
+    for column in NUMERIC_FEATURES:
+        if column not in columns:
+            columns[column] = np.asarray(data[column])
+    return columns
+
+
+def _float32(value):
+    return float(np.float32(value))
+
+
+def _one_hot(values, categories):
+    # pandas CategoricalDtype, without importing pandas
+    if getattr(getattr(values, 'dtype', None), 'name', None) == 'category':
+        # Integer codes of a categorical column compared, not its values
+        codes = values.cat.codes.to_numpy()
+        index = {str(category): i for i, category in enumerate(values.cat.categories)}
+        return [codes == index.get(str(category), -1) for category in categories]
+    values = np.asarray(values)
+    if values.dtype.kind not in 'iufb':
+        # Categoricals and strings compared as str
+        values = values.astype(str)
+        categories = [str(category) for category in categories]
+    return [values == category for category in categories]
+
+
+#%%
+
+class TripPreprocessor:
+
+    def __init__(self, fold=1.5, n_clusters=10, random_state=42, aggregate_store=None):
+        self.fold = fold
+        self.n_clusters = n_clusters
+        self.random_state = random_state
+        self.aggregate_store = aggregate_store
+        self.categories = {column: list(categories) for column, categories in CATEGORICAL_FEATURES.items()}
+        self.lambdas_ = None
+        self.limits_ = None
+        self.shifts_ = None
+        self.means_ = None
+        self.scales_ = None
+        self.target_lambda_ = None
+        self.target_limits_ = None
+        self.cluster_centers_ = None
+
+    @property
+    def feature_names_(self):
+        names = list(NUMERIC_FEATURES)
+        for categories in self.categories.values():
+            names += [str(category) for category in categories]
+        if self.cluster_centers_ is not None:
+            names.append('pickup_cluster')
+        if self.aggregate_store is not None:
+            from aggregate_store import FEATURE_NAMES
+
+            names += FEATURE_NAMES
+        return names
+
+    def fit(self, data, y=None):
+        import pandas as pd
+
+        columns = feature_arrays(data)
+        X = np.column_stack([columns[column].astype(np.float64) for column in NUMERIC_FEATURES])
+        self.lambdas_ = YeoJohnson(random_state=self.random_state).fit(X).lambdas_
+        self.shifts_ = [yeo_johnson_shift(lmbda, float(np.median(X[:, j]))) for j, lmbda in enumerate(self.lambdas_)]
+
+        transformed = yeo_johnson_columns(X, self.lambdas_, inplace=True, shifts=self.shifts_)
+        index = [NUMERIC_FEATURES.index(column) for column in CLIPPED_FEATURES]
+        limits = find_limits(pd.DataFrame(transformed[:, index], columns=CLIPPED_FEATURES), CLIPPED_FEATURES, self.fold)
+        self.limits_ = {column: [float(lower), float(upper)] for column, (lower, upper) in limits.items()}
+        self._fit_scaling(transformed)
+
+        if y is not None:
+            y = np.asarray(y, dtype=np.float64)
+            self.target_lambda_ = YeoJohnson(random_state=self.random_state).fit(y[:, None]).lambdas_[0]
+            q1, q3 = np.quantile(yeo_johnson(y, self.target_lambda_), [0.25, 0.75])
+            self.target_limits_ = [float(limit) for limit in limits_from_quartiles(q1, q3, self.fold)]
+
+        if self.n_clusters:
+            self._fit_clusters(columns['pickup_longitude'], columns['pickup_latitude'])
+
+        if self.aggregate_store is not None:
+            if y is None:
+                raise ValueError('The aggregate store is filled with the trip durations, fit() needs y')
+            self.aggregate_store.clear().update(columns['pickup_latitude'], columns['pickup_longitude'],
+                                                columns['weekday'], columns['hour'], y, columns['trip_distance(km)'])
+        return self
+
+    # Same fit in one pass over a stream of frames (e.g. trip_loader.iter_trips), with memory
+    # bounded by sample_size whatever the number of trips. The lambdas and the cluster centers
+    # are fitted on a uniform sample of the rows (fit() subsamples to 200k rows for both anyway),
+    # the quartiles of the limits come from one QuantileSketch per clipped column. The sketches
+    # see the raw values: the Yeo-Johnson transform is increasing, so the quartiles of the
+    # transformed values are the transformed quartiles.
+    # target is the name of the target column of the frames (None when there is no target).
+
+    def fit_stream(self, chunks, target=TARGET, sample_size=200_000, k=1000):
+        if self.aggregate_store is not None:
+            raise ValueError('fit_stream() does not fill the aggregate store, use fit()')
+        sample = ReservoirSample(sample_size, seed=self.random_state)
+        sketches = {column: QuantileSketch(k=k, seed=self.random_state) for column in CLIPPED_FEATURES}
+        if target is not None:
+            sketches[target] = QuantileSketch(k=k, seed=self.random_state)
+        for chunk in chunks:
+            columns = feature_arrays(chunk)
+            if target is not None:
+                columns[target] = np.asarray(chunk[target])
+            for column, sketch in sketches.items():
+                sketch.update(columns[column])
+            sample.update(np.column_stack([columns[column].astype(np.float64) for column in
+                                           NUMERIC_FEATURES + ([target] if target is not None else [])]))
+
+        rows = sample.sample
+        n_features = len(NUMERIC_FEATURES)
+        self.lambdas_ = YeoJohnson(sample_size=None, random_state=self.random_state).fit(rows[:, :n_features]).lambdas_
+        self.shifts_ = [yeo_johnson_shift(lmbda, float(np.median(rows[:, j]))) for j, lmbda in enumerate(self.lambdas_)]
+        self.limits_ = {}
+        for column in CLIPPED_FEATURES:
+            j = NUMERIC_FEATURES.index(column)
+            self.limits_[column] = self._sketch_limits(sketches[column], self.lambdas_[j], self.shifts_[j])
+        self._fit_scaling(yeo_johnson_columns(rows[:, :n_features], self.lambdas_, shifts=self.shifts_))
+
+        if target is not None:
+            self.target_lambda_ = YeoJohnson(sample_size=None, random_state=self.random_state).fit(
+                rows[:, n_features:]).lambdas_[0]
+            self.target_limits_ = self._sketch_limits(sketches[target], self.target_lambda_)
+
+        if self.n_clusters:
+            self._fit_clusters(rows[:, NUMERIC_FEATURES.index('pickup_longitude')],
+                               rows[:, NUMERIC_FEATURES.index('pickup_latitude')])
+        return self
+
+    # Mean and standard deviation of the clipped transformed columns (float64, clipped in place),
+    # scale 1 for constant columns
+
+    def _fit_scaling(self, transformed):
+        for j, column in enumerate(NUMERIC_FEATURES):
+            if column in self.limits_:
+                np.clip(transformed[:, j], *self.limits_[column], out=transformed[:, j])
+        self.means_ = [float(mean) for mean in transformed.mean(axis=0)]
+        self.scales_ = [float(std) if std > 0 else 1.0 for std in transformed.std(axis=0)]
+
+    def _sketch_limits(self, sketch, lmbda, shift=0.0):
+        q1, q3 = (yeo_johnson_value(value, lmbda, shift) for value in sketch.quantile([0.25, 0.75]))
+        return [float(limit) for limit in limits_from_quartiles(q1, q3, self.fold)]
+
+    def _fit_clusters(self, longitudes, latitudes):
+        from clustering import kmeans_sweep
+
+        pickups = np.column_stack([longitudes, latitudes])
+        sweep = kmeans_sweep(pickups, [self.n_clusters], random_state=self.random_state)
+        self.cluster_centers_ = sweep.model(self.n_clusters).cluster_centers_
+
+    # Fast path: raw or featurized trips -> float32 (n_trips, n_features) matrix
+
+    def transform(self, data):
+        return self._transform(data)
+
+    # y: durations of trips that are in the aggregate store, their store features are out-of-fold
+
+    def _transform(self, data, y=None):
+        if self.lambdas_ is None:
+            raise ValueError('TripPreprocessor is not fitted yet, call fit() first')
+        columns = feature_arrays(data)
+        n_rows = len(columns[NUMERIC_FEATURES[0]])
+        X = np.empty((n_rows, len(self.feature_names_)), dtype=np.float32)
+
+        for j, (column, lmbda) in enumerate(zip(NUMERIC_FEATURES, self.lambdas_)):
+            # float64 math, rounded once to float32 after the standardization (same values as transform_one)
+            values = yeo_johnson(columns[column].astype(np.float64), lmbda, shift=self.shifts_[j])
+            if column in self.limits_:
+                np.clip(values, *self.limits_[column], out=values)
+            values -= self.means_[j]
+            values /= self.scales_[j]
+            X[:, j] = values
+
+        j = len(NUMERIC_FEATURES)
+        for column, categories in self.categories.items():
+            for indicator in _one_hot(data[column], categories):
+                X[:, j] = indicator
+                j += 1
+
+        if self.cluster_centers_ is not None:
+            X[:, j] = self.predict_cluster(columns['pickup_latitude'], columns['pickup_longitude'])
+            j += 1
+
+        if self.aggregate_store is not None:
+            arguments = [columns['pickup_latitude'], columns['pickup_longitude'], columns['weekday'], columns['hour']]
+            if y is None:
+                X[:, j:] = self.aggregate_store.lookup(*arguments)
+            else:
+                X[:, j:] = self.aggregate_store.out_of_fold(*arguments, y, columns['trip_distance(km)'],
+                                                            random_state=self.random_state)
+        return X
+
+    def fit_transform(self, data, y=None):
+        return self.fit(data, y)._transform(data, y)
+
+    # Single raw trip (a dict with the RAW_FEATURES keys) -> (1, n_features) float32 matrix,
+    # computed with scalar math. Values are rounded to float32 where transform() has float32
+    # columns (coordinates as loaded by trip_loader, geodesic features), so both give the same matrix.
+
+    def transform_one(self, trip):
+        if self.lambdas_ is None:
+            raise ValueError('TripPreprocessor is not fitted yet, call fit() first')
+        coordinates = [_float32(trip[column]) for column in
+                       ('pickup_longitude', 'pickup_latitude', 'dropoff_longitude', 'dropoff_latitude')]
+        longitude, latitude, dropoff_longitude, dropoff_latitude = coordinates
+        values = [float(trip['passenger_count'])] + coordinates
+        values += [_float32(value) for value in
+                   trip_geodesic_features(latitude, longitude, dropoff_latitude, dropoff_longitude)]
+        datetime_values = trip_datetime_features(trip['pickup_datetime'])
+        values += datetime_values
+
+        row = []
+        for j, (column, value, lmbda) in enumerate(zip(NUMERIC_FEATURES, values, self.lambdas_)):
+            value = yeo_johnson_value(value, lmbda, self.shifts_[j])
+            if column in self.limits_:
+                lower, upper = self.limits_[column]
+                value = min(max(value, lower), upper)
+            row.append((value - self.means_[j]) / self.scales_[j])
+        for column, categories in self.categories.items():
+            row += [float(str(trip[column]) == str(category)) for category in categories]
+        if self.cluster_centers_ is not None:
+            row.append(self.predict_cluster_one(latitude, longitude))
+        if self.aggregate_store is not None:
+            weekday = datetime_values[DATETIME_FEATURES.index('weekday')]
+            hour = datetime_values[DATETIME_FEATURES.index('hour')]
+            row += self.aggregate_store.lookup_one(latitude, longitude, weekday, hour).tolist()
+        return np.array([row], dtype=np.float32)
+
+    # Index of the closest KMeans center (clusters are fitted on longitude, latitude)
+
+    def predict_cluster(self, latitudes, longitudes):
+        return nearest_center(latitudes, longitudes, self.cluster_centers_)
+
+    def predict_cluster_one(self, latitude, longitude):
+        # Plain floats, numpy is slower than a loop for one point and a handful of centers
+        distances = [(longitude - center_longitude) ** 2 + (latitude - center_latitude) ** 2
+                     for center_longitude, center_latitude in self.cluster_centers_.tolist()]
+        return distances.index(min(distances))
+
+    def transform_target(self, y):
+        transformed = yeo_johnson(np.asarray(y, dtype=np.float64), self.target_lambda_)
+        return np.clip(transformed, *self.target_limits_)
+
+    # Model outputs in the transformed space -> trip durations in seconds (never negative)
+
+    def inverse_transform_target(self, transformed):
+        durations = yeo_johnson_inverse(np.asarray(transformed, dtype=np.float64), self.target_lambda_)
+        return np.maximum(durations, 0, out=durations)
+
+    def to_dict(self):
+        return {
+            'version': ARTIFACT_VERSION,
+            'fold': self.fold,
+            'n_clusters': self.n_clusters,
+            'random_state': self.random_state,
+            'categories': self.categories,
+            'numeric_features': NUMERIC_FEATURES,
+            'lambdas': self.lambdas_,
+            'limits': self.limits_,
+            'shifts': self.shifts_,
+            'means': self.means_,
+            'scales': self.scales_,
+            'target_lambda': self.target_lambda_,
+            'target_limits': self.target_limits_,
+            'cluster_centers': None if self.cluster_centers_ is None else np.asarray(self.cluster_centers_).tolist(),
+            # File name of the store, set by save()
+            'aggregate_store': None,
+        }
+
+    # directory: where the aggregate store file of the artifact is
+
+    @classmethod
+    def from_dict(cls, params, directory=''):
+        if params['version'] != ARTIFACT_VERSION or params['numeric_features'] != NUMERIC_FEATURES:
+            raise ValueError('Preprocessor artifact was saved by an incompatible version of the code')
+        preprocessor = cls(fold=params['fold'], n_clusters=params['n_clusters'], random_state=params['random_state'])
+        preprocessor.categories = params['categories']
+        preprocessor.lambdas_ = params['lambdas']
+        preprocessor.limits_ = params['limits']
+        preprocessor.shifts_ = params['shifts']
+        preprocessor.means_ = params['means']
+        preprocessor.scales_ = params['scales']
+        preprocessor.target_lambda_ = params['target_lambda']
+        preprocessor.target_limits_ = params['target_limits']
+        if params['cluster_centers'] is not None:
+            preprocessor.cluster_centers_ = np.asarray(params['cluster_centers'])
+        if params['aggregate_store'] is not None:
+            from aggregate_store import AggregateStore
+
+            preprocessor.aggregate_store = AggregateStore.load(os.path.join(directory, params['aggregate_store']))
+        return preprocessor
+
+    def save(self, path):
+        params = self.to_dict()
+        if self.aggregate_store is not None:
+            params['aggregate_store'] = os.path.splitext(os.path.basename(path))[0] + '_store.npz'
+            self.aggregate_store.save(os.path.join(os.path.dirname(path), params['aggregate_store']))
+        with open(path, 'w') as f:
+            json.dump(params, f, indent=2)
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            return cls.from_dict(json.load(f), os.path.dirname(path))
+
@@ -0,0 +1,91 @@
+#%%
+# Row cleaning as one stage: every rule gives a boolean "keep" mask, the masks are
+# combined and the frame is indexed once, instead of one full copy of the frame per filter.
+# The number of rows removed by each rule is recorded, also when the filter is applied
+# chunk by chunk to a stream of frames (e.g. trip_loader.iter_trips).
+
+import operator
+
+import numpy as np
+
+
+_OPERATORS = {'>': operator.gt, '>=': operator.ge, '<': operator.lt, '<=': operator.le,
+              '==': operator.eq, '!=': operator.ne}
+
+
+# Rule keeping the rows where `column op value`, e.g. column_rule('passenger_count', '>', 0)
+
+def column_rule(column, op, value):
+    compare = _OPERATORS[op]
+
+    def condition(data):
+        return compare(data[column].to_numpy(), value)
+    return condition
+
+
+#%%
+
+class RowFilter:
+
+    def __init__(self):
+        self.rules = {}
+        self.rows_in = 0
+        self.rows_out = 0
+        self.removed = {}
+
+    # `condition` takes a frame and returns a boolean array, True for the rows to keep
+
+    def add_rule(self, name, condition):
+        self.rules[name] = condition
+        self.removed[name] = 0
+        return self
+
+    # Rows are counted against the first rule they fail, in the order the rules were
+    # added, like with the chain of df = df[...] filters this replaces
+
+    def mask(self, data):
+        keep = np.ones(len(data), dtype=bool)
+        removed = {}
+        for name, condition in self.rules.items():
+            kept_before = np.count_nonzero(keep)
+            keep &= np.asarray(condition(data), dtype=bool)
+            removed[name] = kept_before - np.count_nonzero(keep)
+        return keep, removed
+
+    def apply(self, data):
+        keep, removed = self.mask(data)
+        for name, count in removed.items():
+            self.removed[name] += int(count)
+        self.rows_in += len(data)
+        self.rows_out += int(np.count_nonzero(keep))
+        if keep.all():
+            return data
+        return data[keep]
+
+    def apply_chunks(self, chunks):
+        for chunk in chunks:
+            yield self.apply(chunk)
+
+    def report(self):
+        lines = ['{:<30} {:>12}'.format('rule', 'rows removed')]
+        for name, count in self.removed.items():
+            lines.append('{:<30} {:>12,}'.format(name, count))
+        lines.append('{:<30} {:>12,} of {:,} ({:,} kept)'.format('total', self.rows_in - self.rows_out, self.rows_in, self.rows_out))
+        return '\n'.join(lines)
+
+
+#%%
+
+# Cleaning rules of the trip data:
+# - rides with 0 passenger, and more than 6 passengers (a taxi can accommodate only 6 members at max)
+# - trips of 0 seconds and of more than 100 hours
+# - trips shorter than 1 metre
+
+def trip_row_filter():
+    row_filter = RowFilter()
+    row_filter.add_rule('passenger_count > 0', column_rule('passenger_count', '>', 0))
+    row_filter.add_rule('passenger_count < 7', column_rule('passenger_count', '<', 7))
+    row_filter.add_rule('trip_duration != 0', column_rule('trip_duration', '!=', 0))
+    row_filter.add_rule('trip_duration < 360000', column_rule('trip_duration', '<', 360000))
+    row_filter.add_rule('trip_distance(km) > 0.001', column_rule('trip_distance(km)', '>', 0.001))
+    return row_filter
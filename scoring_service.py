@@ -0,0 +1,249 @@
+#%%
+# Trip duration of one trip at a time, for dispatch: a raw trip (coordinates, pickup time,
+# vendor, passenger count, store_and_fwd_flag) goes through TripPreprocessor.transform_one,
+# which computes the features with scalar math instead of pandas, and then through the model.
+#
+#   scorer = TripScorer.load('trip_model.cbm', 'trip_preprocessor.json')
+#   scorer.predict({'vendor_id': 2, 'pickup_datetime': '2016-06-30 23:59:58', 'passenger_count': 1,
+#                   'pickup_longitude': -73.988, 'pickup_latitude': 40.732, 'dropoff_longitude': -73.990,
+#                   'dropoff_latitude': 40.757, 'store_and_fwd_flag': 'N'})
+#
+# A model saved as .trees (flat_trees.py) is loaded memory-mapped and scored with numpy only:
+# importing this module and loading such a model imports neither pandas nor the model libraries,
+# see benchmarks/bench_cold_start.py.
+#
+# ScoringServer serves the same over HTTP (POST /predict with the trip as JSON, keep-alive
+# connections), and load_test is a small load generator reporting the p50/p99 latencies:
+#
+#   python scoring_service.py serve --model trip_model.cbm --preprocessor trip_preprocessor.json --port 8000
+#   python scoring_service.py load http://127.0.0.1:8000 test.csv --requests 5000 --concurrency 4
+
+import argparse
+import http.client
+import json
+import numbers
+import threading
+import time
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+from model_io import load_model
+from preprocessing_pipeline import RAW_FEATURES, TripPreprocessor
+
+
+#%%
+
+NUMBER_FIELDS = ['passenger_count', 'pickup_longitude', 'pickup_latitude', 'dropoff_longitude', 'dropoff_latitude']
+
+
+# ValueError with a message for the client when the trip is not a dict of RAW_FEATURES with
+# numbers for NUMBER_FIELDS and an ISO pickup_datetime (or a datetime)
+
+def validate_trip(trip):
+    if not isinstance(trip, dict):
+        raise ValueError('Expected a trip as a JSON object, got {}'.format(type(trip).__name__))
+    missing = [column for column in RAW_FEATURES if column not in trip]
+    if missing:
+        raise ValueError('Missing trip fields: {}'.format(', '.join(missing)))
+    for column in NUMBER_FIELDS:
+        value = trip[column]
+        if isinstance(value, bool) or not isinstance(value, numbers.Real):
+            raise ValueError('{} must be a number, got {!r}'.format(column, value))
+    pickup_datetime = trip['pickup_datetime']
+    if isinstance(pickup_datetime, datetime):
+        return
+    if isinstance(pickup_datetime, str):
+        try:
+            datetime.fromisoformat(pickup_datetime)
+            return
+        except ValueError:
+            pass
+    raise ValueError('pickup_datetime must be a date and time like "2016-06-30 23:59:58", got {!r}'.format(
+        pickup_datetime))
+
+
+class TripScorer:
+
+    def __init__(self, model, preprocessor):
+        self.model = model
+        self.preprocessor = preprocessor
+        self._predict = self._predictor(model)
+
+    # XGBoost's inplace_predict skips the DMatrix that predict() builds for every call
+    @staticmethod
+    def _predictor(model):
+        if hasattr(model, 'get_booster'):
+            return model.get_booster().inplace_predict
+        return model.predict
+
+    @classmethod
+    def load(cls, model_path, preprocessor_path):
+        return cls(load_model(model_path), TripPreprocessor.load(preprocessor_path))
+
+    # Trip duration in seconds
+
+    def predict(self, trip):
+        validate_trip(trip)
+        prediction = self._predict(self.preprocessor.transform_one(trip))
+        if self.preprocessor.target_lambda_ is not None:
+            prediction = self.preprocessor.inverse_transform_target(prediction)
+        return float(np.ravel(prediction)[0])
+
+
+#%%
+
+# POST /predict with a trip as a JSON object -> {"trip_duration": seconds}
+# A body that is not valid JSON or not a valid trip (validate_trip) gets a 400 with
+# {"error": message}, any other failure a 500, the connection stays open either way.
+# Runs in a background thread:
+#   server = ScoringServer(scorer).start()
+#   ...
+#   server.stop()
+
+class ScoringServer:
+
+    def __init__(self, scorer, host='127.0.0.1', port=0):
+        self.scorer = scorer
+
+        class Handler(BaseHTTPRequestHandler):
+            # Keep-alive, so clients do not pay a TCP handshake per trip, and no Nagle delay
+            # between the headers and the body of the reply
+            protocol_version = 'HTTP/1.1'
+            disable_nagle_algorithm = True
+
+            def do_POST(self):
+                if urllib.parse.urlparse(self.path).path != '/predict':
+                    self._reply(404, {'error': 'not found'})
+                    return
+                length = self.headers.get('Content-Length', '0')
+                if not length.isdigit():
+                    self._reply(400, {'error': 'Invalid Content-Length {!r}'.format(length)})
+                    return
+                try:
+                    trip = json.loads(self.rfile.read(int(length)))
+                    validate_trip(trip)
+                except ValueError as error:
+                    self._reply(400, {'error': str(error)})
+                    return
+                try:
+                    self._reply(200, {'trip_duration': scorer.predict(trip)})
+                except Exception as error:
+                    self._reply(500, {'error': '{}: {}'.format(type(error).__name__, error)})
+
+            def _reply(self, status, payload):
+                body = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self.url = 'http://{}:{}'.format(*self.server.server_address)
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def serve_forever(self):
+        self.server.serve_forever()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+#%%
+
+def latency_summary(latencies, seconds=None):
+    latencies = np.asarray(latencies) * 1000
+    summary = {'requests': len(latencies), 'mean_ms': latencies.mean(),
+               'p50_ms': np.percentile(latencies, 50), 'p99_ms': np.percentile(latencies, 99),
+               'max_ms': latencies.max()}
+    if seconds:
+        summary['requests_per_second'] = len(latencies) / seconds
+    return summary
+
+
+# Sends n_requests POST /predict requests to url from `concurrency` threads, each with its own
+# keep-alive connection, cycling through `trips` (a list of dicts). Returns latency_summary.
+
+def load_test(url, trips, n_requests=1000, concurrency=1, timeout=10):
+    url = urllib.parse.urlparse(url)
+    bodies = [json.dumps(trip).encode() for trip in trips]
+    headers = {'Content-Type': 'application/json'}
+
+    def worker(worker_index):
+        connection = http.client.HTTPConnection(url.hostname, url.port, timeout=timeout)
+        latencies = []
+        try:
+            for i in range(worker_index, n_requests, concurrency):
+                start = time.perf_counter()
+                connection.request('POST', '/predict', bodies[i % len(bodies)], headers)
+                response = connection.getresponse()
+                response.read()
+                latencies.append(time.perf_counter() - start)
+                if response.status != 200:
+                    raise RuntimeError('Request failed with status {}'.format(response.status))
+        finally:
+            connection.close()
+        return latencies
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(worker, range(concurrency)))
+    return latency_summary([latency for latencies in results for latency in latencies], time.perf_counter() - start)
+
+
+# The first n rows of a trips CSV as JSON ready dicts
+
+def read_trips(path, n=1000):
+    import pandas as pd
+
+    return pd.read_csv(path, nrows=n, usecols=RAW_FEATURES).to_dict('records')
+
+
+def print_summary(summary):
+    print('{requests:,} requests: mean {mean_ms:.2f} ms, p50 {p50_ms:.2f} ms, p99 {p99_ms:.2f} ms, '
+          'max {max_ms:.2f} ms'.format(**summary)
+          + (', {:,.0f} requests/s'.format(summary['requests_per_second']) if 'requests_per_second' in summary else ''))
+
+
+#%%
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Single trip scoring server and load generator.')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    serve = commands.add_parser('serve', help='serve POST /predict')
+    serve.add_argument('--model', default='trip_model.cbm', help='saved model, see model_io.py')
+    serve.add_argument('--preprocessor', default='trip_preprocessor.json', help='saved TripPreprocessor')
+    serve.add_argument('--host', default='127.0.0.1')
+    serve.add_argument('--port', type=int, default=8000)
+
+    load = commands.add_parser('load', help='send trips of a CSV file to a running server')
+    load.add_argument('url', help='server url, e.g. http://127.0.0.1:8000')
+    load.add_argument('trips', help='trips CSV file, e.g. test.csv')
+    load.add_argument('--requests', type=int, default=1000)
+    load.add_argument('--concurrency', type=int, default=1)
+    args = parser.parse_args(argv)
+
+    if args.command == 'serve':
+        server = ScoringServer(TripScorer.load(args.model, args.preprocessor), args.host, args.port)
+        print('Serving on {}/predict'.format(server.url))
+        server.serve_forever()
+    else:
+        print_summary(load_test(args.url, read_trips(args.trips, min(args.requests, 10_000)),
+                                args.requests, args.concurrency))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,245 @@
+#%%
+# Timing and memory of the stages of a pipeline run (loading, features, filtering, KMeans,
+# power transform, clipping, model fits...), cheap enough to leave on in batch runs.
+#
+# For every stage the tracer records:
+#   - wall_seconds and cpu_seconds (process CPU time of all the threads, cpu / wall above 1
+#     means the stage used several cores)
+#   - rss_mb at the end, rss_delta_mb (resident memory added by the stage) and peak_rss_mb
+#     (peak of the process so far, see peak_rss_mb)
+#   - tracemalloc_peak_mb, the peak of the memory allocated during the stage, with
+#     trace_memory=True (or the environment variable STAGE_TRACE_MEMORY=1, which the tracers of
+#     file_main.py / new_main.py read) only. It is off by default because tracemalloc hooks
+#     every allocation: on 1M synthetic trips the vectorized stages barely change (features
+#     0.29 -> 0.35 s, row filter 0.12 -> 0.12 s, clipping 0.11 -> 0.14 s), but the stages
+#     allocating many Python objects get several times slower (YeoJohnson fit 1.7 -> 7.8 s,
+#     to_dict of 200k rows 2.4 -> 14.4 s, make_trips 0.7 -> 13.4 s): 5.3 s -> 36 s in all.
+#     Without it, rss_delta_mb and peak_rss_mb still show the memory of every stage.
+#   - rows_in / rows_out when given (a number, numpy integers included, or anything with a
+#     len(), e.g. the frame)
+# A stage costs a few reads of /proc/self and of the clocks, well under a millisecond.
+#
+# The code of a #%% cell is wrapped in a stage, which is stopped even when the cell raises
+# (a stage left open by start() would have every later stage nested under it):
+#
+#   with tracer.stage('row_filter', rows_in=df) as stage:
+#       df = row_filter.apply(df)
+#       stage['rows_out'] = df
+#
+# or started and stopped by hand (tracer.start / tracer.stop), or used as a decorator
+# (@tracer.stage_function()). Stages can be nested.
+# save() writes the Chrome trace format (chrome://tracing, https://ui.perfetto.dev): one
+# slice per stage with its measurements as arguments, plus a resident memory counter track.
+# report() is the summary table, stages in the order they started (nested ones indented
+# under their parent) with their share of the total wall time.
+
+import functools
+import json
+import numbers
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+
+_PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+SUMMARY_COLUMNS = ['wall_seconds', 'cpu_seconds', 'rss_delta_mb', 'peak_rss_mb', 'tracemalloc_peak_mb', 'rows_in',
+                   'rows_out']
+
+
+#%%
+
+# Current resident memory of the process in MB (None when it cannot be measured)
+
+def current_rss_mb():
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE / 1e6
+    except OSError:
+        pass
+    try:
+        import psutil
+    except ImportError:
+        return None
+    return psutil.Process().memory_info().rss / 1e6
+
+
+# Peak resident memory of the process in MB (None when it cannot be measured).
+# On Linux VmHWM is used rather than ru_maxrss, which a process started by another one
+# inherits from it (ru_maxrss survives fork and exec).
+
+def peak_rss_mb():
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1e3
+    except OSError:
+        pass
+    try:
+        import resource
+    except ImportError:
+        # Windows
+        try:
+            import psutil
+        except ImportError:
+            return None
+        return psutil.Process().memory_info().peak_wset / 1e6
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macOS, KB on Linux
+    return peak / 1e6 if sys.platform == 'darwin' else peak / 1e3
+
+
+def _rows(value):
+    if value is None:
+        return None
+    if isinstance(value, numbers.Integral):
+        return int(value)
+    return len(value)
+
+
+def _difference(end, start):
+    return None if end is None or start is None else end - start
+
+
+#%%
+
+class StageTracer:
+
+    # trace_memory=None: on when the environment variable STAGE_TRACE_MEMORY is 1
+
+    def __init__(self, trace_memory=None):
+        if trace_memory is None:
+            trace_memory = os.environ.get('STAGE_TRACE_MEMORY') == '1'
+        self.trace_memory = trace_memory
+        self.records = []
+        self._stack = []
+        self._origin = time.perf_counter()
+        self._counters = []
+        if trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def start(self, name, rows_in=None, **args):
+        rss = current_rss_mb()
+        record = {'name': name, 'depth': len(self._stack), 'rows_in': _rows(rows_in), 'rows_out': None,
+                  'args': args, '_rss': rss}
+        if self.trace_memory:
+            # tracemalloc has a single peak: the enclosing stage keeps the peak reached so far
+            # before it is reset for this one
+            peak = tracemalloc.get_traced_memory()[1]
+            if self._stack:
+                self._stack[-1]['_peak'] = max(self._stack[-1]['_peak'], peak)
+            tracemalloc.reset_peak()
+            record['_peak'] = 0
+        self._counters.append((time.perf_counter(), rss))
+        record['_cpu'] = time.process_time()
+        record['_start'] = time.perf_counter()
+        self._stack.append(record)
+        return record
+
+    def stop(self, rows_out=None, **args):
+        end = time.perf_counter()
+        cpu = time.process_time()
+        record = self._stack.pop()
+        rss = current_rss_mb()
+        start = record.pop('_start')
+        record['start_seconds'] = start - self._origin
+        record['wall_seconds'] = end - start
+        record['cpu_seconds'] = cpu - record.pop('_cpu')
+        record['rss_mb'] = rss
+        record['rss_delta_mb'] = _difference(rss, record.pop('_rss'))
+        record['peak_rss_mb'] = peak_rss_mb()
+        record['tracemalloc_peak_mb'] = None
+        if self.trace_memory:
+            peak = max(record.pop('_peak'), tracemalloc.get_traced_memory()[1])
+            record['tracemalloc_peak_mb'] = peak / 1e6
+            if self._stack:
+                self._stack[-1]['_peak'] = max(self._stack[-1]['_peak'], peak)
+        if rows_out is not None:
+            record['rows_out'] = _rows(rows_out)
+        record['args'].update(args)
+        record['thread'] = threading.get_ident()
+        self._counters.append((end, rss))
+        self.records.append(record)
+        return record
+
+    # Stage around a block; rows_out can be set on the record yielded (record['rows_out'] = df)
+
+    @contextmanager
+    def stage(self, name, rows_in=None, **args):
+        record = self.start(name, rows_in, **args)
+        try:
+            yield record
+        finally:
+            self.stop(record['rows_out'])
+
+    # Stage around every call of a function, rows in / out from the first argument and the result
+    # when they have a len()
+
+    def stage_function(self, name=None):
+        def decorator(function):
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                rows_in = len(args[0]) if args and hasattr(args[0], '__len__') else None
+                self.start(name or function.__name__, rows_in)
+                result = None
+                try:
+                    result = function(*args, **kwargs)
+                    return result
+                finally:
+                    self.stop(len(result) if hasattr(result, '__len__') else None)
+            return wrapper
+        return decorator
+
+    #%%
+
+    def chrome_trace(self):
+        pid = os.getpid()
+        events = [{'name': 'process_name', 'ph': 'M', 'pid': pid, 'args': {'name': 'pipeline'}}]
+        for record in sorted(self.records, key=lambda record: record['start_seconds']):
+            args = {column: record[column] for column in SUMMARY_COLUMNS + ['rss_mb'] if record[column] is not None}
+            args.update(record['args'])
+            events.append({'name': record['name'], 'cat': 'stage', 'ph': 'X', 'pid': pid, 'tid': record['thread'],
+                           'ts': record['start_seconds'] * 1e6, 'dur': record['wall_seconds'] * 1e6, 'args': args})
+        for seconds, rss in self._counters:
+            if rss is not None:
+                events.append({'name': 'memory', 'ph': 'C', 'pid': pid, 'ts': (seconds - self._origin) * 1e6,
+                               'args': {'rss_mb': rss}})
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+    def save(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.chrome_trace(), f, default=str)
+        return path
+
+    # One row per stage in the order they started, with its share of the wall time of the top
+    # level stages
+
+    def summary(self):
+        total = sum(record['wall_seconds'] for record in self.records if record['depth'] == 0) or 1
+        rows = []
+        for record in sorted(self.records, key=lambda record: record['start_seconds']):
+            row = {'stage': '  ' * record['depth'] + record['name']}
+            row.update((column, record[column]) for column in SUMMARY_COLUMNS)
+            row['share'] = record['wall_seconds'] / total
+            rows.append(row)
+        return rows
+
+    def report(self):
+        header = '{:<28} {:>9} {:>9} {:>6} {:>10} {:>9} {:>11} {:>11} {:>11}'.format(
+            'stage', 'wall s', 'cpu s', 'share', 'rss +MB', 'peak MB', 'traced MB', 'rows in', 'rows out')
+        lines = [header, '-' * len(header)]
+
+        def number(value, spec):
+            return '-' if value is None else format(value, spec)
+
+        for row in self.summary():
+            lines.append('{:<28} {:>9} {:>9} {:>6} {:>10} {:>9} {:>11} {:>11} {:>11}'.format(
+                row['stage'][:28], number(row['wall_seconds'], '.3f'), number(row['cpu_seconds'], '.3f'),
+                number(100 * row['share'], '.0f') + '%', number(row['rss_delta_mb'], '+.0f'),
+                number(row['peak_rss_mb'], '.0f'), number(row['tracemalloc_peak_mb'], '.0f'),
+                number(row['rows_in'], ','), number(row['rows_out'], ',')))
+        return '\n'.join(lines)
@@ -0,0 +1,122 @@
+#%%
+# Bounded memory summaries of a stream of chunks, for fitting the preprocessing and scaling
+# the features when the trips do not fit in memory (see incremental_training.py).
+# Like Outliers_detection.QuantileSketch, both are updated chunk by chunk and can be merged
+# across partitions.
+#
+#   - ReservoirSample keeps a uniform random sample of at most `size` rows of the stream
+#     (the power transform lambdas and the KMeans centers are fitted on a sample anyway)
+#   - RunningMoments keeps the count, mean and variance of every column (pairwise update of
+#     Chan et al.), for standard scaling
+
+import numpy as np
+
+
+#%%
+
+class ReservoirSample:
+
+    def __init__(self, size, seed=None):
+        self.size = size
+        self.n = 0
+        self.rows = None
+        self._rng = np.random.default_rng(seed)
+
+    @property
+    def sample(self):
+        if self.rows is None:
+            raise ValueError('Empty sample')
+        return self.rows[:min(self.n, self.size)]
+
+    # rows: 2d array (or 1d for a single column), with the same columns in every chunk
+
+    def update(self, rows):
+        rows = np.asarray(rows)
+        if rows.ndim == 1:
+            rows = rows[:, None]
+        if self.rows is None:
+            self.rows = np.empty((self.size, rows.shape[1]), dtype=rows.dtype)
+
+        # Rows are kept as they come until the reservoir is full
+        filled = min(self.n, self.size)
+        fill = min(self.size - filled, len(rows))
+        self.rows[filled:filled + fill] = rows[:fill]
+
+        # Then the i-th row of the stream (from 0) replaces a random row with probability size / (i + 1)
+        positions = self.n + np.arange(fill, len(rows))
+        slots = self._rng.integers(0, positions + 1)
+        accepted = np.flatnonzero(slots < self.size)
+        if len(accepted):
+            # A slot drawn twice in the chunk keeps the last row, as with a row by row update
+            _, last = np.unique(slots[accepted][::-1], return_index=True)
+            accepted = accepted[len(accepted) - 1 - last]
+            self.rows[slots[accepted]] = rows[fill + accepted]
+        self.n += len(rows)
+        return self
+
+    # Sample of the union of both streams: the number of rows taken from each side follows
+    # the hypergeometric distribution of a sample drawn from all n + other.n rows
+
+    def merge(self, other):
+        if other.n == 0:
+            return self
+        if self.n == 0:
+            self.n, self.rows = other.n, other.rows.copy()
+            return self
+        size = min(self.size, self.n + other.n)
+        from_self = self._rng.hypergeometric(self.n, other.n, size)
+        mine = self.sample[self._rng.choice(len(self.sample), size=from_self, replace=False)]
+        theirs = other.sample[self._rng.choice(len(other.sample), size=size - from_self, replace=False)]
+        self.rows = np.empty((self.size, self.rows.shape[1]), dtype=self.rows.dtype)
+        self.rows[:size] = self._rng.permutation(np.concatenate([mine, theirs]))
+        self.n += other.n
+        return self
+
+    def __len__(self):
+        return min(self.n, self.size)
+
+
+#%%
+
+class RunningMoments:
+
+    def __init__(self):
+        self.n = 0
+        self.mean = None
+        self.m2 = None
+
+    def _combine(self, n, mean, m2):
+        if self.n == 0:
+            self.n, self.mean, self.m2 = n, mean, m2
+            return self
+        total = self.n + n
+        delta = mean - self.mean
+        self.mean = self.mean + delta * (n / total)
+        self.m2 = self.m2 + m2 + delta ** 2 * (self.n * n / total)
+        self.n = total
+        return self
+
+    def update(self, values):
+        values = np.asarray(values, dtype=np.float64)
+        if values.ndim == 1:
+            values = values[:, None]
+        if len(values) == 0:
+            return self
+        mean = values.mean(axis=0)
+        return self._combine(len(values), mean, ((values - mean) ** 2).sum(axis=0))
+
+    def merge(self, other):
+        if other.n == 0:
+            return self
+        return self._combine(other.n, other.mean, other.m2)
+
+    @property
+    def variance(self):
+        return self.m2 / self.n
+
+    # Standard deviation with constant columns set to 1, same as sklearn's StandardScaler
+
+    @property
+    def scale(self):
+        std = np.sqrt(self.variance)
+        return np.where(std > 0, std, 1.0)
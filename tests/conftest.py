@@ -0,0 +1,12 @@
+#%%
+# The modules are flat files at the root of the repository, the synthetic trips are in
+# benchmarks/synthetic_trips.py.
+
+import os
+import sys
+
+REPOSITORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+for path in (REPOSITORY, os.path.join(REPOSITORY, 'benchmarks')):
+    if path not in sys.path:
+        sys.path.insert(0, path)
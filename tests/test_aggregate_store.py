@@ -0,0 +1,31 @@
+import numpy as np
+import pytest
+
+from aggregate_store import AggregateStore
+from preprocessing_pipeline import feature_arrays
+from synthetic_trips import make_trips
+from trip_features import add_trip_features
+
+
+# The out-of-fold features of a fold are the ones of a store built on the other folds only
+
+def test_out_of_fold_matches_a_store_without_the_fold():
+    trips = add_trip_features(make_trips(20_000))
+    features = AggregateStore().update_frame(trips).out_of_fold_frame(trips, n_folds=3, random_state=0)
+
+    folds = np.random.default_rng(0).integers(3, size=len(trips))
+    for fold in range(3):
+        other = trips[folds != fold]
+        store = AggregateStore().update_frame(other)
+        own = trips[folds == fold]
+        np.testing.assert_array_equal(features[folds == fold], store.lookup_frame(own))
+
+
+def test_merge_needs_the_same_centers():
+    centers = np.array([[-73.98, 40.75], [-73.95, 40.78]])
+    AggregateStore(centers=centers).merge(AggregateStore(centers=centers.copy()))
+    for store, other in [(AggregateStore(centers=centers), AggregateStore(centers=centers + 0.01)),
+                         (AggregateStore(centers=centers), AggregateStore()),
+                         (AggregateStore(), AggregateStore(centers=centers))]:
+        with pytest.raises(ValueError):
+            store.merge(other)
@@ -0,0 +1,38 @@
+import socket
+import urllib.error
+
+from geocoding import NominatimBackend, ReverseGeocoder
+
+
+# Fails for the points north of latitude 40.8 until it is fixed
+
+class FlakyBackend(NominatimBackend):
+
+    def __init__(self):
+        super().__init__('test', requests_per_second=None, max_concurrency=4)
+        self.broken = True
+        self.calls = 0
+
+    def reverse(self, latitude, longitude):
+        self.calls += 1
+        if self.broken and latitude > 40.8:
+            raise (urllib.error.URLError('503') if longitude > -73.95 else socket.timeout('timed out'))
+        return '{:.4f}, {:.4f}'.format(latitude, longitude)
+
+
+def test_failed_lookups_do_not_abort_the_batch(tmp_path):
+    backend = FlakyBackend()
+    geocoder = ReverseGeocoder(backend, str(tmp_path / 'cache.sqlite'))
+    latitudes = [40.75, 40.85, 40.76, 40.86]
+    longitudes = [-73.98, -73.90, -73.97, -73.99]
+
+    addresses = geocoder.reverse_many(latitudes, longitudes)
+    assert addresses == ['40.7500, -73.9800', None, '40.7600, -73.9700', None]
+    assert len(backend.errors_) == 2
+
+    # The successful lookups were cached, only the failed ones are sent again
+    backend.broken = False
+    backend.calls = 0
+    addresses = geocoder.reverse_many(latitudes, longitudes)
+    assert None not in addresses
+    assert backend.calls == 2
@@ -0,0 +1,34 @@
+import numpy as np
+import pandas as pd
+
+from incremental_training import cleaned_chunks, evaluate, fit_preprocessor, train_xgboost
+from preprocessing_pipeline import NUMERIC_FEATURES, TARGET, TripPreprocessor
+from synthetic_trips import write_trips_csv
+
+
+# Chunked training on a small file against the same model trained on all the rows in memory:
+# the streamed preprocessor keeps the distinct values of the features and the held out RMSLE
+# is as good
+
+def test_incremental_training_matches_in_memory_training(tmp_path):
+    import xgboost as xgb
+
+    path = write_trips_csv(str(tmp_path / 'trips.csv'), 20_000)
+    chunksize = 5_000
+    params = {'tree_method': 'hist', 'objective': 'reg:squarederror', 'learning_rate': 0.1, 'max_depth': 6}
+
+    trips = pd.concat(list(cleaned_chunks(path, chunksize)))
+    in_memory = TripPreprocessor().fit(trips, trips[TARGET])
+    X = in_memory.transform(trips)
+    model = xgb.train(params, xgb.DMatrix(X, in_memory.transform_target(trips[TARGET])), num_boost_round=50)
+    expected = evaluate(model, path, in_memory, chunksize)
+
+    preprocessor = fit_preprocessor(path, chunksize)
+    X_stream = preprocessor.transform(trips)
+    for j, column in enumerate(NUMERIC_FEATURES):
+        assert len(np.unique(X_stream[:, j])) >= 0.95 * len(np.unique(X[:, j])), column
+    booster = train_xgboost(path, preprocessor, chunksize, params, num_boost_round=50)
+    result = evaluate(booster, path, preprocessor, chunksize)
+
+    assert result['rows'] == expected['rows'] > 1_000
+    assert result['rmsle'] <= 1.02 * expected['rmsle']
@@ -0,0 +1,24 @@
+import numpy as np
+import pandas as pd
+
+from Outliers_detection import Clipper
+
+
+# Clipped columns keep their dtype, integer limits are rounded inwards
+
+def test_clipping_keeps_the_dtypes():
+    data = pd.DataFrame({'passenger_count': np.array([0, 1, 2, 9], dtype=np.int64),
+                         'trip_duration': np.array([5, 600, 900, 90_000], dtype=np.int32),
+                         'pickup_latitude': np.array([40.7, 40.8, 41.9, 10.0], dtype=np.float32)})
+    limits = {'passenger_count': (0.5, 3.5), 'trip_duration': (10.2, 3600.7), 'pickup_latitude': (40.5, 41.0)}
+    clipper = Clipper(limits=limits)
+    dtypes = data.dtypes.copy()
+
+    clipped = clipper.transform(data)
+    assert (clipped.dtypes == dtypes).all()
+    assert clipped['passenger_count'].tolist() == [1, 1, 2, 3]
+    assert clipped['trip_duration'].tolist() == [11, 600, 900, 3600]
+    np.testing.assert_array_equal(clipped['pickup_latitude'].to_numpy(),
+                                  np.array([40.7, 40.8, 41.0, 40.5], dtype=np.float32))
+    assert clipper.clip_counts_ == {'passenger_count': (1, 1), 'trip_duration': (1, 1), 'pickup_latitude': (1, 1)}
+
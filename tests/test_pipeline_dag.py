@@ -0,0 +1,68 @@
+import importlib
+import os
+import sys
+
+import numpy as np
+
+from model_benchmark import MODEL_FAMILIES
+from pipeline_dag import Pipeline, Stage, code_dependencies
+from synthetic_trips import make_trips
+from trip_pipeline import trip_pipeline
+
+# scaled reaches the constant through two imports, numbers does not import it
+SOURCES = {
+    'dag_test_settings': 'FACTOR = {factor}\n',
+    'dag_test_helpers': 'from dag_test_settings import FACTOR\n\n\ndef scale(values):\n    return values * FACTOR\n',
+    'dag_test_scaled': 'import dag_test_helpers\n\n\ndef scaled(values):\n    return dag_test_helpers.scale(values)\n',
+    'dag_test_numbers': 'import numpy as np\n\n\ndef numbers(n):\n    return np.arange(n)\n',
+}
+
+
+def _write_modules(directory, factor):
+    for name, source in SOURCES.items():
+        (directory / (name + '.py')).write_text(source.format(factor=factor))
+    for name in SOURCES:
+        sys.modules.pop(name, None)
+    return importlib.import_module('dag_test_numbers'), importlib.import_module('dag_test_scaled')
+
+
+def _pipeline(directory, factor):
+    numbers, scaled = _write_modules(directory, factor)
+    return Pipeline([Stage('numbers', numbers.numbers, params={'n': 5}),
+                     Stage('scaled', scaled.scaled, ['numbers'])], str(directory / 'cache'))
+
+
+def test_editing_an_imported_constant_reruns_the_stage(tmp_path, monkeypatch):
+    monkeypatch.syspath_prepend(str(tmp_path))
+    try:
+        pipeline = _pipeline(tmp_path, 2)
+        assert sorted(code_dependencies(pipeline.stages['scaled'].function)) == [
+            'dag_test_helpers.FACTOR', 'dag_test_helpers.scale', 'dag_test_scaled.scaled']
+        assert sorted(code_dependencies(pipeline.stages['numbers'].function)) == ['dag_test_numbers.numbers']
+        np.testing.assert_array_equal(pipeline.run(['scaled'], verbose=False)['scaled'], np.arange(5) * 2)
+        assert pipeline.plan(['scaled'])[0] == []
+
+        pipeline = _pipeline(tmp_path, 3)
+        assert pipeline.plan(['scaled'])[0] == ['scaled']
+        np.testing.assert_array_equal(pipeline.run(['scaled'], verbose=False)['scaled'], np.arange(5) * 3)
+    finally:
+        for name in SOURCES:
+            sys.modules.pop(name, None)
+
+
+# A model hyperparameter is only in the key of its train stage and of the evaluation
+
+def test_editing_a_model_parameter_keeps_the_data_stages_cached(tmp_path, monkeypatch):
+    path = str(tmp_path / 'trips.csv')
+    make_trips(2_000).to_csv(path, index=False)
+    pipeline = trip_pipeline(path, models=['linear_regression'], plots_dir='',
+                             cache_dir=str(tmp_path / 'cache'))
+    pipeline.run(['evaluation'], verbose=False)
+    assert set(pipeline.status().values()) == {'cached'}
+
+    module, class_name, params, extension = MODEL_FAMILIES['linear_regression']
+    monkeypatch.setitem(MODEL_FAMILIES, 'linear_regression', (module, class_name, dict(params, fit_intercept=False),
+                                                              extension))
+    status = pipeline.status()
+    assert [name for name, state in status.items() if state == 'to run'] == ['train_linear_regression', 'evaluation']
+    assert status['load'] == 'cached'
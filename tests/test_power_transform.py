@@ -0,0 +1,26 @@
+import numpy as np
+
+from power_transform import YeoJohnson
+from synthetic_trips import make_trips
+
+COORDINATES = ['pickup_longitude', 'pickup_latitude', 'dropoff_longitude', 'dropoff_latitude']
+
+
+# The float32 coordinates get extreme lambdas, their transformed values must stay as distinct
+# as the coordinates
+
+def test_float32_coordinates_keep_their_distinct_values():
+    trips = make_trips(200_000)[COORDINATES]
+    assert (trips.dtypes == np.float32).all()
+    transformer = YeoJohnson().fit(trips)
+    assert max(abs(lmbda) for lmbda in transformer.lambdas_) > 2
+
+    transformed = transformer.transform(trips)
+    for column in COORDINATES:
+        assert transformed[column].dtype == np.float64
+        assert transformed[column].nunique() == trips[column].nunique(), column
+
+    array = transformer.transform(trips.to_numpy())
+    for j, column in enumerate(COORDINATES):
+        assert len(np.unique(array[:, j])) == trips[column].nunique(), column
+
@@ -0,0 +1,69 @@
+import numpy as np
+
+from power_transform import yeo_johnson
+from preprocessing_pipeline import NUMERIC_FEATURES, TripPreprocessor, feature_arrays
+from synthetic_trips import make_trips
+
+
+# Distinct raw values of each numeric feature left after the clipping, computed on the raw values:
+# the transform is increasing, all the values past a limit become that limit
+
+def _distinct_after_clipping(preprocessor, columns):
+    counts = {}
+    for j, column in enumerate(NUMERIC_FEATURES):
+        values = columns[column].astype(np.float64)
+        transformed = yeo_johnson(values, preprocessor.lambdas_[j], shift=preprocessor.shifts_[j])
+        lower, upper = preprocessor.limits_.get(column, (-np.inf, np.inf))
+        inside = (transformed > lower) & (transformed < upper)
+        counts[column] = len(np.unique(values[inside])) + (transformed <= lower).any() + (transformed >= upper).any()
+    return counts
+
+
+# The float32 matrix keeps the distinct values of every feature (up to a few float32 roundings
+# of close values), however extreme the lambdas of the coordinates
+
+def test_transform_keeps_the_distinct_values_of_every_feature():
+    trips = make_trips(200_000)
+    preprocessor = TripPreprocessor(n_clusters=0).fit(trips, trips['trip_duration'])
+    assert max(abs(lmbda) for lmbda in preprocessor.lambdas_) > 5
+
+    X = preprocessor.transform(trips)
+    assert X.dtype == np.float32 and np.isfinite(X).all()
+    expected = _distinct_after_clipping(preprocessor, feature_arrays(trips))
+    for j, column in enumerate(NUMERIC_FEATURES):
+        assert len(np.unique(X[:, j])) >= 0.999 * expected[column], column
+
+
+def test_transform_one_matches_transform():
+    trips = make_trips(2_000)
+    preprocessor = TripPreprocessor(n_clusters=0).fit(trips, trips['trip_duration'])
+    X = preprocessor.transform(trips)
+    for i, trip in enumerate(trips.head(50).to_dict('records')):
+        np.testing.assert_allclose(preprocessor.transform_one(trip)[0], X[i], rtol=1e-5, atol=1e-5)
+
+
+# With an aggregate store the training trips get out-of-fold store features, new trips the lookups,
+# and the store is saved and loaded with the preprocessor (scalar and frame paths alike)
+
+def test_aggregate_store_features_in_the_scoring_path(tmp_path):
+    from aggregate_store import FEATURE_NAMES, AggregateStore
+
+    trips = make_trips(5_000)
+    train, new = trips.iloc[:4_000], trips.iloc[4_000:]
+    preprocessor = TripPreprocessor(n_clusters=0, aggregate_store=AggregateStore())
+    X_train = preprocessor.fit_transform(train, train['trip_duration'])
+    store = preprocessor.aggregate_store
+    assert store.n_trips == len(train)
+    assert preprocessor.feature_names_[-len(FEATURE_NAMES):] == FEATURE_NAMES
+    np.testing.assert_array_equal(X_train[:, -len(FEATURE_NAMES):],
+                                  store.out_of_fold_frame(train, random_state=preprocessor.random_state))
+
+    path = str(tmp_path / 'preprocessor.json')
+    preprocessor.save(path)
+    loaded = TripPreprocessor.load(path)
+    np.testing.assert_array_equal(loaded.aggregate_store.duration_counts, store.duration_counts)
+    X = loaded.transform(new)
+    np.testing.assert_array_equal(X, preprocessor.transform(new))
+    np.testing.assert_array_equal(X[:, -len(FEATURE_NAMES):], store.lookup_frame(new))
+    for i, trip in enumerate(new.head(50).to_dict('records')):
+        np.testing.assert_allclose(loaded.transform_one(trip)[0], X[i], rtol=1e-5, atol=1e-5)
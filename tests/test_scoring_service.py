@@ -0,0 +1,49 @@
+import http.client
+import json
+import urllib.parse
+
+import pytest
+from sklearn.ensemble import HistGradientBoostingRegressor
+
+from preprocessing_pipeline import RAW_FEATURES, TripPreprocessor
+from scoring_service import ScoringServer, TripScorer
+from synthetic_trips import make_trips
+from trip_loader import DATETIME_FORMAT
+
+
+@pytest.fixture(scope='module')
+def server():
+    df = make_trips(5_000)
+    preprocessor = TripPreprocessor().fit(df, df['trip_duration'])
+    model = HistGradientBoostingRegressor(max_iter=10).fit(preprocessor.transform(df),
+                                                           preprocessor.transform_target(df['trip_duration']))
+    server = ScoringServer(TripScorer(model, preprocessor)).start()
+    raw = df[RAW_FEATURES].iloc[:1]
+    server.trip = raw.assign(pickup_datetime=raw['pickup_datetime'].dt.strftime(DATETIME_FORMAT)).to_dict('records')[0]
+    yield server
+    server.stop()
+
+
+# Bad payloads get a 400 with a JSON error on the same keep-alive connection, which then
+# still serves a valid trip
+
+def test_bad_payloads_get_a_json_error(server):
+    url = urllib.parse.urlparse(server.url)
+    connection = http.client.HTTPConnection(url.hostname, url.port, timeout=10)
+    bodies = ['not json', '[1, 2]', '"trip"', 'null', json.dumps({'vendor_id': 1}),
+              json.dumps(dict(server.trip, pickup_datetime=1467331198)),
+              json.dumps(dict(server.trip, pickup_longitude='east')),
+              json.dumps(dict(server.trip, passenger_count=None))]
+    try:
+        for body in bodies:
+            connection.request('POST', '/predict', body.encode(), {'Content-Type': 'application/json'})
+            response = connection.getresponse()
+            assert response.status == 400, body
+            assert json.loads(response.read())['error']
+
+        connection.request('POST', '/predict', json.dumps(server.trip).encode(), {'Content-Type': 'application/json'})
+        response = connection.getresponse()
+        assert response.status == 200
+        assert json.loads(response.read())['trip_duration'] > 0
+    finally:
+        connection.close()
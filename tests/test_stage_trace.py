@@ -0,0 +1,27 @@
+import tracemalloc
+
+import numpy as np
+
+from stage_trace import StageTracer
+
+
+def test_rows_accept_numpy_integers_and_sized_objects():
+    tracer = StageTracer(trace_memory=False)
+    mask = np.array([True, False, True])
+    with tracer.stage('filter', rows_in=np.int64(3)) as stage:
+        stage['rows_out'] = mask.sum()
+    with tracer.stage('sized', rows_in=[1, 2]) as stage:
+        stage['rows_out'] = len(mask) - np.int32(1)
+    assert [(record['rows_in'], record['rows_out']) for record in tracer.records] == [(3, 2), (2, 2)]
+    assert all(type(record['rows_out']) is int for record in tracer.records)
+
+
+def test_memory_tracing_from_the_environment(monkeypatch):
+    monkeypatch.setenv('STAGE_TRACE_MEMORY', '1')
+    tracer = StageTracer()
+    try:
+        with tracer.stage('allocate'):
+            values = np.ones(1_000_000)
+        assert tracer.records[0]['tracemalloc_peak_mb'] >= values.nbytes / 1e6
+    finally:
+        tracemalloc.stop()
@@ -0,0 +1,39 @@
+import numpy as np
+import pytest
+
+from synthetic_trips import make_trips
+from trip_features import (GEO_FEATURES, bearing_array, dummy_manhattan_distance, geodesic_features,
+                           haversine_distance, trip_geodesic_features)
+
+COORDINATES = ['pickup_latitude', 'pickup_longitude', 'dropoff_latitude', 'dropoff_longitude']
+
+
+@pytest.fixture(scope='module')
+def trips():
+    return make_trips(2_000)[COORDINATES].astype(np.float64)
+
+
+def _vector_features(trips, engine):
+    features = geodesic_features(*(trips[column].values for column in COORDINATES), dtype=np.float64, engine=engine)
+    return np.column_stack([features[column] for column in GEO_FEATURES])
+
+
+# The numpy, numba and scalar paths give the same features for every row, and the same as the
+# unfused functions of the notebook
+
+@pytest.mark.parametrize('engine', ['numpy', 'numba'])
+def test_vector_and_scalar_paths_agree_row_by_row(trips, engine):
+    if engine == 'numba':
+        pytest.importorskip('numba')
+    vector = _vector_features(trips, engine)
+    scalar = np.array([trip_geodesic_features(*row) for row in trips[COORDINATES].itertuples(index=False)])
+    np.testing.assert_allclose(vector, scalar, rtol=1e-12, atol=1e-9)
+
+
+def test_fused_features_match_the_notebook_functions(trips):
+    features = _vector_features(trips, 'numpy')
+    lat1, long1, lat2, long2 = COORDINATES
+    np.testing.assert_allclose(features[:, 0], haversine_distance(trips, lat1, lat2, long1, long2), rtol=1e-9)
+    np.testing.assert_allclose(features[:, 3], dummy_manhattan_distance(trips, lat1, long1, lat2, long2), rtol=1e-9)
+    np.testing.assert_allclose(features[:, 4], bearing_array(trips, trips[lat1], trips[long1], trips[lat2],
+                                                             trips[long2]), atol=1e-9)
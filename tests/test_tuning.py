@@ -0,0 +1,53 @@
+import json
+
+import numpy as np
+import pytest
+
+from tuning import HalvingSearch
+
+PARAM_DIST = {'learning_rate': [0.05, 0.1, 0.2, 0.3], 'max_depth': [2, 3, 4, 5]}
+
+
+def _data(seed=0):
+    rng = np.random.default_rng(seed)
+    X = rng.normal(size=(300, 4)).astype(np.float32)
+    return X, X[:, 0] * 2 + rng.normal(scale=0.1, size=300)
+
+
+def _search(log_path, n_trials=4, **params):
+    return HalvingSearch(PARAM_DIST, n_trials=n_trials, min_rounds=3, max_rounds=9, n_folds=2, n_jobs=1,
+                         log_path=str(log_path), **params)
+
+
+def test_log_of_other_data_is_rejected(tmp_path):
+    log_path = tmp_path / 'trials.jsonl'
+    X, y = _data()
+    _search(log_path).fit(X, y)
+    with open(log_path) as f:
+        assert 'fingerprint' in json.loads(f.readline())
+
+    with pytest.raises(ValueError, match='other data or settings'):
+        _search(log_path).fit(X, y + 1)
+    with pytest.raises(ValueError, match='other data or settings'):
+        _search(log_path, random_state=7).fit(X, y)
+
+    search = _search(log_path, stale_log='restart').fit(X, y + 1)
+    assert (tmp_path / 'trials.jsonl.stale').exists()
+    # Started over: every trial trained again on the new target
+    assert len(search.trials_) > 0
+    with open(log_path) as f:
+        assert len(f.readlines()) == 1 + len(search.trials_)
+
+
+def test_resume_with_fewer_trials(tmp_path):
+    log_path = tmp_path / 'trials.jsonl'
+    X, y = _data()
+    _search(log_path, n_trials=4).fit(X, y)
+    with open(log_path) as f:
+        logged = len(f.readlines())
+
+    search = _search(log_path, n_trials=2).fit(X, y)
+    assert search.trials_['trial'].max() < 2
+    # Nothing was trained again
+    with open(log_path) as f:
+        assert len(f.readlines()) == logged
@@ -0,0 +1,272 @@
+#%%
+# Exact and near duplicate trips from 64-bit row fingerprints, without copying the frame.
+#
+# len(df) - len(df.drop_duplicates()) builds a deduplicated copy of the whole frame (and hashes
+# the Python strings of every object column) just to count. Here every row of a chosen subset
+# of columns is folded into one uint64 fingerprint with vectorized numpy code:
+#   - numbers by their bits (float32 / float64 widened, -0.0 and NaN made canonical),
+#     datetimes by their nanoseconds, categories by the hash of their category, strings with
+#     pd.util.hash_array (fixed key, so the same value gets the same hash in every chunk)
+#   - the column keys folded with the splitmix64 finalizer, so the column order matters
+# A row is a duplicate when its fingerprint was seen in an earlier row (keep='first' of
+# pandas.duplicated). Two different rows get the same fingerprint with probability ~n^2 / 2^65,
+# about 1e-7 for 2M trips.
+#
+# Near duplicates: the columns with a tolerance are quantized before hashing, a coordinate to
+# cells of `tolerance` degrees and a datetime to buckets of `tolerance` seconds, so trips of the
+# same vendor a few meters and seconds apart get the same fingerprint. Two close values on both
+# sides of a cell border would be missed, so each row is also hashed on a second grid shifted by
+# half a cell (offsets), and a row is a near duplicate of an earlier one sharing a cell on any
+# grid. Rows a little more than a tolerance apart may match as well (up to 2 cells). Each grid
+# costs one more fingerprint per row: trips moved by up to 1/3 of the tolerances in all five
+# columns are found 43% of the time with one grid, 71% with two and 94% with four
+# (benchmarks/bench_duplicates.py).
+#
+# DuplicateFinder streams the chunks of a file (trip_loader.iter_trips): only the fingerprints
+# seen so far are kept, in a FingerprintSet of sorted uint64 runs (8 bytes per distinct row and
+# grid, against ~100 bytes per entry of a Python set), and each chunk gives the index labels of
+# its duplicate rows.
+#
+#   python trip_duplicates.py train.csv [--near] [--output duplicates.npy]
+
+import argparse
+
+import numpy as np
+import pandas as pd
+
+
+# Same trip under another id
+TRIP_KEY_COLUMNS = ['vendor_id', 'pickup_datetime', 'pickup_longitude', 'pickup_latitude',
+                    'dropoff_longitude', 'dropoff_latitude']
+
+# Seconds for the datetimes, degrees for the coordinates (1e-4 degrees is ~11 m of latitude
+# and ~8 m of longitude in New York)
+NEAR_DUPLICATE_TOLERANCES = {
+    'pickup_datetime': 60,
+    'pickup_longitude': 1e-4,
+    'pickup_latitude': 1e-4,
+    'dropoff_longitude': 1e-4,
+    'dropoff_latitude': 1e-4,
+}
+
+# Grids of the quantized columns, in cells
+NEAR_DUPLICATE_OFFSETS = (0.0, 0.5)
+
+# Key of a missing value (NaN, NaT, missing category) in every column
+_MISSING_KEY = np.uint64(0x9E3779B97F4A7C15)
+
+_SEED = np.uint64(0x2545F4914F6CDD1D)
+
+
+#%%
+
+def _mix64(z):
+    z ^= z >> np.uint64(30)
+    z *= np.uint64(0xBF58476D1CE4E5B9)
+    z ^= z >> np.uint64(27)
+    z *= np.uint64(0x94D049BB133111EB)
+    z ^= z >> np.uint64(31)
+    return z
+
+
+def _is_datetime(dtype):
+    return dtype.kind == 'M' or isinstance(dtype, pd.DatetimeTZDtype)
+
+
+def _nanoseconds(series):
+    values = series
+    if isinstance(series.dtype, pd.DatetimeTZDtype):
+        values = series.dt.tz_convert('UTC').dt.tz_localize(None)
+    return values.to_numpy(dtype='datetime64[ns]').view(np.int64)
+
+
+# Cell of every value on the grid shifted by offset cells
+
+def _quantized_key(series, tolerance, offset):
+    if _is_datetime(series.dtype):
+        nanoseconds = _nanoseconds(series)
+        missing = nanoseconds == np.iinfo(np.int64).min
+        values = nanoseconds / (tolerance * 1e9)
+    else:
+        values = series.to_numpy(dtype=np.float64, na_value=np.nan) / tolerance
+        missing = ~np.isfinite(values)
+    values += offset
+    np.floor(values, out=values)
+    values[missing] = 0
+    keys = values.astype(np.int64).view(np.uint64)
+    keys[missing] = _MISSING_KEY
+    return keys
+
+
+def _exact_key(series):
+    dtype = series.dtype
+    if isinstance(dtype, pd.CategoricalDtype):
+        codes = series.cat.codes.to_numpy()
+        hashes = pd.util.hash_array(dtype.categories.to_numpy(dtype=object))
+        return np.where(codes >= 0, hashes[codes], _MISSING_KEY)
+    if _is_datetime(dtype):
+        return _nanoseconds(series).view(np.uint64).copy()
+    if dtype.kind in 'biu' and not isinstance(dtype, pd.api.extensions.ExtensionDtype):
+        return series.to_numpy().astype(np.int64).view(np.uint64)
+    if dtype.kind in 'biuf':
+        # numpy floats and the nullable numbers, missing values as NaN
+        values = series.to_numpy(dtype=np.float64, na_value=np.nan) + 0.0
+        missing = np.isnan(values)
+        keys = values.view(np.uint64)
+        keys[missing] = _MISSING_KEY
+        return keys
+    # Hashing every string is faster than factorizing them first for mostly distinct ones (ids)
+    return pd.util.hash_array(series.to_numpy(dtype=object), categorize=False)
+
+
+# One uint64 per row of data[columns] (all the columns when None). Columns in tolerances are
+# quantized to cells of that size, shifted by offset cells; grid salts the fingerprints so
+# the ones of different grids never match.
+
+def row_fingerprints(data, columns=None, tolerances=None, offset=0.0, grid=0):
+    columns = list(data.columns if columns is None else columns)
+    tolerances = tolerances or {}
+    fingerprints = np.full(len(data), _SEED + np.uint64(grid), dtype=np.uint64)
+    for column in columns:
+        tolerance = tolerances.get(column)
+        if tolerance is None:
+            fingerprints ^= _exact_key(data[column])
+        else:
+            fingerprints ^= _quantized_key(data[column], tolerance, offset)
+        _mix64(fingerprints)
+    return fingerprints
+
+
+#%%
+
+# Set of uint64 kept as sorted runs without duplicates. A new run is merged into the one before
+# it while that one is less than twice its size, so every run is more than twice the next:
+# O(log n) runs, each value copied O(log n) times in all.
+
+class FingerprintSet:
+
+    def __init__(self):
+        self.runs = []
+
+    def __len__(self):
+        return sum(len(run) for run in self.runs)
+
+    @property
+    def nbytes(self):
+        return sum(run.nbytes for run in self.runs)
+
+    def contains(self, fingerprints):
+        fingerprints = np.asarray(fingerprints, dtype=np.uint64)
+        found = np.zeros(len(fingerprints), dtype=bool)
+        for run in self.runs:
+            positions = np.searchsorted(run, fingerprints)
+            np.minimum(positions, len(run) - 1, out=positions)
+            found |= run[positions] == fingerprints
+        return found
+
+    def _add_run(self, run):
+        if len(run) == 0:
+            return
+        self.runs.append(run)
+        while len(self.runs) > 1 and len(self.runs[-2]) <= 2 * len(self.runs[-1]):
+            last = self.runs.pop()
+            merged = np.concatenate([self.runs.pop(), last])
+            # Two sorted runs: timsort merges them in linear time
+            merged.sort(kind='stable')
+            self.runs.append(merged)
+
+    def add(self, fingerprints):
+        unique = np.unique(np.asarray(fingerprints, dtype=np.uint64))
+        self._add_run(unique[~self.contains(unique)])
+        return self
+
+    # Adds the fingerprints and returns which ones were already seen: in the set, or earlier
+    # in the array
+
+    def update(self, fingerprints):
+        fingerprints = np.asarray(fingerprints, dtype=np.uint64)
+        unique, first, inverse = np.unique(fingerprints, return_index=True, return_inverse=True)
+        known = self.contains(unique)
+        seen = known[inverse]
+        repeated = np.ones(len(fingerprints), dtype=bool)
+        repeated[first] = False
+        seen |= repeated
+        self._add_run(unique[~known])
+        return seen
+
+
+#%%
+
+class DuplicateFinder:
+
+    def __init__(self, columns=None, tolerances=None, offsets=None):
+        self.columns = None if columns is None else list(columns)
+        self.tolerances = dict(tolerances or {})
+        if offsets is None:
+            offsets = NEAR_DUPLICATE_OFFSETS if self.tolerances else (0.0,)
+        self.offsets = tuple(offsets)
+        self.seen = FingerprintSet()
+        self.n_rows = 0
+        self.n_duplicates = 0
+
+    # Boolean mask of the rows of the chunk that repeat an earlier row of the stream
+
+    def duplicated(self, chunk):
+        fingerprints = np.concatenate([row_fingerprints(chunk, self.columns, self.tolerances, offset, grid)
+                                       for grid, offset in enumerate(self.offsets)])
+        duplicated = self.seen.update(fingerprints).reshape(len(self.offsets), len(chunk)).any(axis=0)
+        self.n_rows += len(chunk)
+        self.n_duplicates += int(duplicated.sum())
+        return duplicated
+
+    # Index labels of the duplicate rows of the chunk
+
+    def update(self, chunk):
+        return chunk.index[self.duplicated(chunk)]
+
+
+# Index labels of the rows of data that repeat an earlier row, on columns (all when None),
+# the columns in tolerances compared on their quantized values
+
+def duplicate_index(data, columns=None, tolerances=None, offsets=None):
+    return DuplicateFinder(columns, tolerances, offsets).update(data)
+
+
+# Index labels of the duplicates of every chunk of a stream, e.g. trip_loader.iter_trips
+# (whose index counts the rows of the file)
+
+def iter_duplicates(chunks, columns=None, tolerances=None, offsets=None):
+    finder = DuplicateFinder(columns, tolerances, offsets)
+    for chunk in chunks:
+        yield finder.update(chunk)
+
+
+#%%
+
+def main(argv=None):
+    from trip_loader import DEFAULT_CHUNKSIZE, iter_trips
+
+    parser = argparse.ArgumentParser(description='Row numbers of the duplicate trips of a CSV, streamed in chunks')
+    parser.add_argument('input', help='CSV file with the trips')
+    parser.add_argument('--columns', nargs='+', help='columns compared (default: all, or the trip key with --near)')
+    parser.add_argument('--near', action='store_true',
+                        help='same vendor within {pickup_datetime} s and {pickup_latitude} degrees'.format(
+                            **NEAR_DUPLICATE_TOLERANCES))
+    parser.add_argument('--chunksize', type=int, default=DEFAULT_CHUNKSIZE)
+    parser.add_argument('--output', help='.npy file for the row numbers of the duplicates')
+    args = parser.parse_args(argv)
+
+    columns = args.columns or (TRIP_KEY_COLUMNS if args.near else None)
+    tolerances = NEAR_DUPLICATE_TOLERANCES if args.near else None
+    finder = DuplicateFinder(columns, tolerances)
+    rows = [finder.update(chunk).to_numpy(dtype=np.int64)
+            for chunk in iter_trips(args.input, args.chunksize, usecols=columns)]
+    rows = np.concatenate(rows) if rows else np.empty(0, dtype=np.int64)
+    print('{:,} duplicates in {:,} rows ({:.1f} MB of fingerprints)'.format(
+        finder.n_duplicates, finder.n_rows, finder.seen.nbytes / 1e6))
+    if args.output:
+        np.save(args.output, rows)
+
+
+if __name__ == '__main__':
+    main()
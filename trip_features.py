@@ -0,0 +1,336 @@
+#%%
+# Derived trip features shared by file_main.py and new_main.py:
+# distances, center point and direction of the trip, plus the datetime features.
+#
+# Bump FEATURE_VERSION whenever the output of add_trip_features changes,
+# so cached features from feature_cache.py are recomputed.
+
+import importlib.util
+import math
+import os
+import types
+from datetime import datetime
+
+import numpy as np
+
+
+# numba is only imported the first time the numba kernel runs (the import alone takes ~0.3 s)
+NUMBA_AVAILABLE = importlib.util.find_spec('numba') is not None
+
+
+FEATURE_VERSION = 3
+
+EARTH_RADIUS_KM = 6371 #average radius of earth in kilometers
+
+# Rows per block in the numpy version of geodesic_features,
+# bounds the float64 temporaries to a few MB whatever the size of the input
+GEODESIC_BLOCK_SIZE = 65536
+
+GEO_FEATURES = ['trip_distance(km)', 'center_latitude', 'center_longitude', 'distance_manhattan', 'direction']
+
+DATETIME_FEATURES = ['month', 'week', 'weekday', 'hour', 'minute_oftheday']
+
+# Pickups or dropoffs outside of this box (long_min, lat_min, long_max, lat_max) are considered outside New York
+NYC_BOUNDS = (-74.15, 40.5774, -73.7004, 40.9176)
+
+
+#%%
+
+#Haversine distance is a formula used to calculate the distance between two points on the surface of a sphere,
+#given their latitude and longitude in decimal degrees.
+#This formula is often employed to calculate the distance between two locations on earth
+#where the earth is approximately spherical
+
+def haversine_distance(df, lat1, lat2, long1, long2):
+
+    r = 6371 #average radius of earth in kilometers
+
+    phi1 = np.radians(df[lat1])
+
+    phi2 = np.radians(df[lat2])
+
+    delta_phi = np.radians(df[lat2] - df[lat1])
+
+    delta_lambda = np.radians(df[long2] - df[long1])
+
+    a = np.sin(delta_phi/2) ** 2 + np.cos(phi1) * np.cos(phi2) * np.sin(delta_lambda/2)**2
+
+    c = 2 * np.arctan2(np.sqrt(a), np.sqrt(1-a))
+
+    d = r * c
+
+    return d
+
+
+# Approximation of the distance driven on a street grid:
+# the north-south leg plus the east-west leg of the trip
+
+def dummy_manhattan_distance(df, lat1, long1, lat2, long2):
+    a = haversine_distance(df, lat1, lat1, long1, long2)
+    b = haversine_distance(df, lat1, lat2, long1, long1)
+    return a + b
+
+
+#calculates the compass bearing (direction) between two geographic points specified by their latitude and longitude coordinates.
+#The bearing is the angle measured in degrees from the north direction (0 degrees) in a clockwise direction
+#The resulting bearing is typically expressed as a value between -180 and 180 degrees where 0 degrees is north,
+#90 degrees is east, 180 (or -180) degrees is south, and -90 degrees is west
+
+def bearing_array(df,lat1, long1, lat2, long2):
+    long_delta_rad = np.radians(long2 - long1)
+    lat1, long1, lat2, long2 = map(np.radians, (lat1, long1, lat2, long2))
+    y = np.sin(long_delta_rad) * np.cos(lat2)
+    x = np.cos(lat1) * np.sin(lat2) - np.sin(lat1) * np.cos(lat2) * np.cos(long_delta_rad)
+    return np.degrees(np.arctan2(y, x))
+
+
+#%%
+
+# Fused version of the three functions above: the coordinates are converted to radians once
+# and the trig terms are shared between the haversine distance, the manhattan approximation
+# and the bearing.
+#   sin(dlambda) = 2 sin(dlambda/2) cos(dlambda/2),  cos(dlambda) = 1 - 2 sin(dlambda/2)^2
+# The manhattan legs are haversine distances with one of the two deltas set to 0,
+# so they reuse the two terms of the haversine sum.
+#
+# The formulas are written once, in _geodesic, and run three ways: with numpy's ufuncs on
+# float64 blocks of rows (m=np), compiled by numba for one row at a time (numba has the numpy
+# ufuncs for scalars) and on Python floats with the math module (m=_SCALAR_MATH, one numpy call
+# on a scalar costs more than the math itself).
+# Inputs are float64 arrays or floats, returns the GEO_FEATURES values in that order.
+
+def _geodesic(lat1, long1, lat2, long2, m=np):
+    phi1 = m.radians(lat1)
+    phi2 = m.radians(lat2)
+    cos_phi1 = m.cos(phi1)
+    cos_phi2 = m.cos(phi2)
+
+    half_delta_lambda = m.radians(long2 - long1) / 2
+    sin_half_delta_lambda = m.sin(half_delta_lambda)
+    lat_term = m.sin((phi2 - phi1) / 2) ** 2
+    long_term = sin_half_delta_lambda ** 2
+
+    # Central angles 2 atan2(sqrt(a), sqrt(1 - a)) of the trip and of its two legs
+    a = lat_term + cos_phi1 * cos_phi2 * long_term
+    distance = EARTH_RADIUS_KM * 2 * m.arctan2(m.sqrt(a), m.sqrt(1 - a))
+    a = cos_phi1 ** 2 * long_term
+    manhattan = EARTH_RADIUS_KM * 2 * (m.arctan2(m.sqrt(a), m.sqrt(1 - a))
+                                       + m.arctan2(m.sqrt(lat_term), m.sqrt(1 - lat_term)))
+
+    y = 2 * sin_half_delta_lambda * m.cos(half_delta_lambda) * cos_phi2
+    x = cos_phi1 * m.sin(phi2) - m.sin(phi1) * cos_phi2 * (1 - 2 * long_term)
+    direction = m.degrees(m.arctan2(y, x))
+    return distance, (lat1 + lat2) / 2, (long1 + long2) / 2, manhattan, direction
+
+
+# The math functions under the numpy names used by _geodesic
+_SCALAR_MATH = types.SimpleNamespace(radians=math.radians, degrees=math.degrees, sin=math.sin, cos=math.cos,
+                                     sqrt=math.sqrt, arctan2=math.atan2)
+
+
+# Blocks of block_size rows, bounds the float64 temporaries; outputs in GEO_FEATURES order
+
+def _geodesic_numpy(lat1, long1, lat2, long2, outputs, block_size):
+    for start in range(0, len(lat1), block_size):
+        block = slice(start, start + block_size)
+        values = _geodesic(*(np.asarray(column[block], dtype=np.float64) for column in (lat1, long1, lat2, long2)))
+        for out, value in zip(outputs, values):
+            out[block] = value
+
+
+# One row at a time, so there are no temporaries at all
+
+def _geodesic_rows(lat1, long1, lat2, long2, distance, center_lat, center_long, manhattan, direction):
+    for i in prange(len(lat1)):
+        distance[i], center_lat[i], center_long[i], manhattan[i], direction[i] = _geodesic_row(
+            np.float64(lat1[i]), np.float64(long1[i]), np.float64(lat2[i]), np.float64(long2[i]))
+
+
+# numba.prange and the compiled _geodesic once numba is imported, the kernel is compiled with them
+prange = range
+_geodesic_row = _geodesic
+
+_geodesic_kernel = None
+
+
+def _numba_kernel():
+    global prange, _geodesic_row, _geodesic_kernel
+    if _geodesic_kernel is None:
+        import numba
+
+        prange = numba.prange
+        _geodesic_row = numba.njit(cache=True)(_geodesic)
+        _geodesic_kernel = numba.njit(parallel=True, cache=True)(_geodesic_rows)
+    return _geodesic_kernel
+
+
+# Threads of the numba kernel: NUMBA_NUM_THREADS, which defaults to the number of cores
+
+def _numba_threads():
+    return int(os.environ.get('NUMBA_NUM_THREADS', os.cpu_count() or 1))
+
+
+# Returns a dict with the GEO_FEATURES columns, written into the arrays of `out` (a dict with the
+# same keys) when it is given.
+# engine='auto' uses the parallel numba kernel when numba is installed and there is more than
+# one core to run it on. On a single core numpy's vectorized trig is as fast as the numba loop.
+
+def geodesic_features(lat1, long1, lat2, long2, dtype=np.float32, block_size=GEODESIC_BLOCK_SIZE, engine='auto',
+                      out=None):
+    if engine == 'auto':
+        engine = 'numba' if NUMBA_AVAILABLE and _numba_threads() > 1 else 'numpy'
+    if engine == 'numba' and not NUMBA_AVAILABLE:
+        raise ImportError('numba is not installed, use engine="numpy"')
+    if engine not in ('numba', 'numpy'):
+        raise ValueError('Unknown engine: {}'.format(engine))
+
+    coordinates = [np.asarray(values) for values in (lat1, long1, lat2, long2)]
+    if out is None:
+        outputs = [np.empty(len(coordinates[0]), dtype=dtype) for _ in GEO_FEATURES]
+    else:
+        outputs = [out[column] for column in GEO_FEATURES]
+
+    if engine == 'numba':
+        _numba_kernel()(*coordinates, *outputs)
+    else:
+        _geodesic_numpy(*coordinates, outputs, block_size)
+    return dict(zip(GEO_FEATURES, outputs))
+
+
+#%%
+
+def add_geo_features(df, dtype=np.float32):
+    features = geodesic_features(df['pickup_latitude'].values, df['pickup_longitude'].values,
+                                 df['dropoff_latitude'].values, df['dropoff_longitude'].values, dtype=dtype)
+    for column, values in features.items():
+        df[column] = values
+    return df
+
+
+#%%
+
+# Datetime features computed with integer arithmetic on seconds since 1970-01-01,
+# in one pass and without the per-row Python calls of .map(lambda x: x.total_seconds()).
+# Timestamps are naive local NYC times, same as in the Kaggle/TLC files.
+
+SECONDS_PER_DAY = 86400
+
+
+def epoch_seconds(values):
+    return np.asarray(values).astype('datetime64[s]').view(np.int64)
+
+
+# Year, month and day from days since 1970-01-01, with the proleptic Gregorian calendar
+# (the civil_from_days algorithm of H. Hinnant, years starting in March)
+
+def _civil_from_days(days):
+    z = days + 719468
+    era = z // 146097
+    day_of_era = z - era * 146097
+    year_of_era = (day_of_era - day_of_era // 1460 + day_of_era // 36524 - day_of_era // 146096) // 365
+    day_of_year = day_of_era - (365 * year_of_era + year_of_era // 4 - year_of_era // 100)
+    shifted_month = (5 * day_of_year + 2) // 153
+    day = day_of_year - (153 * shifted_month + 2) // 5 + 1
+    month = np.where(shifted_month < 10, shifted_month + 3, shifted_month - 9)
+    year = year_of_era + era * 400 + (month <= 2)
+    return year, month, day
+
+
+def _days_before_year(year):
+    year = year - 1
+    return 365 * year + year // 4 - year // 100 + year // 400 - 719162
+
+
+# A year has 53 ISO weeks when it starts on a Thursday, or on a Wednesday in a leap year
+
+def _iso_weeks_in_year(year):
+    def weekday_dec_31(y):
+        return (y + y // 4 - y // 100 + y // 400) % 7
+    return 52 + ((weekday_dec_31(year) == 4) | (weekday_dec_31(year - 1) == 3))
+
+
+# month, ISO week, weekday (Monday=0), hour and minute of the day as small integers,
+# same values as the pandas .dt accessors
+
+def datetime_features(pickup_datetime):
+    seconds = epoch_seconds(pickup_datetime)
+    days = seconds // SECONDS_PER_DAY
+    minute_oftheday = (seconds - days * SECONDS_PER_DAY) // 60
+    # 1970-01-01 was a Thursday
+    weekday = (days + 3) % 7
+
+    year, month, _ = _civil_from_days(days)
+    ordinal_day = days - _days_before_year(year) + 1
+    week = (ordinal_day - weekday + 9) // 7
+    # First days of January can belong to the last week of the previous year,
+    # last days of December to week 1 of the next one
+    week = np.where(week < 1, _iso_weeks_in_year(year - 1),
+                    np.where(week > _iso_weeks_in_year(year), 1, week))
+
+    return {
+        'month': month.astype(np.int8),
+        'week': week.astype(np.int8),
+        'weekday': weekday.astype(np.int8),
+        'hour': (minute_oftheday // 60).astype(np.int8),
+        'minute_oftheday': minute_oftheday.astype(np.int16),
+    }
+
+
+# Duration between pickup and dropoff in whole seconds
+
+def trip_duration_seconds(pickup_datetime, dropoff_datetime):
+    return (epoch_seconds(dropoff_datetime) - epoch_seconds(pickup_datetime)).astype(np.int32)
+
+
+# Expects pickup_datetime to be parsed already (see trip_loader.py)
+
+def add_datetime_features(df):
+    for column, values in datetime_features(df['pickup_datetime'].values).items():
+        df[column] = values
+    return df
+
+
+def add_trip_features(df):
+    df = add_geo_features(df)
+    return add_datetime_features(df)
+
+
+#%%
+
+# Index of the closest center of every point, the centers as (longitude, latitude) rows like the
+# KMeans models of the scripts (fitted on pickup_longitude, pickup_latitude), same result as
+# KMeans.predict on float64 points. Distances are computed in float64 one center at a time:
+# no (n_points, n_centers) matrix, and none of the rounding of the expanded |x|^2 - 2 x.c + |c|^2
+# that makes KMeans.predict pick a farther center for ~20% of float32 trips.
+
+def nearest_center(latitudes, longitudes, centers, out=None):
+    latitudes = np.asarray(latitudes, dtype=np.float64)
+    longitudes = np.asarray(longitudes, dtype=np.float64)
+    clusters = np.empty(len(latitudes), dtype=np.int32) if out is None else out
+    clusters[:] = 0
+    best = np.full(len(latitudes), np.inf)
+    for i, (center_longitude, center_latitude) in enumerate(np.asarray(centers, dtype=np.float64)):
+        distances = (longitudes - center_longitude) ** 2 + (latitudes - center_latitude) ** 2
+        closer = distances < best
+        best[closer] = distances[closer]
+        clusters[closer] = i
+    return clusters
+
+
+#%%
+
+# One trip at a time with the math module, for scoring single trips where the overhead of
+# numpy and pandas calls would dominate. Same formulas as geodesic_features (_geodesic) and
+# datetime_features, the values are returned as tuples in GEO_FEATURES / DATETIME_FEATURES order.
+
+def trip_geodesic_features(lat1, long1, lat2, long2):
+    return _geodesic(float(lat1), float(long1), float(lat2), float(long2), _SCALAR_MATH)
+
+
+# pickup_datetime: datetime or 'YYYY-MM-DD HH:MM:SS' string
+
+def trip_datetime_features(pickup_datetime):
+    if isinstance(pickup_datetime, str):
+        pickup_datetime = datetime.fromisoformat(pickup_datetime)
+    return (pickup_datetime.month, pickup_datetime.isocalendar()[1], pickup_datetime.weekday(),
+            pickup_datetime.hour, pickup_datetime.hour * 60 + pickup_datetime.minute)
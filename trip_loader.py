@@ -0,0 +1,73 @@
+#%%
+# Loading the taxi trip files (Kaggle train.csv / test.csv or a month of TLC data)
+# with a fixed schema instead of letting pandas guess float64/object for every column.
+#
+# float32 is plenty for GPS coordinates (~0.5 m resolution around New York),
+# the small integer columns fit in int8, and the store_and_fwd_flag only has 2 values.
+
+import pandas as pd
+
+
+DATETIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+DATETIME_COLUMNS = ['pickup_datetime', 'dropoff_datetime']
+
+COORDINATE_COLUMNS = ['pickup_longitude', 'pickup_latitude', 'dropoff_longitude', 'dropoff_latitude']
+
+STORE_AND_FWD_DTYPE = pd.CategoricalDtype(categories=['N', 'Y'])
+
+TRIP_DTYPES = {
+    'id': str,
+    'vendor_id': 'int8',
+    'passenger_count': 'int8',
+    'pickup_longitude': 'float32',
+    'pickup_latitude': 'float32',
+    'dropoff_longitude': 'float32',
+    'dropoff_latitude': 'float32',
+    'store_and_fwd_flag': STORE_AND_FWD_DTYPE,
+    'trip_duration': 'int32',
+}
+
+# Number of rows per frame when streaming a file
+DEFAULT_CHUNKSIZE = 500_000
+
+
+#%%
+
+# Datetime columns are read as plain strings and then parsed with the fixed format,
+# which is much faster than letting pandas infer the format row by row.
+# test.csv has no dropoff_datetime, so only the columns present are parsed.
+
+def parse_trip_datetimes(data):
+    for column in DATETIME_COLUMNS:
+        if column in data.columns:
+            data[column] = pd.to_datetime(data[column], format=DATETIME_FORMAT)
+    return data
+
+
+def _read_csv_kwargs(usecols):
+    dtypes = dict(TRIP_DTYPES)
+    for column in DATETIME_COLUMNS:
+        dtypes[column] = str
+    if usecols is not None:
+        dtypes = {column: dtype for column, dtype in dtypes.items() if column in usecols}
+    return dict(dtype=dtypes, usecols=usecols)
+
+
+#%%
+
+# Reads the whole file into a single typed frame
+
+def load_trips(path, usecols=None):
+    data = pd.read_csv(path, **_read_csv_kwargs(usecols))
+    return parse_trip_datetimes(data)
+
+
+# Streams the file as typed frames of at most `chunksize` rows, so the rest of the
+# pipeline never needs the whole file in memory.
+# The row index keeps counting across chunks, same as with load_trips.
+
+def iter_trips(path, chunksize=DEFAULT_CHUNKSIZE, usecols=None):
+    with pd.read_csv(path, chunksize=chunksize, **_read_csv_kwargs(usecols)) as reader:
+        for chunk in reader:
+            yield parse_trip_datetimes(chunk)
@@ -0,0 +1,217 @@
+#%%
+# The steps of new_main.py as a DAG of pipeline_dag.py stages, so changing one parameter only
+# reruns what depends on it (e.g. a new n_clusters reruns the clustering, encoding, power
+# transform, clipping, models and evaluation, but not the loading, features and filtering).
+#
+#   load -> geodesic_features -> datetime_features -> filtered -> split -> clusters -> encoded
+#        -> power_transformer -> transformed -> clipper -> clipped -> train_<model> -> evaluation
+#   load -> duplicates -> filtered (row numbers of the repeated trips, dropped before the filters)
+#   filtered -> density_plots (in parallel with the modeling branch)
+#
+# Unlike the script, everything fitted (cluster centers, Yeo-Johnson lambdas, IQR limits) is
+# fitted on the training rows only and applied to all of them. Every stage returns a new
+# frame or object, its inputs are read-only.
+#
+#   python trip_pipeline.py train.csv [--models catboost xgboost] [--n-clusters 10] [--jobs 2]
+#   python trip_pipeline.py train.csv --status
+
+import argparse
+import importlib
+import os
+
+import numpy as np
+
+import trip_features
+from density_plots import report_curves, write_report
+from model_benchmark import MODEL_FAMILIES, regression_metrics
+from Outliers_detection import Clipper
+from pipeline_dag import PIPELINE_CACHE_DIR, Pipeline, Stage
+from power_transform import YeoJohnson, yeo_johnson_inverse
+from preprocessing_pipeline import CATEGORICAL_FEATURES, CLIPPED_FEATURES, TARGET
+from row_filters import trip_row_filter
+from trip_duplicates import duplicate_index
+from trip_loader import load_trips
+
+
+DEFAULT_MODELS = ['linear_regression', 'catboost', 'xgboost']
+
+# Columns that are not model features
+NON_FEATURES = ['id', 'pickup_datetime', 'dropoff_datetime', TARGET]
+
+# Not power transformed: one-hot and cluster columns
+UNTRANSFORMED_PREFIXES = tuple(CATEGORICAL_FEATURES) + ('pickup_cluster',)
+
+
+#%%
+
+# Stages: pure functions of the outputs of other stages and of their parameters
+
+def load(path):
+    return load_trips(path)
+
+
+def geodesic_features(trips):
+    features = trip_features.geodesic_features(trips['pickup_latitude'].values, trips['pickup_longitude'].values,
+                                               trips['dropoff_latitude'].values, trips['dropoff_longitude'].values)
+    return trips.assign(**features)
+
+
+def datetime_features(trips):
+    return trips.assign(**trip_features.datetime_features(trips['pickup_datetime'].values))
+
+
+# Row numbers of the trips repeating an earlier one on columns (all when None)
+
+def duplicates(trips, columns):
+    return trips.index.get_indexer(duplicate_index(trips, columns))
+
+
+def filtered(trips, duplicate_rows):
+    if len(duplicate_rows):
+        trips = trips.drop(index=trips.index[duplicate_rows])
+    return trip_row_filter().apply(trips)
+
+
+# Boolean mask of the test rows
+
+def split(trips, test_size, random_state):
+    rng = np.random.default_rng(random_state)
+    is_test = np.zeros(len(trips), dtype=bool)
+    is_test[rng.choice(len(trips), size=int(round(test_size * len(trips))), replace=False)] = True
+    return is_test
+
+
+# KMeans centers of the training pickups, as (longitude, latitude) rows
+
+def clusters(trips, is_test, n_clusters, random_state, sample_size=200_000):
+    from sklearn.cluster import KMeans
+
+    points = np.column_stack([trips['pickup_longitude'].values, trips['pickup_latitude'].values])[~is_test]
+    points = points.astype(np.float64)
+    if len(points) > sample_size:
+        points = points[np.random.default_rng(random_state).choice(len(points), size=sample_size, replace=False)]
+    return KMeans(n_clusters=n_clusters, n_init=1, random_state=random_state).fit(points).cluster_centers_
+
+
+# Model features and the target: one-hot categoricals, pickup cluster, no ids or datetimes
+
+def encoded(trips, centers):
+    import pandas as pd
+
+    features = {column: trips[column].values for column in trips.columns
+                if column not in NON_FEATURES and column not in CATEGORICAL_FEATURES}
+    for column, categories in CATEGORICAL_FEATURES.items():
+        values = trips[column].astype(str).values
+        for category in categories:
+            features['{}_{}'.format(column, category)] = (values == str(category)).astype(np.int8)
+    features['pickup_cluster'] = trip_features.nearest_center(trips['pickup_latitude'].values,
+                                                              trips['pickup_longitude'].values, centers)
+    features[TARGET] = trips[TARGET].values
+    return pd.DataFrame(features)
+
+
+def _transformed_columns(data):
+    return [column for column in data.columns if not column.startswith(UNTRANSFORMED_PREFIXES)]
+
+
+def power_transformer(data, is_test, random_state):
+    columns = _transformed_columns(data)
+    return YeoJohnson(random_state=random_state).fit(data.loc[~is_test, columns])
+
+
+def transformed(data, transformer):
+    columns = _transformed_columns(data)
+    return data.assign(**dict(zip(columns, np.asarray(transformer.transform(data[columns])).T)))
+
+
+def clipper(data, is_test, fold):
+    return Clipper(CLIPPED_FEATURES, fold=fold).fit(data[~is_test])
+
+
+def clipped(data, fitted_clipper):
+    return fitted_clipper.transform(data.copy(), columns=CLIPPED_FEATURES)
+
+
+def train_model(data, is_test, family):
+    module, class_name, params, _ = MODEL_FAMILIES[family]
+    model = getattr(importlib.import_module(module), class_name)(**params)
+    train = data[~is_test]
+    return model.fit(train.drop(columns=TARGET), train[TARGET])
+
+
+# RMSE and RMSLE in seconds of every model on the test rows
+
+def evaluation(data, is_test, transformer, *models):
+    import pandas as pd
+
+    target_lambda = transformer.lambdas_[_transformed_columns(data).index(TARGET)]
+    test = data[is_test]
+    y_test = yeo_johnson_inverse(test[TARGET].to_numpy(dtype=np.float64), target_lambda)
+    rows = []
+    for model in models:
+        predictions = yeo_johnson_inverse(np.asarray(model.predict(test.drop(columns=TARGET)), dtype=np.float64),
+                                          target_lambda)
+        rmse, rmsle = regression_metrics(y_test, predictions)
+        rows.append({'model': type(model).__name__, 'rmse': rmse, 'rmsle': rmsle})
+    return pd.DataFrame(rows)
+
+
+def density_plots(trips, output_dir):
+    return write_report(report_curves(trips), output_dir, formats=('png',))
+
+
+#%%
+
+def trip_pipeline(path, models=DEFAULT_MODELS, n_clusters=10, test_size=0.33, fold=1.5, random_state=42,
+                  plots_dir='reports', cache_dir=PIPELINE_CACHE_DIR, duplicate_columns=None):
+    stages = [
+        Stage('load', load, params={'path': path}, files=[path]),
+        Stage('geodesic_features', geodesic_features, ['load']),
+        Stage('datetime_features', datetime_features, ['geodesic_features']),
+        Stage('duplicates', duplicates, ['load'], {'columns': duplicate_columns}),
+        Stage('filtered', filtered, ['datetime_features', 'duplicates']),
+        Stage('split', split, ['filtered'], {'test_size': test_size, 'random_state': random_state}),
+        Stage('clusters', clusters, ['filtered', 'split'], {'n_clusters': n_clusters, 'random_state': random_state}),
+        Stage('encoded', encoded, ['filtered', 'clusters']),
+        Stage('power_transformer', power_transformer, ['encoded', 'split'], {'random_state': random_state}),
+        Stage('transformed', transformed, ['encoded', 'power_transformer']),
+        Stage('clipper', clipper, ['transformed', 'split'], {'fold': fold}),
+        Stage('clipped', clipped, ['transformed', 'clipper']),
+    ]
+    stages += [Stage('train_' + family, train_model, ['clipped', 'split'], {'family': family}) for family in models]
+    stages.append(Stage('evaluation', evaluation, ['clipped', 'split', 'power_transformer'] +
+                        ['train_' + family for family in models]))
+    if plots_dir:
+        stages.append(Stage('density_plots', density_plots, ['filtered'], {'output_dir': plots_dir}))
+    return Pipeline(stages, cache_dir)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Trip duration pipeline with cached stages')
+    parser.add_argument('input', help='CSV file with the trips and their trip_duration')
+    parser.add_argument('--models', nargs='+', choices=list(MODEL_FAMILIES), default=DEFAULT_MODELS)
+    parser.add_argument('--n-clusters', type=int, default=10)
+    parser.add_argument('--test-size', type=float, default=0.33)
+    parser.add_argument('--fold', type=float, default=1.5)
+    parser.add_argument('--duplicate-columns', nargs='+', help='columns of the duplicate trips (default: all)')
+    parser.add_argument('--plots-dir', default='reports', help='density plots written there ("" for none)')
+    parser.add_argument('--cache-dir', default=PIPELINE_CACHE_DIR)
+    parser.add_argument('--jobs', type=int, default=1, help='stages run in parallel processes')
+    parser.add_argument('--force', nargs='*', default=[], help='stages rerun even when cached')
+    parser.add_argument('--status', action='store_true', help='only show which stages would run')
+    args = parser.parse_args(argv)
+
+    pipeline = trip_pipeline(os.path.abspath(args.input), args.models, args.n_clusters, args.test_size, args.fold,
+                             plots_dir=args.plots_dir, cache_dir=args.cache_dir,
+                             duplicate_columns=args.duplicate_columns)
+    targets = ['evaluation'] + (['density_plots'] if args.plots_dir else [])
+    if args.status:
+        for name, status in pipeline.status(targets).items():
+            print('{:<24} {}'.format(name, status))
+        return
+    outputs = pipeline.run(targets, n_jobs=args.jobs, force=args.force)
+    print(outputs['evaluation'])
+
+
+if __name__ == '__main__':
+    main()
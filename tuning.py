@@ -0,0 +1,223 @@
+#%%
+# Hyperparameter search for XGBoost with successive halving (asynchronous, ASHA style),
+# replacing RandomizedSearchCV(XGBRegressor(n_jobs=n_cores), n_jobs=n_cores, cv=5).
+#
+#   - The cores are split explicitly: n_parallel trials run at the same time, each model
+#     trains with n_cores // n_parallel threads (RandomizedSearchCV with n_jobs=n_cores around
+#     a model with n_jobs=n_cores asks for n_cores^2 threads).
+#   - The number of boosting rounds is the resource: every configuration is first trained for
+#     min_rounds rounds, and only the best 1/eta of each rung is trained further (eta times
+#     more rounds, continuing from the boosters already trained), up to max_rounds.
+#     Poor configurations stop early instead of training to completion on every fold.
+#   - The folds are built once as QuantileDMatrix (the quantile sketch of the features is
+#     computed once per fold, not once per fit) and shared by all the trials.
+#   - Every finished rung of a trial is appended to a JSON lines log; a search started again
+#     with the same log skips the work already done. The first line of the log is the
+#     fingerprint of the search (shape and hash of X and y, folds, rungs, random_state, base
+#     params): a log of a search on other data or settings is rejected (stale_log='raise'), or
+#     moved aside to <log_path>.stale and the search starts over (stale_log='restart').
+#     Trials of the log beyond n_trials are ignored, so a search can be resumed with fewer.
+
+import hashlib
+import json
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import numpy as np
+import pandas as pd
+from joblib import cpu_count
+from sklearn.model_selection import KFold, ParameterSampler
+
+
+# Threads per model when n_parallel is not given
+THREADS_PER_TRIAL = 4
+
+
+#%%
+
+# Rounds of each rung: max_rounds, max_rounds / eta, max_rounds / eta^2... down to min_rounds
+
+def halving_rungs(min_rounds, max_rounds, eta):
+    rungs = [max_rounds]
+    while rungs[-1] // eta >= min_rounds:
+        rungs.append(rungs[-1] // eta)
+    return rungs[::-1]
+
+
+def rmse(y_true, y_pred):
+    return float(np.sqrt(np.mean((np.asarray(y_true, dtype=np.float64) - y_pred) ** 2)))
+
+
+def _to_json(value):
+    return value.item() if isinstance(value, np.generic) else value
+
+
+def array_digest(values):
+    values = np.ascontiguousarray(values)
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(str((values.dtype.str, values.shape)).encode())
+    digest.update(memoryview(values).cast('B'))
+    return digest.hexdigest()
+
+
+#%%
+
+# param_distributions: same as RandomizedSearchCV (lists or scipy.stats distributions) with
+# XGBoost parameters, e.g. {'learning_rate': uniform(0.01, 0.2), 'max_depth': randint(3, 10)}.
+# The number of trees is not sampled, it is the resource of the halving (max_rounds at most).
+
+class HalvingSearch:
+
+    def __init__(self, param_distributions, n_trials=20, min_rounds=20, max_rounds=200, eta=3, n_folds=5,
+                 n_jobs=-1, n_parallel=None, log_path=None, random_state=123, base_params=None, stale_log='raise'):
+        if 'n_estimators' in param_distributions:
+            raise ValueError('n_estimators is the resource of the halving, set max_rounds instead')
+        if stale_log not in ('raise', 'restart'):
+            raise ValueError("stale_log must be 'raise' or 'restart', got {!r}".format(stale_log))
+        self.param_distributions = param_distributions
+        self.n_trials = n_trials
+        self.min_rounds = min_rounds
+        self.max_rounds = max_rounds
+        self.eta = eta
+        self.n_folds = n_folds
+        self.n_jobs = n_jobs
+        self.n_parallel = n_parallel
+        self.log_path = log_path
+        self.random_state = random_state
+        self.base_params = dict(base_params or {})
+        self.stale_log = stale_log
+        self.rungs = halving_rungs(min_rounds, max_rounds, eta)
+
+    def _cores(self):
+        n_cores = cpu_count() if self.n_jobs is None or self.n_jobs < 1 else self.n_jobs
+        n_parallel = self.n_parallel or max(1, n_cores // THREADS_PER_TRIAL)
+        n_parallel = min(n_parallel, n_cores, self.n_trials)
+        return n_cores, n_parallel, max(1, n_cores // n_parallel)
+
+    # What the scores of the log depend on, besides the sampled params of each trial
+
+    def fingerprint(self, X, y):
+        return {'X_shape': list(X.shape), 'X_digest': array_digest(X), 'y_shape': list(y.shape),
+                'y_digest': array_digest(y), 'n_folds': self.n_folds, 'rungs': self.rungs,
+                'random_state': self.random_state,
+                'base_params': {name: _to_json(value) for name, value in sorted(self.base_params.items())}}
+
+    def _read_log(self, fingerprint):
+        scores = {}
+        if not self.log_path:
+            return scores
+        if os.path.exists(self.log_path):
+            with open(self.log_path) as f:
+                lines = [json.loads(line) for line in f if line.strip()]
+            if lines and lines[0].get('fingerprint') != fingerprint:
+                if self.stale_log == 'raise':
+                    raise ValueError('{} was written by a search on other data or settings, remove it or pass '
+                                     "stale_log='restart'".format(self.log_path))
+                os.replace(self.log_path, self.log_path + '.stale')
+                lines = []
+            for entry in lines[1:]:
+                if entry['trial'] >= len(self.params_):
+                    # Trial of a search with a larger n_trials
+                    continue
+                if entry['params'] != self.params_[entry['trial']]:
+                    raise ValueError('{} was written by a search with other parameters'.format(self.log_path))
+                scores[(entry['trial'], entry['rounds'])] = entry['rmse']
+            if lines:
+                return scores
+        with open(self.log_path, 'w') as f:
+            f.write(json.dumps({'fingerprint': fingerprint}) + '\n')
+        return scores
+
+    def _log(self, entry):
+        if self.log_path:
+            with self._log_lock, open(self.log_path, 'a') as f:
+                f.write(json.dumps(entry) + '\n')
+
+    # Next (trial, rung index) to train: the best trial of the highest rung that has one to
+    # promote, else a new trial on the first rung, else None
+
+    def _next_job(self, scores, running):
+        for k in range(len(self.rungs) - 2, -1, -1):
+            done = sorted((score, trial) for (trial, rounds), score in scores.items() if rounds == self.rungs[k])
+            for _, trial in done[:len(done) // self.eta]:
+                job = (trial, k + 1)
+                if (trial, self.rungs[k + 1]) not in scores and job not in running:
+                    return job
+        for trial in range(self.n_trials):
+            if (trial, self.rungs[0]) not in scores and (trial, 0) not in running:
+                return (trial, 0)
+        return None
+
+    def _train(self, trial, k, folds, nthread):
+        import xgboost as xgb
+
+        start = time.perf_counter()
+        params = dict(self.base_params, **self.params_[trial], nthread=nthread, seed=self.random_state)
+        rounds = self.rungs[k]
+        fold_scores = []
+        for fold, (dtrain, dvalid, y_valid) in enumerate(folds):
+            previous = self._boosters.get((trial, fold))
+            done = previous.num_boosted_rounds() if previous is not None else 0
+            booster = xgb.train(params, dtrain, num_boost_round=rounds - done, xgb_model=previous)
+            self._boosters[(trial, fold)] = booster
+            fold_scores.append(rmse(y_valid, booster.predict(dvalid)))
+        entry = {'trial': trial, 'params': self.params_[trial], 'rounds': rounds, 'rmse': float(np.mean(fold_scores)),
+                 'fold_rmse': fold_scores, 'seconds': time.perf_counter() - start}
+        self._log(entry)
+        return entry
+
+    def fit(self, X, y):
+        import xgboost as xgb
+
+        start = time.perf_counter()
+        X = np.ascontiguousarray(X, dtype=np.float32)
+        y = np.asarray(y, dtype=np.float64)
+        n_cores, n_parallel, nthread = self._cores()
+
+        sampler = ParameterSampler(self.param_distributions, self.n_trials, random_state=self.random_state)
+        self.params_ = [{name: _to_json(value) for name, value in params.items()} for params in sampler]
+        self._boosters = {}
+        self._log_lock = threading.Lock()
+        scores = self._read_log(self.fingerprint(X, y))
+
+        folds = []
+        for train, valid in KFold(self.n_folds, shuffle=True, random_state=self.random_state).split(X):
+            dtrain = xgb.QuantileDMatrix(X[train], y[train], nthread=n_cores)
+            folds.append((dtrain, xgb.QuantileDMatrix(X[valid], ref=dtrain, nthread=n_cores), y[valid]))
+
+        running = {}
+        with ThreadPoolExecutor(max_workers=n_parallel) as executor:
+            while True:
+                while len(running) < n_parallel:
+                    job = self._next_job(scores, set(running.values()))
+                    if job is None:
+                        break
+                    running[executor.submit(self._train, *job, folds, nthread)] = job
+                if not running:
+                    break
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    del running[future]
+                    entry = future.result()
+                    scores[(entry['trial'], entry['rounds'])] = entry['rmse']
+
+        self.trials_ = pd.DataFrame([{'trial': trial, 'rounds': rounds, 'rmse': score, **self.params_[trial]}
+                                     for (trial, rounds), score in scores.items()]).sort_values(['rounds', 'rmse'])
+        best_trial, self.best_rounds_ = min(scores, key=scores.get)
+        self.best_score_ = scores[(best_trial, self.best_rounds_)]
+        self.best_params_ = dict(self.params_[best_trial])
+        self.search_seconds_ = time.perf_counter() - start
+        # Rounds trained per fold, against n_trials * max_rounds for a full search
+        self.trained_rounds_ = sum(self.trials_.groupby('trial')['rounds'].max())
+        del self._boosters
+
+        self.best_estimator_ = xgb.XGBRegressor(**self.base_params, **self.best_params_, n_estimators=self.best_rounds_,
+                                                n_jobs=n_cores, random_state=self.random_state)
+        self.best_estimator_.fit(X, y)
+        self.total_seconds_ = time.perf_counter() - start
+        return self
+
+    def predict(self, X):
+        return self.best_estimator_.predict(np.asarray(X, dtype=np.float32))